@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+dem stages: CopernicusDEM single-point and batch sampling
+
+Tiles are small generated GeoTIFFs with Copernicus tile names, covering
+the test flights, in a temporary directory. Needs the dem requirements.
+"""
+
+import atexit
+import math
+import shutil
+import tempfile
+from pathlib import Path
+
+from common import igc_files, service_app, track_points
+from harness import Stage, emit
+
+service_app("dem")
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from copernicus_dem import CopernicusDEM
+
+# pixels per degree of the fixtures, real tiles have 3600
+FIXTURE_RESOLUTION = 360
+
+
+def tile_name(lat0, lon0):
+    """Copernicus file name of the tile with lower-left corner lat0/lon0"""
+    ns = "N" if lat0 >= 0 else "S"
+    ew = "E" if lon0 >= 0 else "W"
+    return (f"Copernicus_DSM_COG_10_{ns}{abs(lat0):02d}_00_"
+            f"{ew}{abs(lon0):03d}_00_DEM.tif")
+
+
+def make_tiles(points, tiles_dir):
+    """One synthetic 1x1 degree tile per tile touched by points"""
+    n = FIXTURE_RESOLUTION
+    rng = np.random.default_rng(0)
+    for lat0, lon0 in {(math.floor(lat), math.floor(lon))
+                       for lat, lon in points}:
+        elevation = rng.uniform(0, 4000, (n, n)).astype("float32")
+        with rasterio.open(
+                Path(tiles_dir) / tile_name(lat0, lon0), "w",
+                driver="GTiff", height=n, width=n, count=1,
+                dtype="float32", crs="EPSG:4326", nodata=-32767.0,
+                transform=from_origin(lon0, lat0 + 1, 1 / n, 1 / n)) as tile:
+            tile.write(elevation, 1)
+
+
+def stages():
+    tiles_dir = tempfile.mkdtemp(prefix="bench_dem_")
+    atexit.register(shutil.rmtree, tiles_dir, ignore_errors=True)
+
+    points = track_points(igc_files()[-1])
+    make_tiles(points, tiles_dir)
+    coords = [(lon, lat) for lat, lon in points]
+
+    # tiles stay open across repetitions, as in the service
+    dem = CopernicusDEM(tiles_dir)
+    return [
+        Stage("dem.single",
+              lambda: [dem.get_elevation(lat, lon) for lat, lon in points]),
+        Stage("dem.batch", lambda: dem.get_elevations_batch(coords)),
+    ]
+
+
+if __name__ == "__main__":
+    emit(stages)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+geolookup queries: NamedTakeoff, CountryState, NearestTown
+
+Queried at the takeoff of every test flight. Needs the geolookup
+requirements and the data files of service/geolookup/app/data, skipped
+when these are missing.
+
+geolookup.takeoff_scan is the former NamedTakeoff.query, a distance
+scan over all spots in EPSG:3857, for comparison with the KD-tree.
+geolookup.admin1_scan is the former CountryState.query, a pandas
+contains over the R-tree candidates, geolookup.admin1 uses the grid.
+geolookup.batch runs all three lookups over all points in bulk, as
+POST /batch does.
+"""
+
+import numpy as np
+
+from common import service_app, takeoff_points
+from harness import Skip, Stage, emit
+
+app = service_app("geolookup")
+
+DATA = {
+    "takeoff": app / "data" / "paraglidingearth" / "pgEarthSpots.json",
+    "admin1" : app / "data" / "ne_10m_admin_1_states_provinces" /
+               "ne_10m_admin_1_states_provinces.shp",
+}
+
+
+def stages():
+    for name, path in DATA.items():
+        if not path.is_file():
+            raise Skip(f"{name} data {path} not found")
+    import geopandas as gpd
+    from shapely.geometry import Point
+    from named_takeoff import NamedTakeoff
+    from country_state import CountryState
+    from nearest_town import NearestTown
+
+    points = takeoff_points()
+    lat = np.array([p[0] for p in points])
+    lon = np.array([p[1] for p in points])
+    takeoff, state, town = NamedTakeoff(), CountryState(), NearestTown()
+
+    def each(query, *args):
+        return lambda: [query(lat, lon, *args) for lat, lon in points]
+
+    spots = takeoff.gdf.to_crs(epsg=3857)
+
+    def scan(lat, lon, search_radius):
+        point = gpd.GeoSeries([Point(lon, lat)], crs="EPSG:4326")
+        distance = spots.geometry.distance(point.to_crs(epsg=3857).iloc[0])
+        nearby = spots[distance <= search_radius]
+        return nearby.iloc[distance[distance <= search_radius].argsort()]
+
+    def admin1_scan(lat, lon):
+        point = Point(lon, lat)
+        candidates = state.gdf.iloc[list(state.sindex.intersection(
+            point.bounds))]
+        return candidates[candidates.contains(point)]
+
+    return [
+        Stage("geolookup.takeoff_scan", each(scan, 1000)),
+        Stage("geolookup.takeoff", each(takeoff.query, 1000)),
+        Stage("geolookup.takeoff_k10", each(takeoff.nearest, 50000, 10)),
+        Stage("geolookup.admin1_scan", each(admin1_scan)),
+        Stage("geolookup.admin1", each(state.query)),
+        Stage("geolookup.nearest_town", each(town.query)),
+        Stage("geolookup.batch", lambda: (
+            takeoff.query_many(lat, lon, 1000),
+            town.query_many(lat, lon),
+            state.query_many(lat, lon))),
+    ]
+
+
+if __name__ == "__main__":
+    emit(stages)
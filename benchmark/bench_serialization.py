@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+xcmetrics response serialization, before/after
+
+before: igc_lib JSON strings decoded with json.loads, whole tree encoded
+        again by fastapi's JSONResponse (stdlib json)
+after : igc_lib JSON strings spliced as is, track_points encoded by
+        orjson (analysis.render)
+
+Needs the xcmetrics requirements, run from the repository root:
+    python benchmark/bench_serialization.py [igc file] [repetitions]
+"""
+
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / "service" / "shared"))
+sys.path.insert(0, str(root / "service" / "xcmetrics" / "app"))
+from analysis import flight_from_bytes, igcLibCfg, RawJSON, render
+
+
+def before(flight):
+    result = {
+        "info"        : json.loads(flight.flight_summary()),
+        "glides"      : json.loads(flight.glides_to_gdf()),
+        "thermals"    : json.loads(flight.thermals_to_gdf()),
+        "track_points": flight.timeseries().get('track_points'),
+    }
+    # fastapi JSONResponse.render
+    return json.dumps(
+        result,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def after(flight):
+    return render({
+        "info"        : RawJSON(flight.flight_summary()),
+        "glides"      : RawJSON(flight.glides_to_gdf()),
+        "thermals"    : RawJSON(flight.thermals_to_gdf()),
+        "track_points": flight.timeseries().get('track_points'),
+    })
+
+
+def timeit(fn, flight, repetitions):
+    """per-call seconds, list"""
+    out = []
+    for _ in range(repetitions):
+        t0 = time.perf_counter()
+        fn(flight)
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def main():
+    igc = Path(sys.argv[1]) if len(sys.argv) > 1 else \
+        root / "test" / "testdata" / "valid_xctrack.igc"
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    flight = flight_from_bytes(igc.read_bytes(), igcLibCfg)
+    # igc_lib's own summary/GeoJSON/timeseries generation is part of both
+    # paths and identical, exclude it from the comparison
+    summary = flight.flight_summary()
+    glides = flight.glides_to_gdf()
+    thermals = flight.thermals_to_gdf()
+    timeseries = flight.timeseries()
+    flight.flight_summary = lambda: summary
+    flight.glides_to_gdf = lambda: glides
+    flight.thermals_to_gdf = lambda: thermals
+    flight.timeseries = lambda: timeseries
+
+    old, new = before(flight), after(flight)
+    assert json.loads(old) == json.loads(new), "outputs differ"
+
+    print(f"{igc.name}: {len(timeseries['track_points'])} track points, "
+          f"{len(old)} bytes")
+    results = {}
+    for name, fn in (("before", before), ("after", after)):
+        t = timeit(fn, flight, repetitions)
+        results[name] = statistics.median(t)
+        print(f"  {name:6s} median {1e3 * statistics.median(t):8.2f} ms"
+              f"   min {1e3 * min(t):8.2f} ms")
+    print(f"  speedup {results['before'] / results['after']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
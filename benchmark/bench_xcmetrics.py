@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+xcmetrics stages: parse, segmentation (per engine), serialization
+
+Input is the largest flight of test/testdata. Needs the xcmetrics
+requirements.
+"""
+
+from common import igc_files, service_app
+from harness import Stage, emit
+
+service_app("xcmetrics")
+from analysis import (IgcParser, ENGINES, FORMATS, igcLibCfg,
+                      track_analysis, render)
+
+
+def stages():
+    data = igc_files()[-1].read_bytes()
+
+    def parse(data=data):
+        parser = IgcParser()
+        parser.feed(data)
+        parser.close()
+        return parser
+
+    # igc_lib annotates the fixes, every segmentation gets fresh ones
+    out = [Stage("xcmetrics.parse", parse)]
+    for engine in ENGINES:
+        out.append(Stage(
+            f"xcmetrics.segment.{engine}",
+            lambda parser, engine=engine: parser.flight(igcLibCfg,
+                                                        engine=engine),
+            setup=lambda: (parse(),)))
+
+    result = track_analysis(data)
+    for fmt in FORMATS:
+        out.append(Stage(f"xcmetrics.serialize.{fmt}",
+                         lambda fmt=fmt: render(result, fmt)))
+    return out
+
+
+if __name__ == "__main__":
+    emit(stages)
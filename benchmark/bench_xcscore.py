@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+xcscore stages of igc_xc_score(): process spawn, solve, post-process,
+and the whole call with a fresh vs. a pre-started (ScorerPool) process,
+fix decimation and the call on the decimated flight, and the in-process
+numpy scorer on the same flight
+
+spawn is a process start and exit without a flight. Needs the
+igc-xc-score binary next to the wrapper, skipped otherwise.
+"""
+
+import atexit
+import copy
+import os
+import time
+
+from common import igc_files, service_app
+from harness import Skip, Stage, emit
+
+service_app("xcscore")
+from igc_xc_score_wrapper import (scorer_program, spawn, solve, postprocess,
+                                  igc_xc_score)
+from scorer_pool import ScorerPool
+from decimate import decimate
+from numpy_scorer import numpy_xc_score
+
+# decimation of the decimated stages, meters
+TOLERANCE = 10
+
+
+def stages():
+    if not os.path.isfile(scorer_program()[0]):
+        raise Skip(f"{scorer_program()[0]} not found")
+    # igc-xc-score takes seconds on long flights, use the shortest
+    data = igc_files()[0].read_bytes()
+
+    def start_exit():
+        process = spawn()
+        process.communicate(input=b"")
+
+    raw = solve(spawn(), data)
+    decimated, _, _ = decimate(data, TOLERANCE)
+
+    pool = ScorerPool(1, max_idle=3600)
+    atexit.register(pool.shutdown)
+
+    def ready():
+        # the replacement is started in the background, not timed
+        while not pool.idle:
+            time.sleep(0.01)
+        return ()
+
+    return [
+        Stage("xcscore.spawn", start_exit),
+        Stage("xcscore.solve", solve,
+              setup=lambda: (spawn(), data), repeat=5),
+        Stage("xcscore.postprocess", postprocess,
+              setup=lambda: (copy.deepcopy(raw),)),
+        Stage("xcscore.score", igc_xc_score, setup=lambda: (data,),
+              repeat=10),
+        Stage("xcscore.score_pooled",
+              lambda: igc_xc_score(data, pool.acquire), setup=ready,
+              repeat=10),
+        Stage("xcscore.decimate", decimate,
+              setup=lambda: (data, TOLERANCE)),
+        Stage("xcscore.score_decimated", igc_xc_score,
+              setup=lambda: (decimated,), repeat=10),
+        Stage("xcscore.score_numpy", numpy_xc_score, setup=lambda: (data,),
+              repeat=10),
+    ]
+
+
+if __name__ == "__main__":
+    emit(stages)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Paths shared by the per-service benchmarks."""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+TESTDATA = ROOT / "test" / "testdata"
+
+
+def service_app(name):
+    """Make service/<name>/app importable, returns its path
+
+    The services are not packages and use top-level module names (main,
+    config, ...), so only one service can be imported per process.
+    """
+    path = ROOT / "service" / name / "app"
+    # modules shared by the services, e.g. metrics
+    sys.path.insert(0, str(ROOT / "service" / "shared"))
+    sys.path.insert(0, str(path))
+    return path
+
+
+def igc_files():
+    """Valid igc files of test/testdata, smallest first"""
+    files = [p for p in TESTDATA.iterdir()
+             if p.suffix.lower() == ".igc" and p.stat().st_size > 0]
+    return sorted(files, key=lambda p: p.stat().st_size)
+
+
+def _b_record_latlon(line):
+    """lat, lon degrees of an igc B record, BHHMMSSDDMMmmmNDDDMMmmmE..."""
+    lat = int(line[7:9]) + int(line[9:14]) / 60000
+    lon = int(line[15:18]) + int(line[18:23]) / 60000
+    if line[14] == "S":
+        lat = -lat
+    if line[23] == "W":
+        lon = -lon
+    return lat, lon
+
+
+def track_points(path, step=1):
+    """(lat, lon) of every step-th B record of an igc file"""
+    with open(path, encoding="ISO-8859-1") as f:
+        lines = [line for line in f if line.startswith("B")]
+    return [_b_record_latlon(line) for line in lines[::step]]
+
+
+def takeoff_points():
+    """(lat, lon) of the first fix of every test flight"""
+    return [track_points(p)[0] for p in igc_files()]
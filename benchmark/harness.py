@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness: stage timings, percentiles, memory peaks, baseline.
+
+A stage is a callable timed over a number of repetitions, with an
+optional untimed setup that produces its arguments (e.g. fresh fixes,
+since igc_lib mutates them). Memory peaks come from a separate run under
+tracemalloc, which would otherwise distort the timings.
+"""
+
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+
+
+class Skip(Exception):
+    """Stage or service cannot run here, e.g. missing data or binary"""
+
+
+class Stage:
+
+    def __init__(self, name, fn, setup=None, repeat=20, warmup=1):
+        """
+        Args:
+            name: "<service>.<stage>"
+            fn: callable, timed
+            setup: callable returning a tuple of arguments for fn, untimed
+            repeat: timed repetitions
+            warmup: untimed repetitions before
+        """
+        self.name = name
+        self.fn = fn
+        self.setup = setup or tuple
+        self.repeat = repeat
+        self.warmup = warmup
+
+    def _call(self):
+        args = self.setup()
+        gc.collect()
+        t0 = time.perf_counter()
+        self.fn(*args)
+        return time.perf_counter() - t0
+
+    def run(self):
+        """dict of p50/p90/p99/mean in ms and peak memory in MiB"""
+        for _ in range(self.warmup):
+            self._call()
+        times = sorted(1e3 * self._call() for _ in range(self.repeat))
+
+        args = self.setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            self.fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "p50"     : percentile(times, 50),
+            "p90"     : percentile(times, 90),
+            "p99"     : percentile(times, 99),
+            "mean"    : statistics.fmean(times),
+            "peak_mib": peak / 2**20,
+            "n"       : len(times),
+        }
+
+
+def percentile(sorted_values, q):
+    """Linear interpolation percentile of an ascending list"""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def regressions(results, baseline, tolerance):
+    """Stages whose p50 or memory peak exceed baseline * (1 + tolerance)
+
+    Returns:
+        list of human readable messages, empty if none regressed
+    """
+    out = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        for key in ("p50", "peak_mib"):
+            if r[key] > b[key] * (1 + tolerance):
+                out.append(f"{name}: {key} {r[key]:.2f} > baseline "
+                           f"{b[key]:.2f} (+{100 * tolerance:.0f}%)")
+    return out
+
+
+def emit(stages):
+    """Run the stages of one service, print the results as JSON
+
+    Entry point of the bench_<service>.py scripts, run.py starts each in
+    its own process.
+
+    Args:
+        stages: callable returning a list of Stage, may raise Skip
+    """
+    try:
+        out = {stage.name: stage.run() for stage in stages()}
+    except Skip as e:
+        out = {"skipped": str(e)}
+    print(json.dumps(out))
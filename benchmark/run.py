@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite, stage timings per service against a stored baseline
+
+Each service runs in its own process with that service's app directory
+on sys.path (the services share module names), so run it in an
+environment with the requirements of the services to benchmark:
+
+    python benchmark/run.py                      # all services
+    python benchmark/run.py --service xcmetrics
+    python benchmark/run.py --update-baseline    # store current results
+
+Reports p50/p90/p99 in ms and the tracemalloc peak per stage. Exits 1
+when a benchmark fails to run, or when a stage's p50 or memory peak
+exceeds its baseline by more than the tolerance. Services that lack
+their data or binary are skipped. Timings are machine specific, store
+the baseline on the machine that runs the comparison.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from harness import load_baseline, regressions, save_baseline
+
+HERE = Path(__file__).resolve().parent
+SERVICES = ("xcmetrics", "xcscore", "geolookup", "dem")
+
+
+def run_service(service):
+    """Stage results of bench_<service>.py, {"skipped": reason} or
+    {"failed": stderr} if it could not run"""
+    p = subprocess.run([sys.executable, str(HERE / f"bench_{service}.py")],
+                       capture_output=True, text=True, cwd=HERE)
+    if p.returncode != 0:
+        lines = p.stderr.strip().splitlines() or [f"exit {p.returncode}"]
+        return {"failed": lines[-1]}
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+
+def report(results, baseline):
+    print(f"{'stage':34s} {'p50':>9s} {'p90':>9s} {'p99':>9s} "
+          f"{'peak MiB':>9s} {'vs base':>8s}")
+    for name, r in results.items():
+        b = baseline.get(name)
+        delta = f"{100 * (r['p50'] / b['p50'] - 1):+7.1f}%" if b else ""
+        print(f"{name:34s} {r['p50']:9.2f} {r['p90']:9.2f} {r['p99']:9.2f} "
+              f"{r['peak_mib']:9.2f} {delta:>8s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--service", choices=SERVICES, action="append",
+                        help="service to run, repeatable, default all")
+    parser.add_argument("--baseline", default=str(HERE / "baseline.json"))
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed regression, fraction (default 0.25)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {}
+    broken = []
+    for service in args.service or SERVICES:
+        out = run_service(service)
+        if "skipped" in out:
+            print(f"{service}: skipped, {out['skipped']}", file=sys.stderr)
+        elif "failed" in out:
+            print(f"{service}: failed, {out['failed']}", file=sys.stderr)
+            broken.append(service)
+        else:
+            results.update(out)
+
+    baseline = load_baseline(args.baseline)
+    report(results, baseline)
+
+    if args.update_baseline:
+        # keep stages of services that were not run
+        save_baseline(args.baseline, {**baseline, **results})
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    failed = regressions(results, baseline, args.tolerance)
+    for message in failed:
+        print(f"REGRESSION {message}", file=sys.stderr)
+    return 1 if failed or broken else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
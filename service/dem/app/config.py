@@ -23,3 +23,9 @@ if not os.path.isdir(DEM_TILES_DIR):
         f"DEM_TILES_DIR '{DEM_TILES_DIR}' does not exist. "
         "Service will return None for elevations."
     )
+
+# Response compression (gzip/brotli, negotiated with Accept-Encoding):
+# minimum body size in bytes, gzip level 1-9 and brotli quality 0-11
+COMPRESS_MIN_SIZE = int(os.environ.get("DEM_COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("DEM_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("DEM_BROTLI_QUALITY", 4))
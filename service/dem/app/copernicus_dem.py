@@ -12,9 +12,15 @@ from pathlib import Path
 from typing import Optional, Dict, Tuple
 import rasterio
 from rasterio.windows import from_bounds
+from prometheus_client import Counter
+
+from metrics import stage
 
 logger = logging.getLogger(__name__)
 
+TILE_CACHE = Counter(
+    "dem_tile_cache_total", "Tile dataset lookups", ["result"])
+
 
 class CopernicusDEM:
     """
@@ -86,9 +92,13 @@ class CopernicusDEM:
         """
         tile_key = str(tile_path)
         
-        if tile_key not in self.tile_cache:
+        if tile_key in self.tile_cache:
+            TILE_CACHE.labels("hit").inc()
+        else:
+            TILE_CACHE.labels("miss").inc()
             try:
-                dataset = rasterio.open(tile_path)
+                with stage("tile_open"):
+                    dataset = rasterio.open(tile_path)
                 self.tile_cache[tile_key] = dataset
                 logger.debug(f"Opened tile: {tile_path.name}")
             except Exception as e:
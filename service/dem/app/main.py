@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, generate_latest
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import logging
 from contextlib import asynccontextmanager
 from copernicus_dem import CopernicusDEM
-from config import DEM_TILES_DIR
+from config import (DEM_TILES_DIR, COMPRESS_MIN_SIZE, GZIP_LEVEL,
+                    BROTLI_QUALITY)
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, stage
 
 logger = logging.getLogger(__name__)
 
+POINTS = Counter(
+    "dem_points_total", "Sampled points")
+
 # Global DEM reader instance
 dem_reader = None
 
@@ -35,7 +43,11 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"Error closing DEM reader: {e}")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_SIZE,
+                   gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY)
+# outermost, sizes as on the wire
+app.add_middleware(MetricsMiddleware)
 
 class TrackPoint(BaseModel):
     """Single track point with optional altitude and segment information"""
@@ -55,6 +67,11 @@ class TrackPointsInput(BaseModel):
 async def alive():
     return {"message": "dem"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics, text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/")
 async def process(input_data: TrackPointsInput):
     """
@@ -67,7 +84,9 @@ async def process(input_data: TrackPointsInput):
     - Track points with terrain_alt added to each point
     """
     try:
-        return await process_track_points(input_data.track_points)
+        # returned as response directly, skips jsonable_encoder
+        return ORJSONResponse(
+            await process_track_points(input_data.track_points))
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
@@ -92,7 +111,9 @@ async def process_track_points(track_points: List[TrackPoint]) -> Dict[str, Any]
     coords = [[tp.lon, tp.lat] for tp in track_points]
     
     # Get elevations
-    elevations = await get_elevations_batch(coords)
+    with stage("sample"):
+        elevations = await get_elevations_batch(coords)
+    POINTS.inc(len(coords))
     
     # Return enhanced data
     result = []
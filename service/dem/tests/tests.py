@@ -126,5 +126,39 @@ class TestDEMicroservice(unittest.TestCase):
         result = response.json()
         self.assertEqual(result["track_points"], [])
 
+    def test_compression(self):
+        """gzip/brotli responses above the size threshold"""
+        test_data = {"track_points": [
+            {"timestamp": "2024-08-15T10:23:45Z", "lat": 45.9237, "lon": 6.8694}
+        ] * 100}
+        for encoding in ["gzip", "br"]:
+            response = requests.post(self.url, json=test_data,
+                                     headers={"Accept-Encoding": encoding})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["Content-Encoding"], encoding)
+            self.assertEqual(len(response.json()["track_points"]), 100)
+
+        # below the threshold
+        response = requests.post(self.url, json={"track_points": []},
+                                 headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+
+        """Prometheus metrics, sampling time and tile cache counts"""
+        test_data = {
+            "track_points": [
+                {"timestamp": "2024-08-15T10:23:45Z", "lat": 45.9237, "lon": 6.8694},
+                {"timestamp": "2024-08-15T10:23:50Z", "lat": 45.8326, "lon": 6.8652},
+            ]
+        }
+        response = requests.post(self.url, json=test_data)
+        self.assertEqual(response.status_code, 200)
+
+        response = requests.get(self.url + "metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('stage_duration_seconds_count{stage="sample"}', response.text)
+        self.assertIn("dem_points_total", response.text)
+        self.assertIn("dem_tile_cache_total", response.text)
+
 if __name__ == '__main__':
     unittest.main()
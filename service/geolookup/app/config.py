@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Configuration for geolookup service.
+"""
+
+import os
+
+# Cell size in degrees of the admin-1 lookup grid. Points in a cell
+# inside a single region, or outside all of them, are answered without a
+# polygon test (0 disables the grid)
+ADMIN1_GRID = float(os.environ.get("GEOLOOKUP_ADMIN1_GRID", 0.5))
+
+# Lookup result cache: entries (0 disables) and decimal places the
+# coordinates are rounded to, 4 is 11 m of latitude. Lookups run on the
+# rounded coordinates
+CACHE_ENTRIES = int(os.environ.get("GEOLOOKUP_CACHE_ENTRIES", 10000))
+CACHE_PRECISION = int(os.environ.get("GEOLOOKUP_CACHE_PRECISION", 4))
+
+# Largest k of GET /takeoffs
+MAX_TAKEOFFS = int(os.environ.get("GEOLOOKUP_MAX_TAKEOFFS", 100))
+
+# Largest number of points of POST /batch, larger requests get 422
+MAX_BATCH_POINTS = int(os.environ.get("GEOLOOKUP_MAX_BATCH_POINTS", 10000))
@@ -1,7 +1,16 @@
+import math
 import os
+import numpy as np
 import geopandas as gpd
+import shapely
 from shapely.geometry import Point
 
+from config import ADMIN1_GRID
+
+# grid cell values besides region indices
+BORDER = -1  # touches several regions, or a region's boundary
+NONE = -2    # outside all regions
+
 class CountryState:
     """admin-1 lookup for lat/lon
     
@@ -10,7 +19,7 @@ class CountryState:
     "iso_3166_1": US    https://en.wikipedia.org/wiki/ISO_3166-1
     "iso_3166_2": US-CA https://en.wikipedia.org/wiki/ISO_3166-2
     """
-    def __init__(self):
+    def __init__(self, grid=ADMIN1_GRID):
         # Load the GeoJSON FeatureCollection into a GeoDataFrame
         p = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                      'data',
@@ -23,30 +32,113 @@ class CountryState:
         self.gdf = gdf
         # Build a spatial index - rtree
         self.sindex = gdf.sindex
+        # response of each region, built once
+        self.records = [self._record(row) for _, row in gdf.iterrows()]
+        # prepared geometries, fast repeated contains tests
+        self.geometries = gdf.geometry.to_numpy()
+        shapely.prepare(self.geometries)
+        self.grid_size = grid
+        self.grid = self._grid(grid) if grid > 0 else None
 
-    def query(self,lat,lon):
+    def _grid(self, size):
+        """Region of each size x size degree cell, BORDER or NONE
+
+        A cell maps to a region when the region contains it properly
+        (closed cell in the region's interior) and no other region
+        intersects it, so every point in it has that answer.
         """
+        nx, ny = int(np.ceil(360 / size)), int(np.ceil(180 / size))
+        grid = np.full((ny, nx), NONE, dtype=np.int32)
+        # regions intersecting each cell
+        count = np.zeros((ny, nx), dtype=np.int32)
+        # margin, a point is inside its cell despite float rounding
+        eps = 1e-9
+        for r, (x0, y0, x1, y1) in enumerate(shapely.bounds(self.geometries)):
+            if np.isnan(x0):
+                continue
+            ix = np.arange(max(int((x0 + 180) // size), 0),
+                           min(int((x1 + 180) // size), nx - 1) + 1)
+            iy = np.arange(max(int((y0 + 90) // size), 0),
+                           min(int((y1 + 90) // size), ny - 1) + 1)
+            ix, iy = [a.ravel() for a in np.meshgrid(ix, iy)]
+            cells = shapely.box(ix * size - 180 - eps, iy * size - 90 - eps,
+                                (ix + 1) * size - 180 + eps,
+                                (iy + 1) * size - 90 + eps)
+            touch = shapely.intersects(self.geometries[r], cells)
+            count[iy[touch], ix[touch]] += 1
+            inside = shapely.contains_properly(self.geometries[r],
+                                               cells[touch])
+            grid[iy[touch][inside], ix[touch][inside]] = r
+        grid[count > 1] = BORDER
+        grid[(count == 1) & (grid < 0)] = BORDER
+        return grid
+
+    def _cells(self, lat, lon):
+        """Grid value at lat, lon (arrays), BORDER outside the grid"""
+        ny, nx = self.grid.shape
+        ix = np.floor((np.asarray(lon) + 180) / self.grid_size)
+        iy = np.floor((np.asarray(lat) + 90) / self.grid_size)
+        valid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        out = np.full(np.shape(ix), BORDER, dtype=np.int32)
+        out[valid] = self.grid[iy[valid].astype(int), ix[valid].astype(int)]
+        return out
+
+    def query(self,lat,lon):
+        """Region containing lat, lon, 0 if none
         """
+        if self.grid is not None and math.isfinite(lat + lon):
+            ny, nx = self.grid.shape
+            ix = math.floor((lon + 180) / self.grid_size)
+            iy = math.floor((lat + 90) / self.grid_size)
+            cell = self.grid[iy, ix] if 0 <= ix < nx and 0 <= iy < ny \
+                else BORDER
+            if cell >= 0:
+                return self.records[cell]
+            if cell == NONE:
+                return 0
+
         # Create a Point geometry for the given lat0, lon0
         point = Point(lon, lat)
 
-        # Find potential matches with spatial index
-        possible_matches_index = list(self.sindex.intersection(point.bounds))
-        possible_matches = self.gdf.iloc[possible_matches_index]
-        
-        # Further filter using actual geometry
-        precise_match = possible_matches[possible_matches.contains(point)]
+        # Find potential matches with spatial index, first one containing
+        # the point, with the prepared geometry
+        for r in self.sindex.intersection(point.bounds):
+            if self.geometries[r].contains(point):
+                return self.records[r]
+        return 0
 
-        if precise_match.empty:
-            return 0
-        
+    @staticmethod
+    def _record(row):
         return {
-            "admin0"    : precise_match.iloc[0]['admin'],
-            "admin1"    : precise_match.iloc[0]['name'],
-            "iso_3166_1": precise_match.iloc[0]['iso_3166_2'],
-            "iso_3166_2": precise_match.iloc[0]['iso_a2'],
+            "admin0"    : row['admin'],
+            "admin1"    : row['name'],
+            "iso_3166_1": row['iso_3166_2'],
+            "iso_3166_2": row['iso_a2'],
         }
 
+    def query_many(self,lat,lon):
+        """query() for arrays of lat, lon, one bulk R-tree query"""
+        lat, lon = np.asarray(lat), np.asarray(lon)
+        if self.grid is not None:
+            cells = self._cells(lat, lon)
+        else:
+            cells = np.full(lat.shape, BORDER, dtype=np.int32)
+        out = [self.records[c] if c >= 0 else 0 for c in cells]
+
+        border = np.flatnonzero(cells == BORDER)
+        points = shapely.points(lon[border], lat[border])
+        # point within polygon, same test as polygon.contains(point)
+        point_index, region_index = self.sindex.query(points,
+                                                      predicate="within")
+        # first region of each point, if several
+        match = {}
+        for p, r in zip(point_index, region_index):
+            if p not in match or r < match[p]:
+                match[p] = r
+        for p, r in match.items():
+            out[border[p]] = self.records[r]
+        return out
+
 
 if __name__ == "__main__":
     """test"""
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+LRU cache of lookup results, keyed on quantized coordinates.
+
+Flights start from a few dozen takeoffs, so the same coordinates, give
+or take a few meters, are looked up again and again. Coordinates are
+rounded to `precision` decimal places (4: 11 m of latitude) and the
+lookup runs on the rounded coordinates, so an answer does not depend
+on which request of a cell came first.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+LOOKUP_CACHE = Counter(
+    "geolookup_cache_total", "Lookup cache queries", ["lookup", "result"])
+
+
+class LookupCache:
+    """
+    LRU cache, bounded by entry count. Thread-safe.
+    """
+
+    def __init__(self, max_entries: int, precision: int):
+        """
+        Args:
+            max_entries: capacity, 0 disables the cache
+            precision: decimal places of the quantized coordinates
+        """
+        self.max_entries = max_entries
+        self.precision = precision
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def quantize(self, lat, lon):
+        """Coordinates lookup() queries for sequences lat, lon, lists
+
+        For bulk queries that bypass the cache but have to give the same
+        answers as the cached single lookups.
+        """
+        if self.max_entries <= 0:
+            return list(lat), list(lon)
+        return ([round(x, self.precision) for x in lat],
+                [round(x, self.precision) for x in lon])
+
+    def lookup(self, name, query, lat, lon, *params):
+        """query(lat, lon, *params), cached
+
+        Args:
+            name: lookup name, part of the key and the metrics label
+            query: the lookup, called on a miss
+            params: further query arguments, part of the key
+        """
+        if self.max_entries <= 0 or not math.isfinite(lat + lon):
+            return query(lat, lon, *params)
+        lat, lon = round(lat, self.precision), round(lon, self.precision)
+        key = (name, lat, lon, *params)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                LOOKUP_CACHE.labels(name, "hit").inc()
+                return self._entries[key]
+        LOOKUP_CACHE.labels(name, "miss").inc()
+
+        value = query(lat, lon, *params)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
@@ -1,5 +1,9 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import ORJSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, generate_latest
+from pydantic import BaseModel, Field
+from typing import List
+import numpy as np
 
 # offline DB of towns/cities, returns closest match
 from nearest_town import NearestTown
@@ -8,32 +12,97 @@ from named_takeoff import NamedTakeoff
 # offline DB of admin-1 (state/province) borders
 # https://www.naturalearthdata.com/downloads/10m-cultural-vectors
 from country_state import CountryState
+from config import (CACHE_ENTRIES, CACHE_PRECISION, MAX_TAKEOFFS,
+                    MAX_BATCH_POINTS)
+from lookup_cache import LookupCache
+from metrics import MetricsMiddleware, stage
 
-app = FastAPI()
+POINTS = Counter(
+    "geolookup_batch_points_total", "Points looked up by /batch")
+
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(MetricsMiddleware)
 takeoff = NamedTakeoff()
 state = CountryState()
 town = NearestTown()
+cache = LookupCache(CACHE_ENTRIES, CACHE_PRECISION)
+
+class Point(BaseModel):
+    lat: float
+    lon: float
+
+class BatchInput(BaseModel):
+    """Points to look up, at most MAX_BATCH_POINTS, radius of the
+    takeoff lookup in meters"""
+    points: List[Point] = Field(max_length=MAX_BATCH_POINTS)
+    radius: float = 1000
 
 @app.get("/")
 async def alive():
     return {"message": "geolookup"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics, text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/takeoffdb")
 async def takeoffdb(lat: float, lon: float, radius: float = 1000):
-    return JSONResponse( content = takeoff.query(lat,lon,radius) )
+    with stage("takeoff"):
+        ddict = cache.lookup("takeoff", takeoff.query, lat, lon, radius)
+    return ORJSONResponse( content = ddict )
+
+@app.get("/takeoffs")
+async def takeoffs(lat: float, lon: float, radius: float = 1000,
+                   k: int = Query(10, ge=1, le=MAX_TAKEOFFS)):
+    """Up to k takeoffs within radius meters, nearest first"""
+    with stage("takeoffs"):
+        nearby = cache.lookup("takeoffs", takeoff.nearest, lat, lon,
+                              radius, k)
+    return ORJSONResponse(nearby)
 
 @app.get("/nearest_town")
 async def takeoffdb(lat: float, lon: float):
-    ddict = town.query(lat, lon)
-    return JSONResponse(ddict)
+    with stage("nearest_town"):
+        ddict = cache.lookup("nearest_town", town.query, lat, lon)
+    return ORJSONResponse(ddict)
 
 @app.get("/admin1")
 async def takeoffdb(lat: float, lon: float):
-    ddict = state.query(lat, lon)
+    with stage("admin1"):
+        ddict = cache.lookup("admin1", state.query, lat, lon)
     if ddict:
-        return JSONResponse(ddict)
+        return ORJSONResponse(ddict)
     else:
         # shouldn't occur
         raise HTTPException(
             status_code=400, # bad request
-            detail=f"admin1: no match") 
\ No newline at end of file
+            detail=f"admin1: no match") 
+
+@app.post("/batch")
+async def batch(input_data: BatchInput):
+    """
+    takeoffdb, nearest_town and admin1 of many points, in bulk queries
+
+    Returns a list in the order of the points:
+    {"lat", "lon", "takeoff", "nearest_town", "admin1"}, admin1 is null
+    where /admin1 would fail
+    """
+    points = input_data.points
+    if not points:
+        return ORJSONResponse([])
+    # same coordinates as the cached single lookups, same answers
+    lat, lon = cache.quantize([p.lat for p in points],
+                              [p.lon for p in points])
+    lat, lon = np.array(lat), np.array(lon)
+    with stage("takeoff_batch"):
+        takeoffs = takeoff.query_many(lat, lon, input_data.radius)
+    with stage("nearest_town_batch"):
+        towns = town.query_many(lat, lon)
+    with stage("admin1_batch"):
+        states = state.query_many(lat, lon)
+    POINTS.inc(len(points))
+    return ORJSONResponse([
+        {"lat": p.lat, "lon": p.lon, "takeoff": t, "nearest_town": n,
+         "admin1": a or None}
+        for p, t, n, a in zip(points, takeoffs, towns, states)])
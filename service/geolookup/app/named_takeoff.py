@@ -1,6 +1,32 @@
 import os
+import numpy as np
 import geopandas as gpd
-from shapely.geometry import Point
+from scipy.spatial import cKDTree
+
+# mean earth radius, meters
+EARTH_RADIUS = 6371008.8
+
+def ecef(lat, lon):
+    """Points on the sphere (earth centered, earth fixed), meters, (n, 3)
+
+    The straight-line (chord) distance between two points is monotonic
+    in their great circle distance, so a KD-tree over these points
+    answers great circle radius and nearest neighbour queries.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    return EARTH_RADIUS * np.stack([np.cos(lat) * np.cos(lon),
+                                    np.cos(lat) * np.sin(lon),
+                                    np.sin(lat)], axis=-1)
+
+def chord(meters):
+    """Chord length of a great circle distance"""
+    return 2 * EARTH_RADIUS * np.sin(
+        np.minimum(meters / (2 * EARTH_RADIUS), np.pi / 2))
+
+def great_circle(chord):
+    """Great circle distance of a chord length"""
+    return 2 * EARTH_RADIUS * np.arcsin(
+        np.minimum(chord / (2 * EARTH_RADIUS), 1.0))
 
 class NamedTakeoff:
     """ example, default search radius 1 km
@@ -8,7 +34,7 @@ class NamedTakeoff:
     {
         "name": "Niedere - Andelsbuch",
         "country": "AT",
-        "dist": 747.4395282905823,
+        "dist": 505.3,
         "db_lat": 47.40349999999999,
         "db_lon": 9.93893
     }
@@ -16,52 +42,67 @@ class NamedTakeoff:
     def __init__(self):
         # Load the GeoJSON FeatureCollection into a GeoDataFrame
         p = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                     'data','paraglidingearth','pgEarthSpots.json') 
+                     'data','paraglidingearth','pgEarthSpots.json')
         gdf = gpd.read_file(p)
-        # Convert the GeoDataFrame to a projected CRS to measure distances in meters
-        # WGS 84 (lat/lon) is EPSG:4326, and we convert to a metric CRS like EPSG:3857
         gdf = gdf.set_crs(epsg=4326)  # Ensure it's in WGS84 (lat/lon)
-        gdf = gdf.to_crs(epsg=3857)   # Convert to a metric CRS for distance calculations
         self.gdf = gdf
 
+        # read-only arrays and KD-tree, queries share no mutable state
+        self.lat = gdf.geometry.y.to_numpy()
+        self.lon = gdf.geometry.x.to_numpy()
+        self.name = gdf['name'].to_numpy()
+        self.country = gdf['countryCode'].fillna('').str.upper().to_numpy()
+        self.tree = cKDTree(ecef(self.lat, self.lon))
+
+    @staticmethod
+    def _empty():
+        return {
+            "name"     : "",
+            "country"  : "",
+            "dist"     : 0, # meters
+            "db_lat"   : 0, # deg
+            "db_lon"   : 0, # deg
+        }
+
+    def _record(self, i, distance):
+        return {
+            "name"     : self.name[i],
+            "country"  : self.country[i],
+            "dist"     : float(great_circle(distance)), # meters
+            "db_lat"   : float(self.lat[i]), # deg
+            "db_lon"   : float(self.lon[i]), # deg
+        }
+
+    def nearest(self,lat,lon,search_radius,k=1):
+        """Up to k takeoffs within search_radius, nearest first
+
+        search_radius: great circle radius in meters around lat, lon
+        """
+        distance, index = self.tree.query(
+            ecef(lat, lon), k=k, distance_upper_bound=chord(search_radius))
+        # missing neighbours have index len(self.name), distance inf
+        return [self._record(i, d)
+                for d, i in zip(np.atleast_1d(distance), np.atleast_1d(index))
+                if i < len(self.name)]
+
+    def query_many(self,lat,lon,search_radius):
+        """query() for arrays of lat, lon, one bulk tree query"""
+        distance, index = self.tree.query(
+            ecef(lat, lon), k=1, distance_upper_bound=chord(search_radius))
+        return [self._record(i, d) if i < len(self.name) else self._empty()
+                for d, i in zip(distance, index)]
+
     def query(self,lat,lon,search_radius):
         """Extract named takeoff and landing locations from database
 
         Database is extracted from paraglidingearth.com
 
-        search_radius: Radius in meters around lat, lon
+        search_radius: great circle radius in meters around lat, lon
         """
-        # Create a Point geometry for the given lat0, lon0
-        takeoff = Point(lon, lat)
-
-        # Convert the reference point to the same CRS
-        takeoff = gpd.GeoSeries([takeoff], crs='EPSG:4326').to_crs(epsg=3857).iloc[0]
-
-        # Calculate distances from the reference point to each feature
-        self.gdf['distance'] = self.gdf.geometry.distance(takeoff)
-
-        # Filter the features within the specified distance
-        nearby = self.gdf[self.gdf['distance'] <= search_radius]
-        nearby = nearby.sort_values(by='distance', ascending=True)
-        
-        if nearby.empty:
-            out = {
-                "name"     : "",
-                "country"  : "",
-                "dist"     : 0, # meters
-                "db_lat"   : 0, # deg
-                "db_lon"   : 0, # deg
-            }
-        else:
-            out = {
-                "name"     : nearby.iloc[0]['name'],
-                "country"  : nearby.iloc[0]['countryCode'].upper(),
-                "dist"     : nearby.iloc[0]['distance'],
-                "db_lat"   : nearby.to_crs(epsg=4326).iloc[0].geometry.y,
-                "db_lon"   : nearby.to_crs(epsg=4326).iloc[0].geometry.x,
-            }
-
-        return out
+        nearby = self.nearest(lat, lon, search_radius)
+        if not nearby:
+            return self._empty()
+        return nearby[0]
 
 if __name__ == "__main__":
     """test"""
@@ -69,5 +110,5 @@ if __name__ == "__main__":
     # Bezau, Niedere
     lat=47.399682
     lon=9.942572
-    out = obj.query(lat,lon)
-    print(out)
\ No newline at end of file
+    out = obj.query(lat,lon,1000)
+    print(out)
@@ -3,7 +3,15 @@ import reverse_geocode
 class NearestTown:
 
     def query(self,lat,lon):
-        ddict = reverse_geocode.get([lat, lon])
+        return self._record(reverse_geocode.get([lat, lon]))
+
+    def query_many(self,lat,lon):
+        """query() for arrays of lat, lon, one bulk tree query"""
+        return [self._record(ddict)
+                for ddict in reverse_geocode.search(list(zip(lat, lon)))]
+
+    @staticmethod
+    def _record(ddict):
         # {
         #     "country_code": "AT",
         #     "city": "Bizau",
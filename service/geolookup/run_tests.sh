@@ -8,6 +8,9 @@ fi
 source .venv/bin/activate
 pip install -r requirements.txt
 
+# modules shared by the services, e.g. metrics.py
+export PYTHONPATH="$(pwd)/../shared"
+
 # Start Uvicorn server in the background and save its PID
 cd ./app
 echo "Starting Uvicorn server..."
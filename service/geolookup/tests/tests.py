@@ -27,6 +27,28 @@ class TestMicroservice(unittest.TestCase):
 
         d = json.loads(response.text)
         self.assertEqual( d["name"], "Niedere - Andelsbuch")
+        # great circle distance
+        self.assertAlmostEqual( d["dist"], 505.3, delta=1)
+
+    def test_route_takeoffs(self):
+        """Test k nearest takeoffs, nearest first"""
+        lat=47.399682
+        lon=9.942572
+        url = self.url + f"/takeoffs?lat={lat}&lon={lon}&radius=20000&k=5"
+
+        response = requests.get(url)
+        self.assertEqual(response.status_code,200)
+
+        d = json.loads(response.text)
+        self.assertEqual( len(d), 5)
+        self.assertEqual( d[0]["name"], "Niedere - Andelsbuch")
+        dist = [t["dist"] for t in d]
+        self.assertEqual( dist, sorted(dist))
+        self.assertTrue( dist[-1] <= 20000)
+
+        for k in [0, 100000]:
+            response = requests.get(self.url + f"/takeoffs?lat={lat}&lon={lon}&k={k}")
+            self.assertEqual(response.status_code,422)
 
     def test_route_nearest_town(self):
         """Test nearest_town with known coordinate"""
@@ -56,6 +78,57 @@ class TestMicroservice(unittest.TestCase):
         self.assertEqual( d["iso_3166_1"], "AT-8")
         self.assertEqual( d["iso_3166_2"], "AT")
 
+    def test_route_batch(self):
+        """Test batch lookup, same answers as the single lookups"""
+        points = [{"lat": 47.399682, "lon": 9.942572},
+                  {"lat": 0.0, "lon": -30.0}, # Atlantic
+                  ] * 50
+        response = requests.post(self.url + "/batch", json={"points": points})
+        self.assertEqual(response.status_code,200)
+
+        d = json.loads(response.text)
+        self.assertEqual( len(d), 100)
+        for lookup in ["takeoffdb", "nearest_town", "admin1"]:
+            single = requests.get(
+                self.url + f"/{lookup}?lat=47.399682&lon=9.942572").json()
+            key = {"takeoffdb": "takeoff"}.get(lookup, lookup)
+            self.assertEqual( d[0][key], single)
+        self.assertEqual( d[1]["takeoff"]["name"], "")
+        self.assertIsNone( d[1]["admin1"])
+        self.assertEqual( d[98], d[0])
+
+        response = requests.post(self.url + "/batch", json={"points": []})
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(response.json(), [])
+
+        # more than GEOLOOKUP_MAX_BATCH_POINTS (default 10000)
+        points = [{"lat": 0.0, "lon": -30.0}] * 10001
+        response = requests.post(self.url + "/batch", json={"points": points})
+        self.assertEqual(response.status_code,422)
+
+    def test_cache(self):
+        """Test lookups a few meters apart share a cache entry"""
+        url = self.url + "/admin1?lat=46.51231&lon=6.63282"
+        first = requests.get(url).json()
+        # 2 m north east
+        url = self.url + "/admin1?lat=46.51232&lon=6.63284"
+        second = requests.get(url).json()
+        self.assertEqual( first, second)
+
+        response = requests.get(self.url + "metrics")
+        self.assertIn('geolookup_cache_total{lookup="admin1",result="hit"}',
+                      response.text)
+
+    def test_metrics(self):
+        """Prometheus metrics, query time per lookup"""
+        response = requests.get(self.url + "/takeoffdb?lat=47.399682&lon=9.942572")
+        self.assertEqual(response.status_code,200)
+
+        response = requests.get(self.url + "metrics")
+        self.assertEqual(response.status_code,200)
+        self.assertIn('stage_duration_seconds_count{stage="takeoff"}', response.text)
+        self.assertIn('route="/takeoffdb"', response.text)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Response compression, gzip or brotli negotiated with Accept-Encoding,
+above a size threshold. Streaming responses (NDJSON) are compressed
+chunk by chunk and flushed, so lines still arrive as soon as they are
+done.
+
+Shared by the services that serve large responses (xcmetrics, dem).
+Compressed requests are handled by upload.GzipRequestMiddleware.
+"""
+
+import zlib
+
+import brotli
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def accepted_encoding(accept_encoding, available=("br", "gzip")):
+    """Preferred content coding of an Accept-Encoding header, or None
+
+    Highest q value wins, ties in the order of available.
+    """
+    best, best_q = None, 0.0
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        if coding == "*":
+            candidates = available
+        elif coding in available:
+            candidates = (coding,)
+        else:
+            continue
+        for candidate in candidates:
+            if q > best_q or (q == best_q and best is not None and
+                              available.index(candidate) <
+                              available.index(best)):
+                best, best_q = candidate, q
+    return best
+
+
+class _Compressor:
+    """Streaming compressor of one response body"""
+
+    def __init__(self, encoding, gzip_level, brotli_quality):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: gzip container
+            self._c = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self._c.process(data)
+        return self._c.compress(data)
+
+    def flush(self):
+        """Everything compressed so far, stream stays open"""
+        if self.encoding == "br":
+            return self._c.flush()
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._c.finish()
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """ASGI middleware, gzip/brotli response compression
+
+    Responses smaller than minimum_size, or already encoded, are sent as
+    is. A strong ETag becomes weak when compressed: the representation
+    differs, the content does not.
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6,
+                 brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = accepted_encoding(
+            _header(scope["headers"], b"accept-encoding"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+
+        async def compressing_send(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # held back until the size of the body is known
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if compressor is None:
+                headers = start.get("headers", [])
+                if (_header(headers, b"content-encoding") is not None
+                        or (not more and len(body) < self.minimum_size)):
+                    # pass through
+                    await send(start)
+                    start = None
+                    return await send(message)
+                compressor = _Compressor(encoding, self.gzip_level,
+                                         self.brotli_quality)
+                start["headers"] = self._headers(headers, encoding)
+                if not more:
+                    body = compressor.compress(body) + compressor.finish()
+                    start["headers"].append(
+                        (b"content-length", str(len(body)).encode()))
+                    await send(start)
+                    return await send({"type": "http.response.body",
+                                       "body": body})
+                await send(start)
+
+            if more:
+                body = compressor.compress(body) + compressor.flush()
+            else:
+                body = compressor.compress(body) + compressor.finish()
+            await send({"type": "http.response.body", "body": body,
+                        "more_body": more})
+
+        await self.app(scope, receive, compressing_send)
+
+    @staticmethod
+    def _headers(headers, encoding):
+        """Response headers of the compressed representation"""
+        out = []
+        vary = None
+        for key, value in headers:
+            if key == b"content-length":
+                continue
+            if key == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            if key == b"vary":
+                vary = value
+                continue
+            out.append((key, value))
+        vary = (vary + b", " if vary else b"") + b"Accept-Encoding"
+        out.append((b"vary", vary))
+        out.append((b"content-encoding", encoding.encode()))
+        return out
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics, served as text format on /metrics.
+
+Shared by all services (service/shared is on their module path, see
+the Dockerfiles and run_tests.sh). Service specific metrics are defined
+next to their use. Imported by worker processes too, so kept free of
+FastAPI.
+
+- HTTP: latency histogram, in-flight gauge, request/response body sizes,
+  labelled by route template (bounded cardinality)
+- stages: wall time of the processing stages, see stage()
+
+The middleware is plain ASGI and only adds a few counter updates per
+request; stage() costs two perf_counter() calls and one observation.
+"""
+
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Gauge, Histogram
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30,
+                   60, 120)
+# 1 KiB .. 64 MiB
+SIZE_BUCKETS = tuple(2**i for i in range(10, 27, 2))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being processed")
+REQUEST_SIZE = Histogram(
+    "http_request_size_bytes", "Request body size",
+    ["route"], buckets=SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size",
+    ["route"], buckets=SIZE_BUCKETS)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds", "Processing stage wall time",
+    ["stage"], buckets=LATENCY_BUCKETS)
+
+# stage() appends (name, seconds) here instead of observing, see
+# redirect_stages()
+_sink = None
+
+
+def redirect_stages(sink):
+    """Collect stage timings in the list sink, None observes again
+
+    For processes whose metrics are not exported, e.g. pool workers
+    that hand their timings back with the job result.
+    """
+    global _sink
+    _sink = sink
+
+
+@contextmanager
+def stage(name):
+    """Time a processing stage"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        if _sink is None:
+            STAGE_SECONDS.labels(name).observe(seconds)
+        else:
+            _sink.append((name, seconds))
+
+
+class MetricsMiddleware:
+    """ASGI middleware, HTTP request metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        received = 0
+        sent = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_FLIGHT.dec()
+            # set by the router, path template rather than the request path
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, status).observe(
+                time.perf_counter() - t0)
+            REQUEST_SIZE.labels(route).observe(received)
+            RESPONSE_SIZE.labels(route).observe(sent)
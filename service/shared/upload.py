@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Bounded-memory request and upload handling.
+
+Shared by the services that take igc uploads (xcmetrics, xcscore).
+
+- requests: a larger Content-Length is rejected before the body is
+  read, bodies without one (chunked transfer) are counted as they
+  arrive. Bodies sent with Content-Encoding: gzip are decompressed while
+  they are received, the limit applies to the decompressed size.
+- uploads: Starlette spools multipart uploads to a temporary file beyond
+  1 MiB, so the request body itself is never held in memory. The igc
+  content is then read from the spooled file in chunks, .igc.gz files
+  decompressed on the fly, and reading stops as soon as the size limit
+  is exceeded.
+
+spool_igc() copies the content to a named temporary file and hashes it
+on the way, for the result cache key. The analysis worker opens the
+file by name and feeds the parser chunk by chunk, so the content is
+never held in memory as a whole. read_igc() returns it as one buffer,
+for consumers that need all of it at once (igc-xc-score reads the whole
+flight from its stdin), bounded by max_bytes per admitted job.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+
+from starlette.responses import JSONResponse
+
+# read size of uploads, compressed or not
+CHUNK_SIZE = 64 * 1024
+
+# decompressed request body bytes handed to the app per receive() call
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+# allowance for multipart boundaries and part headers in the
+# Content-Length check
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class CompressedDataError(ValueError):
+    """Corrupt or truncated gzip data"""
+
+
+class RequestTooLargeError(ValueError):
+    """Request body larger than allowed, answered with 413"""
+
+
+class UploadTooLargeError(ValueError):
+    """Upload exceeds the configured maximum size"""
+
+
+def is_igc(filename):
+    """.igc or gzip compressed .igc.gz file name, case insensitive"""
+    name = (filename or "").lower()
+    return name.endswith(".igc") or name.endswith(".igc.gz")
+
+
+def iter_igc(fileobj, filename, max_bytes):
+    """Content of an uploaded igc file, in chunks of CHUNK_SIZE bytes
+
+    .igc.gz files are decompressed on the fly. Multi-member gzip files
+    (e.g. concatenated with cat) are supported.
+
+    Args:
+        fileobj: binary file object, e.g. UploadFile.file
+        filename: upload file name, .gz suffix selects decompression
+        max_bytes: maximum (decompressed) size
+
+    Raises:
+        UploadTooLargeError: more than max_bytes
+        CompressedDataError: corrupt or truncated gzip data
+    """
+    size = 0
+    try:
+        if filename.lower().endswith(".gz"):
+            fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+        while chunk := fileobj.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(
+                    f"{filename}: larger than {max_bytes} bytes")
+            yield chunk
+    except (OSError, EOFError, zlib.error) as e:
+        raise CompressedDataError(f"{filename}: bad gzip data: {e}")
+
+
+def read_igc(fileobj, filename, max_bytes):
+    """Content of an uploaded igc file, bytearray, see iter_igc()"""
+    out = bytearray()
+    for chunk in iter_igc(fileobj, filename, max_bytes):
+        out += chunk
+    return out
+
+
+class IgcFile:
+    """Igc content in a named temporary file, removed by close()
+
+    Attributes:
+        path: file name, can be opened by other processes
+        size: bytes
+        sha256: hashlib object fed with the content
+    """
+
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def spool_igc(fileobj, filename, max_bytes):
+    """Copy of an uploaded igc file, decompressed, IgcFile
+
+    Same arguments and errors as iter_igc(). The caller closes the
+    copy.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(suffix=".igc", delete=False) as f:
+        try:
+            for chunk in iter_igc(fileobj, filename, max_bytes):
+                sha256.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    return IgcFile(f.name, size, sha256)
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def call_limited(app, scope, receive, send):
+    """app(scope, receive, send), 413 when receive raises
+    RequestTooLargeError
+
+    The app may turn the error into its own response (FastAPI answers
+    400 when reading a form fails), that response is replaced.
+    """
+    error = None
+    started = False
+
+    async def checked_receive():
+        nonlocal error
+        try:
+            return await receive()
+        except RequestTooLargeError as e:
+            error = e
+            raise
+
+    async def checked_send(message):
+        nonlocal started
+        if error is not None and not started:
+            return
+        if message["type"] == "http.response.start":
+            started = True
+        await send(message)
+
+    try:
+        await app(scope, checked_receive, checked_send)
+    except Exception:
+        if error is None:
+            raise
+    if error is not None and not started:
+        body = json.dumps({"detail": str(error)}).encode("utf-8")
+        await send({"type": "http.response.start",
+                    "status": 413, # Content Too Large
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length",
+                                 str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware, 413 for requests larger than max_bytes
+
+    The limit has MULTIPART_OVERHEAD on top. A larger Content-Length is
+    rejected before the body is read, a malformed one with 400; bodies
+    without Content-Length are counted while they are received. Paths in
+    limits (e.g. multi-file uploads) have their own max_bytes, each file
+    is limited by iter_igc() in addition.
+    """
+
+    def __init__(self, app, max_bytes, limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        max_bytes = self.limits.get(scope["path"], self.max_bytes)
+        limit = max_bytes + MULTIPART_OVERHEAD
+        for key, value in scope["headers"]:
+            if key != b"content-length":
+                continue
+            if not value.strip().isdigit():
+                response = JSONResponse(
+                    {"detail": "invalid Content-Length"},
+                    status_code=400) # bad request
+                return await response(scope, receive, send)
+            if int(value) > limit:
+                response = JSONResponse(
+                    {"detail": f"request larger than {max_bytes} bytes"},
+                    status_code=413) # Content Too Large
+                return await response(scope, receive, send)
+
+        received = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise RequestTooLargeError(
+                        f"request larger than {max_bytes} bytes")
+            return message
+
+        await call_limited(self.app, scope, counting_receive, send)
+
+
+class GzipRequestMiddleware:
+    """ASGI middleware, decompresses Content-Encoding: gzip request bodies
+
+    The body is decompressed as the app reads it, at most
+    DECOMPRESS_CHUNK_SIZE bytes per receive() call whatever the ratio,
+    the app sees a plain request without Content-Encoding/Length.
+    Beyond max_bytes of decompressed body the request gets 413, paths in
+    limits (e.g. multi-file uploads) have their own max_bytes.
+    """
+
+    def __init__(self, app, max_bytes=None, limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or
+                _header(scope["headers"], b"content-encoding") != "gzip"):
+            return await self.app(scope, receive, send)
+
+        limit = self.limits.get(scope["path"], self.max_bytes)
+        # changed in place, not copied: the outer middlewares see what
+        # the app adds to the scope (e.g. the route for the metrics)
+        scope["headers"] = [
+            (key, value) for key, value in scope["headers"]
+            if key not in (b"content-encoding", b"content-length")]
+        decompressor = zlib.decompressobj(31)
+        # compressed input not decompressed yet, end of input reached,
+        # whole body handed to the app
+        pending = b""
+        done = False
+        delivered = False
+        total = 0
+
+        async def decompressing_receive():
+            nonlocal pending, done, delivered, total
+            if delivered:
+                # e.g. http.disconnect, awaited by streaming responses
+                return await receive()
+            if not pending and not done:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                pending = message.get("body", b"")
+                done = not message.get("more_body", False)
+            try:
+                body = decompressor.decompress(pending,
+                                               DECOMPRESS_CHUNK_SIZE)
+            except zlib.error as e:
+                raise CompressedDataError(f"bad gzip request body: {e}")
+            pending = decompressor.unconsumed_tail
+            total += len(body)
+            if limit is not None and total > limit:
+                raise RequestTooLargeError(
+                    f"request larger than {limit} bytes")
+            # a full chunk may leave output inside the decompressor
+            if done and not pending and len(body) < DECOMPRESS_CHUNK_SIZE:
+                if not decompressor.eof:
+                    raise CompressedDataError("truncated gzip request body")
+                delivered = True
+                return {"type": "http.request", "body": body,
+                        "more_body": False}
+            return {"type": "http.request", "body": body, "more_body": True}
+
+        await call_limited(self.app, scope, decompressing_receive, send)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+igc_lib analysis, runs inside the worker processes.
+
+Kept free of FastAPI so that everything returned or raised here can be
+pickled back to the server process.
+"""
+
+import sys
+import os
+import math
+import json
+import array
+
+import msgpack
+import orjson
+
+from metrics import stage
+from simplify import simplify_result
+from numpy_engine import NumpyFlight
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'igc_lib'))
+from igc_lib import igc_lib
+
+# segmentation engines, name: Flight class
+ENGINES = {
+    "igc_lib": igc_lib.Flight,
+    "numpy"  : NumpyFlight,
+}
+
+
+# bytes fed to IgcParser at a time
+PARSE_CHUNK_SIZE = 1024 * 1024
+
+
+class InvalidFlightError(ValueError):
+    """igc_lib rejected the flight, message carries flight.notes"""
+
+
+class RawJSON(str):
+    """Already serialized JSON, spliced into the output as is
+
+    igc_lib delivers summary and GeoJSON as JSON strings, decoding them
+    only to encode them again is most of the serialization cost.
+    """
+
+
+def loads_raw(value):
+    """Decoded value if it is RawJSON, else value unchanged"""
+    return orjson.loads(value) if isinstance(value, RawJSON) else value
+
+
+def _default(obj):
+    # orjson hook, called for str/int/dict/list subclasses too because
+    # of OPT_PASSTHROUGH_SUBCLASS
+    if isinstance(obj, RawJSON):
+        return orjson.Fragment(obj)
+    for base in (str, int, float, dict, list):
+        if isinstance(obj, base):
+            return base(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj):
+    """orjson encoding with RawJSON splicing and numpy support, bytes"""
+    return orjson.dumps(
+        obj,
+        default=_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+
+class IgcParser:
+    """Incremental igc record parser
+
+    Same record handling as igc_lib.Flight.create_from_file. feed()
+    takes arbitrary chunks of bytes, a line split across chunks is
+    carried over to the next call.
+    """
+
+    def __init__(self):
+        self.fixes = []
+        self.a_records = []
+        self.h_records = []
+        self.i_records = []
+        self._partial = b""
+
+    def feed(self, chunk):
+        """Parse all complete lines of chunk, returns number of new fixes"""
+        n = len(self.fixes)
+        if self._partial:
+            chunk = self._partial + chunk
+        lines = chunk.split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._record(line)
+        return len(self.fixes) - n
+
+    def close(self):
+        """Parse a trailing line without line break"""
+        n = len(self.fixes)
+        if self._partial:
+            self._record(self._partial)
+            self._partial = b""
+        return len(self.fixes) - n
+
+    def _record(self, raw):
+        line = raw.decode("ISO-8859-1").replace('\r', '')
+        if not line:
+            return
+        if line[0] == 'A':
+            self.a_records.append(line)
+        elif line[0] == 'B':
+            fixes = self.fixes
+            fix = igc_lib.GNSSFix.build_from_B_record(line, index=len(fixes))
+            if fix is not None:
+                # time did not change since the previous fix, ignore
+                if fixes and math.fabs(fix.rawtime - fixes[-1].rawtime) < 1e-5:
+                    return
+                fixes.append(fix)
+        elif line[0] == 'I':
+            self.i_records.append(line)
+        elif line[0] == 'H':
+            self.h_records.append(line)
+
+    def flight(self, config_class=igc_lib.FlightParsingConfig, start=0,
+               engine="igc_lib"):
+        """igc_lib.Flight of the fixes parsed so far
+
+        Args:
+            config_class: igc_lib.FlightParsingConfig (sub)class
+            start: index of the first fix to include
+            engine: key of ENGINES
+        """
+        fixes = self.fixes[start:]
+        if fixes and fixes[-1].index != len(fixes) - 1:
+            # igc_lib slices self.fixes by fix.index
+            for idx, fix in enumerate(fixes):
+                fix.index = idx
+        with stage("segment"):
+            return ENGINES[engine](fixes, self.a_records, self.h_records,
+                                   self.i_records, config_class())
+
+
+def flight_from_bytes(data, config_class=igc_lib.FlightParsingConfig,
+                      engine="igc_lib"):
+    """In-memory counterpart of igc_lib.Flight.create_from_file
+
+    Args:
+        data: igc file content, bytes or bytearray
+        config_class: igc_lib.FlightParsingConfig (sub)class
+        engine: key of ENGINES
+    """
+    parser = IgcParser()
+    with stage("parse"):
+        # in chunks, the split lines of the whole file are never held
+        for i in range(0, len(data), PARSE_CHUNK_SIZE):
+            parser.feed(data[i:i + PARSE_CHUNK_SIZE])
+        parser.close()
+    return parser.flight(config_class, engine=engine)
+
+
+def flight_from_file(path, config_class=igc_lib.FlightParsingConfig,
+                     engine="igc_lib"):
+    """flight_from_bytes of a file, read in chunks of PARSE_CHUNK_SIZE
+
+    The file content is never held in memory as a whole.
+    """
+    parser = IgcParser()
+    with stage("parse"), open(path, "rb") as f:
+        while chunk := f.read(PARSE_CHUNK_SIZE):
+            parser.feed(chunk)
+        parser.close()
+    return parser.flight(config_class, engine=engine)
+
+
+def load_flight(source, config_class=igc_lib.FlightParsingConfig,
+                engine="igc_lib"):
+    """flight_from_bytes or flight_from_file
+
+    Args:
+        source: igc file content (bytes or bytearray), or path of an igc
+            file, e.g. upload.IgcFile.path
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return flight_from_bytes(source, config_class, engine)
+    return flight_from_file(source, config_class, engine)
+
+
+# igc_lib custom settings, defaults of the API
+class igcLibCfg(igc_lib.FlightParsingConfig):
+    min_time_for_bearing_change = 2.0
+    min_time_for_thermal = 30
+
+
+# settings that can be overridden per request. Both only affect the
+# glide/thermal detection, see resegment()
+TUNABLE_SETTINGS = ("min_time_for_bearing_change", "min_time_for_thermal")
+
+
+def make_config(settings=None):
+    """igcLibCfg with per-request overrides applied
+
+    Settings travel to the workers as plain dicts, the config class is
+    built on the worker side (dynamic classes do not pickle).
+
+    Args:
+        settings: dict, keys from TUNABLE_SETTINGS
+    """
+    if not settings:
+        return igcLibCfg
+    unknown = set(settings) - set(TUNABLE_SETTINGS)
+    if unknown:
+        raise ValueError(f"unknown settings: {sorted(unknown)}")
+    return type("igcLibCfg", (igcLibCfg,), dict(settings))
+
+
+def effective_settings(config_class):
+    """TUNABLE_SETTINGS values of config_class, dict"""
+    return {key: getattr(config_class, key) for key in TUNABLE_SETTINGS}
+
+
+def config_fingerprint(config_class):
+    """Stable string of all effective FlightParsingConfig settings
+
+    Includes inherited igc_lib defaults, so that a changed default in
+    igc_lib also changes the fingerprint.
+    """
+    settings = {}
+    for key in dir(config_class):
+        value = getattr(config_class, key)
+        if key.startswith('_') or callable(value):
+            continue
+        settings[key] = value
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+def resegment(flight, config_class):
+    """Rerun the glide/thermal detection of a parsed flight
+
+    Fixes, ground speeds, takeoff/landing and bearings do not depend on
+    TUNABLE_SETTINGS and are kept, only the stages after them run again
+    (igc_lib internals, same order as in Flight.__init__).
+
+    Args:
+        flight: valid igc_lib.Flight
+        config_class: igc_lib.FlightParsingConfig (sub)class
+    """
+    with stage("resegment"):
+        flight._config = config_class()
+        flight._compute_bearing_change_rates()
+        flight._compute_circling()
+        flight._find_thermals()
+
+
+def track_analysis(source, settings=None, engine="igc_lib"):
+    """igc_lib wrapper, combined output dict
+
+    Args:
+        source: igc file content or path, see load_flight()
+        settings: dict, overrides of igcLibCfg, see make_config()
+        engine: key of ENGINES
+
+    Raises:
+        InvalidFlightError: igc_lib reports the flight as invalid
+    """
+
+    # load via igc_lib
+    flight = load_flight(source, make_config(settings), engine)
+
+    # if flight invalid, return igc_lib debug info
+    if not flight.valid:
+        raise InvalidFlightError(
+            "igc_lib: flight invalid: %s" % flight.notes)
+
+    # combine and output, igc_lib JSON strings are kept serialized
+    with stage("summary"):
+        return {
+            "info"        : RawJSON(flight.flight_summary()),
+            "glides"      : RawJSON(flight.glides_to_gdf()),
+            "thermals"    : RawJSON(flight.thermals_to_gdf()),
+            "track_points": flight.timeseries().get('track_points')
+             }
+
+
+# output formats, name: media type
+FORMATS = {
+    "json"    : "application/json",
+    "columnar": "application/vnd.xcmetrics.columnar+json",
+    "msgpack" : "application/msgpack",
+}
+
+
+def to_columns(records):
+    """list of dicts (one per fix) -> dict of lists (one per field)"""
+    if not records:
+        return {}
+    keys = dict.fromkeys(k for r in records for k in r)
+    return {k: [r.get(k) for r in records] for k in keys}
+
+
+def to_typed_array(values):
+    """Numeric column as little-endian typed array, else None
+
+    ints -> int64, floats (or ints with gaps) -> float64 with None as NaN,
+    decode e.g. with numpy.frombuffer(data, dtype)
+    """
+    if all(type(v) is int for v in values):
+        arr, dtype = array.array('q', values), "<i8"
+    elif all(v is None or type(v) in (int, float) for v in values):
+        arr = array.array(
+            'd', (math.nan if v is None else v for v in values))
+        dtype = "<f8"
+    else:
+        return None
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return {"dtype": dtype, "data": arr.tobytes()}
+
+
+def render(result, fmt="json"):
+    """Serialize a track_analysis result
+
+    Args:
+        result: track_analysis output dict
+        fmt: one of FORMATS
+            json     : as is, track_points is a list of per-fix objects
+            columnar : track_points as struct of arrays, JSON
+            msgpack  : track_points as struct of typed arrays, numeric
+                       columns as raw little-endian buffers
+
+    Returns:
+        response body, bytes
+    """
+    if fmt == "json":
+        return dumps(result)
+
+    columns = to_columns(result["track_points"])
+    if fmt == "columnar":
+        return dumps(dict(result, track_points=columns))
+
+    if fmt == "msgpack":
+        for key, values in columns.items():
+            typed = to_typed_array(values)
+            if typed is not None:
+                columns[key] = typed
+        result = {key: loads_raw(value) for key, value in result.items()}
+        return msgpack.packb(dict(result, track_points=columns))
+
+    raise ValueError(f"unknown format {fmt}")
+
+
+def track_analysis_render(source, settings=None, fmt="json", simplify=None,
+                          engine="igc_lib"):
+    """track_analysis, serialized in the worker
+
+    Returns the response body as bytes, which is cheap to pickle back to
+    the server process and can be cached as is.
+
+    Args:
+        simplify: dict, tolerance [m] and/or interval [s], see
+            simplify.simplify_result
+    """
+    result = track_analysis(source, settings, engine)
+    if simplify:
+        with stage("simplify"):
+            for key in ("glides", "thermals"):
+                result[key] = loads_raw(result[key])
+            simplify_result(result, **simplify)
+    with stage("serialize"):
+        return render(result, fmt)
+
+
+def track_analysis_sweep(source, settings_list, engine="igc_lib"):
+    """Parse once, segment once per settings
+
+    Args:
+        source: igc file content or path, see load_flight()
+        settings_list: list of dicts, overrides of igcLibCfg
+        engine: key of ENGINES
+
+    Returns:
+        JSON bytes, {"results": [{"settings", "info", "glides",
+        "thermals"}, ...]} in the order of settings_list
+    """
+    flight = load_flight(source, make_config(settings_list[0]), engine)
+    if not flight.valid:
+        raise InvalidFlightError(
+            "igc_lib: flight invalid: %s" % flight.notes)
+
+    results = []
+    for idx, settings in enumerate(settings_list):
+        config_class = make_config(settings)
+        if idx:
+            resegment(flight, config_class)
+        results.append({
+            "settings": effective_settings(config_class),
+            "info"    : RawJSON(flight.flight_summary()),
+            "glides"  : RawJSON(flight.glides_to_gdf()),
+            "thermals": RawJSON(flight.thermals_to_gdf()),
+        })
+    return render({"results": results})
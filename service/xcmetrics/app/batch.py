@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Batch processing of many igc files with NDJSON result streaming.
+
+Sources are read lazily, one flight per free worker slot, so memory and
+temporary files are bounded by the number of workers rather than by the
+size of the upload or archive. Results are emitted in completion order.
+
+FastAPI before 0.118 closes the request's UploadFiles as soon as the
+endpoint returns, before a StreamingResponse body runs, so the uploads
+are first copied to spooled temporary files owned by the stream. The
+copies are bounded in total bytes and in the number of flights, and
+every flight by the per-file limit.
+"""
+
+import asyncio
+import json
+import logging
+import tempfile
+import zipfile
+from functools import partial
+
+from analysis import InvalidFlightError
+from upload import (CHUNK_SIZE, CompressedDataError, UploadTooLargeError,
+                    is_igc, spool_igc)
+from worker_pool import PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# spooled copies of uploads move to disk beyond this size, as Starlette's
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class BatchInputError(ValueError):
+    """Upload or archive member that cannot be processed"""
+
+
+def _reject(message):
+    raise BatchInputError(message)
+
+
+def _read_member(archive, info, max_bytes):
+    # announced size, rejected before decompressing anything
+    if info.file_size > max_bytes:
+        raise UploadTooLargeError(
+            f"{info.filename}: larger than {max_bytes} bytes")
+    with archive.open(info) as f:
+        return spool_igc(f, info.filename, max_bytes)
+
+
+def _too_large(name, max_bytes):
+    raise UploadTooLargeError(f"{name}: larger than {max_bytes} bytes")
+
+
+def _igc_members(archive):
+    """ZipInfo of the *.igc(.gz) files of a zip archive"""
+    for info in archive.infolist():
+        member = info.filename
+        if (info.is_dir() or member.startswith("__MACOSX/")
+                or not is_igc(member)):
+            continue
+        yield info
+
+
+def _count_flights(name, fileobj):
+    if is_igc(name):
+        return 1
+    try:
+        count = sum(1 for _ in _igc_members(zipfile.ZipFile(fileobj)))
+    except zipfile.BadZipFile:
+        # reported as an error entry, see iter_igc_sources
+        count = 0
+    fileobj.seek(0)
+    return count
+
+
+def spool_uploads(uploads, max_bytes, max_total, max_files):
+    """Copies of the uploads that outlive the request
+
+    .igc(.gz) uploads are copied up to max_bytes, a larger one gets file
+    None (a gzip file larger than max_bytes does not decompress to
+    less). Uploads of other types are not copied, they are rejected by
+    name. The caller closes the copies, see close_uploads.
+
+    Args:
+        uploads: list of fastapi UploadFile
+        max_bytes: maximum (decompressed) size per flight
+        max_total: maximum bytes of all copies
+        max_files: maximum number of flights, .igc(.gz) uploads and
+            archive members
+
+    Returns:
+        list of (name, binary file object or None)
+
+    Raises:
+        UploadTooLargeError: more than max_total bytes or max_files
+            flights
+    """
+    spooled = []
+    total = 0
+    files = 0
+    try:
+        for upload in uploads:
+            name = upload.filename or ""
+            if not (is_igc(name) or name.lower().endswith(".zip")):
+                spooled.append((name, None))
+                continue
+            copy = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            spooled.append((name, copy))
+            upload.file.seek(0)
+            while chunk := upload.file.read(CHUNK_SIZE):
+                total += len(chunk)
+                if total > max_total:
+                    raise UploadTooLargeError(
+                        f"batch larger than {max_total} bytes")
+                copy.write(chunk)
+                if is_igc(name) and copy.tell() > max_bytes:
+                    copy.close()
+                    spooled[-1] = (name, None)
+                    break
+            else:
+                copy.seek(0)
+            files += _count_flights(name, copy)
+            if files > max_files:
+                raise UploadTooLargeError(
+                    f"batch of more than {max_files} flights")
+    except BaseException:
+        close_uploads(spooled)
+        raise
+    return spooled
+
+
+def close_uploads(spooled):
+    """Close the copies made by spool_uploads"""
+    for _, fileobj in spooled:
+        if fileobj is not None:
+            fileobj.close()
+
+
+def iter_igc_sources(uploads, max_bytes):
+    """(name, read) per flight, read() returns an upload.IgcFile
+
+    .zip uploads are expanded member by member, only *.igc members are
+    considered. .igc.gz uploads and members are decompressed. Unusable
+    uploads yield a read() that raises, so they end up as per-file
+    error entries.
+
+    Args:
+        uploads: list of (name, binary file object or None), see
+            spool_uploads
+        max_bytes: maximum (decompressed) size per flight
+    """
+    for name, fileobj in uploads:
+        if is_igc(name) and fileobj is None:
+            yield name, partial(_too_large, name, max_bytes)
+        elif is_igc(name):
+            yield name, partial(spool_igc, fileobj, name, max_bytes)
+        elif name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(fileobj)
+            except zipfile.BadZipFile as e:
+                yield name, partial(_reject, f"bad zip archive: {e}")
+                continue
+            for info in _igc_members(archive):
+                yield f"{name}/{info.filename}", partial(
+                    _read_member, archive, info, max_bytes)
+        else:
+            yield name, partial(_reject,
+                                "File format not .igc, .igc.gz or .zip")
+
+
+async def _run(name, read, analyze):
+    """NDJSON line for one source, failures become error entries"""
+    head = b'{"file":' + json.dumps(name).encode("utf-8")
+    try:
+        with await asyncio.to_thread(read) as igc:
+            body = await analyze(igc)
+        # splice the serialized result, no decode / re-encode
+        return head + b',"result":' + body + b'}\n'
+    except (BatchInputError, InvalidFlightError, CompressedDataError,
+            zipfile.BadZipFile) as e:
+        status, error = 400, str(e)
+    except UploadTooLargeError as e:
+        status, error = 413, str(e)
+    except PoolTimeoutError as e:
+        status, error = 504, f"Timeout: {str(e)}"
+    except Exception as e:
+        logger.error(f"batch: {name} failed", exc_info=True)
+        status, error = 500, f"Internal Error: {str(e)}"
+    tail = json.dumps({"error": error, "status": status}).encode("utf-8")
+    return head + b"," + tail[1:] + b"\n"
+
+
+async def stream_ndjson(sources, analyze, window):
+    """Async generator of NDJSON lines, in completion order
+
+    Args:
+        sources: iterable of (name, read), see iter_igc_sources
+        analyze: coroutine function, upload.IgcFile -> serialized JSON
+            result
+        window: maximum flights in flight at a time
+    """
+    sources = iter(sources)
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    name, read = next(sources)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.create_task(_run(name, read, analyze)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # client went away
+        for task in pending:
+            task.cancel()
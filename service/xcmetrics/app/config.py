@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Configuration for xcmetrics service.
+"""
+
+import os
+
+# Number of worker processes for igc_lib parsing and segmentation
+# Defaults to one per CPU core
+WORKERS = int(os.environ.get("XCMETRICS_WORKERS", os.cpu_count() or 1))
+
+# Maximum number of jobs admitted to the pool (running + queued).
+# Requests beyond this are rejected with 503 instead of piling up.
+MAX_PENDING = int(os.environ.get("XCMETRICS_MAX_PENDING", 4 * WORKERS))
+
+# Maximum size of an uploaded igc file in bytes, after decompression.
+# Larger uploads are rejected with 413, by Content-Length before reading.
+MAX_UPLOAD_BYTES = int(os.environ.get("XCMETRICS_MAX_UPLOAD_BYTES",
+                                      64 * 2**20))
+
+# POST /batch: maximum request size in bytes, all files and archives
+# together as uploaded, and maximum number of flights (files and .igc
+# archive members). Larger batches are rejected with 413.
+MAX_BATCH_BYTES = int(os.environ.get("XCMETRICS_MAX_BATCH_BYTES",
+                                     256 * 2**20))
+MAX_BATCH_FILES = int(os.environ.get("XCMETRICS_MAX_BATCH_FILES", 1000))
+
+# Per-job wall-clock limit in seconds
+JOB_TIMEOUT = float(os.environ.get("XCMETRICS_JOB_TIMEOUT", 120))
+
+# Result cache: memory tier capacity in bytes (0 disables caching) and
+# optional directory of the persistent disk tier
+CACHE_MAX_BYTES = int(os.environ.get("XCMETRICS_CACHE_MAX_BYTES", 256 * 2**20))
+CACHE_DIR = os.environ.get("XCMETRICS_CACHE_DIR") or None
+
+# Live tracking sessions: seconds without update before a session
+# expires, and cap of fixes held across all sessions (memory)
+LIVE_IDLE_TIMEOUT = float(os.environ.get("XCMETRICS_LIVE_IDLE_TIMEOUT", 900))
+LIVE_MAX_FIXES = int(os.environ.get("XCMETRICS_LIVE_MAX_FIXES", 500000))
+
+# Live tracking uploads: bytes per chunk (POST /live/{session}) and
+# bytes per session over its lifetime, larger ones get 413
+LIVE_MAX_CHUNK_BYTES = int(os.environ.get("XCMETRICS_LIVE_MAX_CHUNK_BYTES",
+                                          2**20))
+LIVE_MAX_SESSION_BYTES = int(os.environ.get(
+    "XCMETRICS_LIVE_MAX_SESSION_BYTES", MAX_UPLOAD_BYTES))
+
+# Default segmentation engine, "igc_lib" or "numpy" (vectorized),
+# can be overridden per request with ?engine=
+ENGINE = os.environ.get("XCMETRICS_ENGINE", "igc_lib")
+
+# Response compression (gzip/brotli, negotiated with Accept-Encoding):
+# minimum body size in bytes, gzip level 1-9 and brotli quality 0-11
+COMPRESS_MIN_SIZE = int(os.environ.get("XCMETRICS_COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("XCMETRICS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("XCMETRICS_BROTLI_QUALITY", 4))
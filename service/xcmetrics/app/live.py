@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Live tracking sessions.
+
+A session keeps the parser state of one growing track. Each chunk of igc
+records is parsed once, and the glide/thermal detection only runs over
+a trailing window: segments that ended more than SETTLE_SECONDS before
+the latest fix are considered final, reported once and their fixes are
+dropped. Cost per chunk and memory per session are bounded by the
+length of the open segments, not by the length of the flight.
+
+Responses only carry segments that are new or changed since the
+previous chunk, plus the ids of provisional segments that disappeared.
+
+The session itself only holds raw records: the A/H/I headers and the B
+records of the window. Parsing and segmentation of the window are pure
+Python and CPU bound, they run in the process pool (segment_window)
+under its admission control. A chunk is committed to the session only
+once its job succeeded, so a chunk rejected with 503 or 504 can simply
+be sent again.
+
+Windowed segmentation is an approximation of the full-flight one. The
+detection smooths bearing changes over min_time_for_bearing_change and
+requires min_time_for_thermal of circling, so near the start of the
+window (the end of the last final segment) it can see a segment
+differently than it would with the fixes before the cut: the first
+provisional segment may start a few fixes later, or a short segment
+right at the cut may be missed or merged. Final segments are never
+revised, so a live session can report slightly different glides and
+thermals than POST / on the complete file.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from analysis import IgcParser, make_config
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# a segment is final once the track went on this long after its end
+SETTLE_SECONDS = 120
+
+
+class SessionNotFound(KeyError):
+    """Unknown or expired session id"""
+
+
+class SessionLimitError(Exception):
+    """Memory or size cap reached"""
+
+
+def _segment_id(kind, segment):
+    return f"{kind}-{int(segment.enter_fix.timestamp)}"
+
+
+def _features(geojson, segments, kind):
+    """(id, feature) per segment, igc_lib GeoJSON in segment order"""
+    features = json.loads(geojson).get("features", [])
+    if len(features) != len(segments):
+        logger.warning(f"live: {len(features)} {kind} features for "
+                       f"{len(segments)} segments")
+    return [(_segment_id(kind, s), f) for s, f in zip(segments, features)]
+
+
+def segment_window(header, records, settings=None, engine="igc_lib"):
+    """Glide/thermal detection over the window, runs in a pool worker
+
+    Args:
+        header: A/H/I records, bytes lines
+        records: B records of the window, bytes lines
+        settings: dict, see analysis.make_config
+        engine: key of analysis.ENGINES
+
+    Returns:
+        dict, fixes: fixes in the window, segments: (live_id, feature,
+        final) in glides, thermals order, drop_records/drop_fixes: B
+        records and fixes before the next window
+    """
+    config_class = make_config(settings)
+    parser = IgcParser()
+    # B record of each fix, duplicates and bad records give no fix
+    record_of = []
+    with stage("live_parse"):
+        for line in header:
+            parser.feed(line + b"\n")
+        for i, line in enumerate(records):
+            if parser.feed(line + b"\n"):
+                record_of.append(i)
+    fixes = parser.fixes
+    out = {"fixes": len(fixes), "segments": [],
+           "drop_records": 0, "drop_fixes": 0}
+    if len(fixes) < config_class.min_fixes:
+        return out
+    flight = parser.flight(config_class, engine=engine)
+    if not flight.valid:
+        # e.g. still on the ground, no takeoff yet
+        return out
+
+    settle = fixes[-1].timestamp - SETTLE_SECONDS
+    segments = (
+        _features(flight.glides_to_gdf(), flight.glides, "glide") +
+        _features(flight.thermals_to_gdf(), flight.thermals, "thermal"))
+    ends = {_segment_id("glide", s): s.exit_fix for s in flight.glides}
+    ends.update({_segment_id("thermal", s): s.exit_fix
+                 for s in flight.thermals})
+
+    # window restarts at the end of the latest final segment
+    start = 0
+    for live_id, feature in segments:
+        exit_fix = ends[live_id]
+        final = exit_fix.timestamp < settle
+        props = feature.setdefault("properties", {})
+        props["live_id"] = live_id
+        props["final"] = final
+        if final:
+            start = max(start, exit_fix.index)
+        out["segments"].append((live_id, feature, final))
+    out["drop_fixes"] = start
+    out["drop_records"] = record_of[start] if start < len(record_of) \
+        else len(records)
+    return out
+
+
+class LiveSession:
+    """Raw records and segmentation state of one live track"""
+
+    def __init__(self, settings=None, engine="igc_lib", max_bytes=None):
+        """
+        Args:
+            settings: dict, see analysis.make_config
+            engine: key of analysis.ENGINES
+            max_bytes: bytes accepted over the session's lifetime, None
+                for no limit
+        """
+        self.settings = settings
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.received = 0
+        # A/H/I records, and the B records of the window
+        self.header = []
+        self.records = []
+        # line split across chunks
+        self._partial = b""
+        # fixes before the window are dropped, only the count is kept
+        self.dropped = 0
+        # id: feature of the provisional segments of the last update
+        self.provisional = {}
+        self.last_access = time.monotonic()
+        # chunks of a session are applied one at a time, in order
+        self.lock = asyncio.Lock()
+
+    @property
+    def size(self):
+        """Number of B records held, i.e. the segmentation window"""
+        return len(self.records)
+
+    async def update(self, chunk, run):
+        """Feed a chunk of igc records, returns the changes
+
+        Args:
+            chunk: bytes
+            run: coroutine function, run(fn, *args) in a worker process,
+                e.g. AnalysisPool.run
+
+        Returns:
+            dict, fixes: total fixes, glides/thermals: new or changed
+            features (properties.live_id, properties.final), removed:
+            live_ids of provisional segments that no longer exist
+
+        Raises:
+            SessionLimitError: more than max_bytes received in total
+        """
+        async with self.lock:
+            if (self.max_bytes is not None and
+                    self.received + len(chunk) > self.max_bytes):
+                raise SessionLimitError(
+                    f"session exceeds {self.max_bytes} bytes")
+            lines = (self._partial + chunk).split(b"\n")
+            partial = lines.pop()
+            header = self.header + [
+                line for line in lines if line[:1] in (b"A", b"H", b"I")]
+            records = self.records + [
+                line for line in lines if line[:1] == b"B"]
+
+            window = await run(segment_window, header, records,
+                               self.settings, self.engine)
+
+            # job succeeded, commit the chunk
+            self.received += len(chunk)
+            self._partial = partial
+            self.header = header
+            self.records = records[window["drop_records"]:]
+            out = {"fixes": self.dropped + window["fixes"], "glides": [],
+                   "thermals": [], "removed": []}
+            self.dropped += window["drop_fixes"]
+
+            provisional = {}
+            for live_id, feature, final in window["segments"]:
+                if not final:
+                    provisional[live_id] = feature
+                if final or self.provisional.get(live_id) != feature:
+                    kind = live_id.split("-")[0] + "s"
+                    out[kind].append(feature)
+            current = {live_id for live_id, _, _ in window["segments"]}
+            out["removed"] = [i for i in self.provisional if i not in current]
+            self.provisional = provisional
+            return out
+
+
+class SessionStore:
+    """Live sessions with idle expiry and a cap on the fixes held"""
+
+    def __init__(self, idle_timeout: float, max_fixes: int,
+                 max_session_bytes=None):
+        """
+        Args:
+            idle_timeout: seconds without update before a session expires
+            max_fixes: fixes held across all sessions
+            max_session_bytes: bytes accepted per session, None for no
+                limit
+        """
+        self.idle_timeout = idle_timeout
+        self.max_fixes = max_fixes
+        self.max_session_bytes = max_session_bytes
+        self._sessions: "OrderedDict[str, LiveSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire(self):
+        now = time.monotonic()
+        for sid in list(self._sessions):
+            if now - self._sessions[sid].last_access > self.idle_timeout:
+                del self._sessions[sid]
+                logger.info(f"live: session {sid} expired")
+
+    def create(self, settings=None, engine="igc_lib"):
+        with self._lock:
+            self._expire()
+            sid = uuid.uuid4().hex
+            self._sessions[sid] = LiveSession(settings, engine,
+                                              self.max_session_bytes)
+            return sid
+
+    def get(self, sid):
+        """Session for sid, marks it as most recently used"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(sid)
+            if session is None:
+                raise SessionNotFound(sid)
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(sid)
+            return session
+
+    def delete(self, sid):
+        with self._lock:
+            if self._sessions.pop(sid, None) is None:
+                raise SessionNotFound(sid)
+
+    def enforce_limit(self, sid):
+        """Evict least recently used sessions until under max_fixes
+
+        Raises:
+            SessionLimitError: sid alone exceeds max_fixes, it is dropped
+        """
+        with self._lock:
+            total = sum(s.size for s in self._sessions.values())
+            for other in list(self._sessions):
+                if total <= self.max_fixes:
+                    return
+                if other == sid:
+                    continue
+                total -= self._sessions.pop(other).size
+                logger.info(f"live: session {other} evicted, memory cap")
+            if total > self.max_fixes:
+                self._sessions.pop(sid, None)
+                raise SessionLimitError(
+                    f"session exceeds {self.max_fixes} fixes")
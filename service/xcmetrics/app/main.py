@@ -1,76 +1,380 @@
 #!/usr/bin/env python
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-import sys
-import os
-import tempfile
+from fastapi import (FastAPI, File, Form, UploadFile, HTTPException,
+                     Request, Depends)
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, Counter, Gauge,
+                               generate_latest)
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
 import json
+import logging
 
-sys.path.append(os.path.join(os.path.dirname(__file__), 'igc_lib'))
-from igc_lib import igc_lib
+from analysis import (track_analysis_render, track_analysis_sweep,
+                      config_fingerprint, make_config,
+                      InvalidFlightError, FORMATS)
+from worker_pool import AnalysisPool, PoolBusyError, PoolTimeoutError
+from result_cache import ResultCache, make_key
+from batch import (iter_igc_sources, stream_ndjson, spool_uploads,
+                   close_uploads)
+from live import SessionStore, SessionNotFound, SessionLimitError
+from compression import CompressionMiddleware
+from upload import (GzipRequestMiddleware, UploadLimitMiddleware,
+                    CompressedDataError, UploadTooLargeError,
+                    MULTIPART_OVERHEAD, is_igc, spool_igc)
+from metrics import MetricsMiddleware
+from config import (WORKERS, MAX_PENDING, JOB_TIMEOUT, MAX_UPLOAD_BYTES,
+                    MAX_BATCH_BYTES, MAX_BATCH_FILES,
+                    CACHE_MAX_BYTES, CACHE_DIR,
+                    LIVE_IDLE_TIMEOUT, LIVE_MAX_FIXES, LIVE_MAX_CHUNK_BYTES,
+                    LIVE_MAX_SESSION_BYTES, ENGINE,
+                    COMPRESS_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY)
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter(
+    "xcmetrics_cache_requests_total", "Result cache lookups", ["result"])
+POOL_PENDING = Gauge(
+    "xcmetrics_pool_pending_jobs", "Jobs running or queued in the pool")
+LIVE_SESSIONS = Gauge(
+    "xcmetrics_live_sessions", "Open live tracking sessions")
+
+# Global process pool and result cache instances
+pool = None
+cache = None
+# live tracking sessions, held in this process
+sessions = SessionStore(LIVE_IDLE_TIMEOUT, LIVE_MAX_FIXES,
+                        LIVE_MAX_SESSION_BYTES)
+
+# bump when the response layout changes, invalidates persisted entries
+RESULT_VERSION = "1"
+
+# seconds a /batch job waits before retrying when the pool is full
+BATCH_RETRY_DELAY = 0.5
+
+# upper limit of settings per /sweep request
+MAX_SWEEP_SETTINGS = 50
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage process pool and result cache lifecycle."""
+    global pool, cache
+
+    pool = AnalysisPool(WORKERS, MAX_PENDING, JOB_TIMEOUT)
+    logger.info(f"process pool started with {WORKERS} workers")
+    if CACHE_MAX_BYTES or CACHE_DIR:
+        cache = ResultCache(CACHE_MAX_BYTES, CACHE_DIR)
+
+    yield
+
+    pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_SIZE,
+                   gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY)
+# decompressed size, /batch has a limit of its own
+app.add_middleware(GzipRequestMiddleware,
+                   max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+                   limits={"/batch": MAX_BATCH_BYTES + MULTIPART_OVERHEAD})
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES,
+                   limits={"/batch": MAX_BATCH_BYTES})
+# outermost, sizes as on the wire
+app.add_middleware(MetricsMiddleware)
+
+POOL_PENDING.set_function(lambda: pool.pending if pool else 0)
+LIVE_SESSIONS.set_function(lambda: len(sessions))
 
 @app.get("/")
 async def alive():
     return {"message": "xcmetrics"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics, text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def etag_matches(etag, if_none_match):
+    """If-None-Match header check, weak comparison (RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
+
+# Accept header media type: output format
+MEDIA_TYPES = {media: fmt for fmt, media in FORMATS.items()}
+MEDIA_TYPES["application/x-msgpack"] = "msgpack"
+
+def negotiate_format(fmt, accept):
+    """Output format from ?format= (takes precedence) or Accept header
+
+    Unknown media types in Accept are skipped, default is json.
+    """
+    if fmt is not None:
+        if fmt not in FORMATS:
+            raise HTTPException(
+                status_code=400, # bad request
+                detail=f"format must be one of {', '.join(FORMATS)}")
+        return fmt
+    for media in (accept or "").split(","):
+        media = media.split(";")[0].strip().lower()
+        if media in MEDIA_TYPES:
+            return MEDIA_TYPES[media]
+    return "json"
+
+class FlightSettings(BaseModel):
+    """igc_lib settings exposed through the API, None keeps the default"""
+    min_time_for_bearing_change: Optional[float] = Field(None, gt=0)
+    min_time_for_thermal: Optional[float] = Field(None, gt=0)
+
+SWEEP_SETTINGS = TypeAdapter(List[FlightSettings])
+
+class SimplifySettings(BaseModel):
+    """Output simplification for map display, None disables a stage
+
+    tolerance: Douglas-Peucker tolerance in meters, track_points and
+        glide/thermal LineStrings
+    interval: time thinning of track_points, seconds
+    """
+    tolerance: Optional[float] = Field(None, gt=0)
+    interval: Optional[float] = Field(None, gt=0)
+
+# ?engine= values, segmentation engine, see analysis.ENGINES
+Engine = Optional[Literal["igc_lib", "numpy"]]
+
+def result_key(igc, settings, fmt, simplify=None, engine=ENGINE):
+    """Cache key / ETag of the response for igc in format fmt
+
+    igc: upload.IgcFile, hashed while it was spooled
+    """
+    fingerprint = config_fingerprint(make_config(settings))
+    simplify = json.dumps(simplify or {}, sort_keys=True)
+    return make_key(igc.sha256, RESULT_VERSION, fingerprint, fmt, simplify,
+                    engine)
+
+async def cached_analysis(igc, settings, key, fmt, simplify=None,
+                          engine=ENGINE):
+    """Response body for key, from cache or computed in the process pool
+
+    The worker reads igc (upload.IgcFile) by path, in chunks.
+
+    Returns:
+        (body, "hit" | "miss")
+    """
+    body = await asyncio.to_thread(cache.get, key) if cache else None
+    if body is not None:
+        CACHE_REQUESTS.labels("hit").inc()
+        return body, "hit"
+    if cache:
+        CACHE_REQUESTS.labels("miss").inc()
+    body = await pool.run(track_analysis_render, igc.path, settings, fmt,
+                          simplify, engine)
+    if cache:
+        await asyncio.to_thread(cache.put, key, body)
+    return body, "miss"
+
+def http_error(e):
+    """HTTPException for an exception raised while processing a flight"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, (InvalidFlightError, CompressedDataError)):
+        return HTTPException(
+            status_code=400, # bad request
+            detail=str(e))
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(
+            status_code=413, # Content Too Large
+            detail=str(e))
+    if isinstance(e, PoolBusyError):
+        return HTTPException(
+            status_code=503, # Service Unavailable
+            detail=f"Busy: {str(e)}",
+            headers={"Retry-After": "1"})
+    if isinstance(e, PoolTimeoutError):
+        return HTTPException(
+            status_code=504, # Gateway Timeout
+            detail=f"Timeout: {str(e)}")
+    return HTTPException(
+        status_code=500, # Internal Server Error
+        detail=f"Internal Error: {str(e)}")
+
 @app.post("/")
-async def process(file: UploadFile = File(...)):
-    # Ensure the uploaded file is a .igc file
-    if not file.filename.lower().endswith(".igc"):
+async def process(request: Request, file: UploadFile = File(...),
+                  format: Optional[str] = None,
+                  settings: FlightSettings = Depends(),
+                  simplify: SimplifySettings = Depends(),
+                  engine: Engine = None):
+    # Ensure the uploaded file is a .igc or .igc.gz file
+    if not is_igc(file.filename):
         raise HTTPException(
-            status_code=400, # bad request 
-            detail="File format not .igc")
-    
+            status_code=400, # bad request
+            detail="File format not .igc or .igc.gz")
+
+    fmt = negotiate_format(format, request.headers.get("accept"))
+    settings = settings.model_dump(exclude_none=True)
+    simplify = simplify.model_dump(exclude_none=True)
+    engine = engine or ENGINE
+
     try:
-        # Save the uploaded file temporarily
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, file.filename)
-        with open(temp_path, "wb") as temp_file:
-            temp_file.write(await file.read())
-        # call subfunction
-        json_data = track_analysis(temp_path)
+        # chunked copy of the spooled upload, size limited and hashed
+        igc = await asyncio.to_thread(spool_igc, file.file, file.filename,
+                                      MAX_UPLOAD_BYTES)
+        with igc:
+            # identical content and settings give an identical response
+            key = result_key(igc, settings, fmt, simplify, engine)
+            etag = f'"{key}"'
+            if etag_matches(etag, request.headers.get("if-none-match")):
+                return Response(status_code=304,
+                                headers={"ETag": etag, "Vary": "Accept"})
+
+            # call subfunction
+            body, status = await cached_analysis(igc, settings, key, fmt,
+                                                 simplify, engine)
+
         # Return the processed JSON
-        return JSONResponse(content=json_data)
-    
+        return Response(
+            content=body,
+            media_type=FORMATS[fmt],
+            headers={"ETag": etag, "X-Cache": status, "Vary": "Accept"})
+
     except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
-        else:
-            raise HTTPException(
-                status_code=500, # Internal Server Error
-                detail=f"Internal Error: {str(e)}")
-    
-    finally:
-        os.remove(temp_path)
-
-def track_analysis(input_file):
-    """igc_lib wrapper, combined output dict
-    
-    Args:
-        path to igc file
-    """
+        raise http_error(e)
 
-    # igc_lib custom settings
-    # todo: make igc_lib settings accessible through FastAPI
-    class igcLibCfg(igc_lib.FlightParsingConfig):
-        min_time_for_bearing_change = 2.0
-        min_time_for_thermal = 30
+@app.post("/sweep")
+async def sweep(file: UploadFile = File(...),
+                settings: str = Form(...),
+                engine: Engine = None):
+    """Parameter sweep, parse once and segment once per settings
 
-    # load via igc_lib
-    flight = igc_lib.Flight.create_from_file(input_file,igcLibCfg)
+    settings: JSON list of FlightSettings objects, e.g.
+    [{"min_time_for_thermal": 20}, {"min_time_for_thermal": 40}]
+    """
+    if not is_igc(file.filename):
+        raise HTTPException(
+            status_code=400, # bad request
+            detail="File format not .igc or .igc.gz")
 
-    # if flight invalid, return igc_lib debug info
-    if not flight.valid:
+    try:
+        settings_list = SWEEP_SETTINGS.validate_json(settings)
+    except ValidationError as e:
         raise HTTPException(
             status_code=400, # bad request
-            detail=f"igc_lib: flight invalid: %s" % flight.notes)
-
-    # combine and output
-    return {
-        "info"        : json.loads(flight.flight_summary()),
-        "glides"      : json.loads(flight.glides_to_gdf()),
-        "thermals"    : json.loads(flight.thermals_to_gdf()),
-        "track_points": flight.timeseries().get('track_points')
-         }
\ No newline at end of file
+            detail=f"settings: {str(e)}")
+    if not 0 < len(settings_list) <= MAX_SWEEP_SETTINGS:
+        raise HTTPException(
+            status_code=400, # bad request
+            detail=f"settings: 1 to {MAX_SWEEP_SETTINGS} entries")
+    settings_list = [s.model_dump(exclude_none=True) for s in settings_list]
+
+    try:
+        igc = await asyncio.to_thread(spool_igc, file.file, file.filename,
+                                      MAX_UPLOAD_BYTES)
+        with igc:
+            body = await pool.run(track_analysis_sweep, igc.path,
+                                  settings_list, engine or ENGINE)
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        raise http_error(e)
+
+async def batch_analysis(igc, settings, engine):
+    """cached_analysis for /batch, waits for pool capacity instead of 503"""
+    key = result_key(igc, settings, "json", engine=engine)
+    while True:
+        try:
+            body, _ = await cached_analysis(igc, settings, key, "json",
+                                            engine=engine)
+            return body
+        except PoolBusyError:
+            await asyncio.sleep(BATCH_RETRY_DELAY)
+
+@app.post("/batch")
+async def batch(files: List[UploadFile] = File(...),
+                settings: FlightSettings = Depends(),
+                engine: Engine = None):
+    """Process many igc files, .igc(.gz) uploads and/or .zip archives
+
+    Streams one NDJSON line per flight as soon as it is done,
+    {"file": name, "result": {...}} or {"file": name, "error": "...",
+    "status": http status}. Only as many flights as there are pool
+    workers are decompressed at a time. Batches larger than
+    MAX_BATCH_BYTES or of more than MAX_BATCH_FILES flights get 413.
+    """
+    analyze = partial(batch_analysis,
+                      settings=settings.model_dump(exclude_none=True),
+                      engine=engine or ENGINE)
+    try:
+        # the UploadFiles may be closed before the response body runs
+        uploads = await asyncio.to_thread(spool_uploads, files,
+                                          MAX_UPLOAD_BYTES, MAX_BATCH_BYTES,
+                                          MAX_BATCH_FILES)
+    except Exception as e:
+        raise http_error(e)
+
+    async def body():
+        try:
+            sources = iter_igc_sources(uploads, MAX_UPLOAD_BYTES)
+            async for line in stream_ndjson(sources, analyze, pool.workers):
+                yield line
+        finally:
+            close_uploads(uploads)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.post("/live")
+async def live_open(settings: FlightSettings = Depends(),
+                    engine: Engine = None):
+    """Open a live tracking session
+
+    Then POST chunks of igc records (headers first) to /live/{session},
+    each response carries the glides/thermals that changed since the
+    previous chunk.
+    """
+    sid = sessions.create(settings.model_dump(exclude_none=True),
+                          engine or ENGINE)
+    return {"session": sid, "idle_timeout": sessions.idle_timeout}
+
+async def read_body(request, max_bytes):
+    """Request body, UploadTooLargeError beyond max_bytes
+
+    Counted while receiving, also for chunked bodies without
+    Content-Length.
+    """
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise UploadTooLargeError(f"chunk larger than {max_bytes} bytes")
+    return bytes(body)
+
+@app.post("/live/{sid}")
+async def live_update(sid: str, request: Request):
+    """Append a chunk of igc records (raw request body) to a session"""
+    try:
+        session = sessions.get(sid)
+        chunk = await read_body(request, LIVE_MAX_CHUNK_BYTES)
+        # parsing and segmentation of the window in the process pool
+        out = await session.update(chunk, pool.run)
+        sessions.enforce_limit(sid)
+        return out
+    except SessionNotFound:
+        raise HTTPException(
+            status_code=404, # Not Found
+            detail=f"live: no session {sid}")
+    except SessionLimitError as e:
+        raise HTTPException(
+            status_code=413, # Content Too Large
+            detail=f"live: {str(e)}")
+    except Exception as e:
+        raise http_error(e)
+
+@app.delete("/live/{sid}", status_code=204)
+async def live_close(sid: str):
+    try:
+        sessions.delete(sid)
+    except SessionNotFound:
+        raise HTTPException(
+            status_code=404, # Not Found
+            detail=f"live: no session {sid}")
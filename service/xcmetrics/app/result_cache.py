@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for processed flights.
+
+Results are keyed by the SHA-256 of the IGC bytes plus everything else
+that determines the output (parsing config, output options). Values are
+the serialized response bodies, so a hit skips igc_lib and the JSON
+encoding alike.
+
+Two tiers:
+- memory: LRU, evicted by total size in bytes
+- disk (optional): one file per key, survives restarts; not size
+  limited here, clean up externally if needed (e.g. tmpreaper, cron)
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(data, *parts: str) -> str:
+    """SHA-256 over the file content and the output-determining parts
+
+    data is the content (bytes), or a hashlib.sha256 object already fed
+    with it, e.g. upload.IgcFile.sha256
+    """
+    h = data.copy() if hasattr(data, "digest") else hashlib.sha256(data)
+    for part in parts:
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier (memory LRU, optional disk) cache of response bodies.
+
+    Thread-safe, so that the disk tier can be used from a thread pool.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None):
+        """
+        Args:
+            max_bytes: memory tier capacity, sum of cached body sizes
+            disk_dir: directory of the disk tier, None to disable
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def _disk_path(self, key: str) -> Path:
+        # fan out, avoids huge flat directories
+        return self.disk_dir / key[:2] / key
+
+    def _put_memory(self, key: str, value: bytes):
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            # larger than the whole tier, would only flush everything else
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Cached body for key, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.disk_dir:
+            try:
+                value = self._disk_path(key).read_bytes()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to read cache entry {key}: {e}")
+            else:
+                # promote to memory
+                self._put_memory(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes):
+        """Store body under key in all tiers"""
+        self._put_memory(key, value)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(exist_ok=True)
+                # write-then-rename, readers never see partial files
+                fd, tmp = tempfile.mkstemp(dir=path.parent)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(value)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.error(f"Failed to write cache entry {key}: {e}")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Track simplification for map display.
+
+- Douglas-Peucker with a tolerance in meters, on a local equirectangular
+  projection (accurate to well below the tolerance at flight scale)
+- time-based thinning, at most one fix per interval
+
+Both return the indices of the kept points into the original sequence,
+so clients can still join simplified geometry with per-fix data.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def project(lon, lat):
+    """lon/lat degrees -> local x/y meters, equirectangular at mean lat"""
+    lon = np.radians(np.asarray(lon, dtype=float))
+    lat = np.radians(np.asarray(lat, dtype=float))
+    x = EARTH_RADIUS_M * lon * np.cos(np.mean(lat))
+    y = EARTH_RADIUS_M * lat
+    return x, y
+
+
+def douglas_peucker(x, y, tolerance):
+    """Indices of the points kept by Douglas-Peucker
+
+    Iterative (no recursion limit on long tracks), the distances of all
+    points of a span to its chord are computed in one vectorized step.
+
+    Args:
+        x, y: coordinates in meters, numpy arrays
+        tolerance: maximum distance of a dropped point to the result
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return np.flatnonzero(keep)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        px = x[i + 1:j] - x[i]
+        py = y[i + 1:j] - y[i]
+        dx = x[j] - x[i]
+        dy = y[j] - y[i]
+        seg2 = dx * dx + dy * dy
+        if seg2 > 0:
+            # distance to the chord segment, not the infinite line
+            t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+            px = px - t * dx
+            py = py - t * dy
+        dist = np.hypot(px, py)
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+def thin_by_time(t, interval):
+    """Indices of the first point of every interval, plus the last point
+
+    Args:
+        t: timestamps in seconds, ascending numpy array
+        interval: seconds
+    """
+    if len(t) == 0:
+        return np.arange(0)
+    bucket = np.floor((t - t[0]) / interval)
+    first = np.flatnonzero(np.diff(bucket, prepend=-1) != 0)
+    return np.union1d(first, [len(t) - 1])
+
+
+def simplify_track_points(track_points, tolerance=None, interval=None):
+    """Simplify xcmetrics track_points
+
+    Time thinning runs first, Douglas-Peucker on what is left. The first
+    and last fix of every segment are always kept, so glide/thermal
+    coloring stays exact.
+
+    Args:
+        track_points: list of dicts with lat, lon, timestamp (ISO 8601)
+        tolerance: Douglas-Peucker tolerance in meters, None to skip
+        interval: time thinning interval in seconds, None to skip
+
+    Returns:
+        (kept track_points, indices into track_points)
+    """
+    n = len(track_points)
+    idx = np.arange(n)
+    if n < 3:
+        return track_points, idx.tolist()
+
+    if interval:
+        t = np.array([
+            datetime.fromisoformat(p["timestamp"]).timestamp()
+            for p in track_points])
+        idx = idx[thin_by_time(t, interval)]
+
+    if tolerance:
+        lon = np.array([track_points[i]["lon"] for i in idx])
+        lat = np.array([track_points[i]["lat"] for i in idx])
+        x, y = project(lon, lat)
+        idx = idx[douglas_peucker(x, y, tolerance)]
+
+    if "segment_id" in track_points[0]:
+        seg = np.array([p.get("segment_id") for p in track_points],
+                       dtype=object)
+        change = np.flatnonzero(seg[1:] != seg[:-1])
+        # last fix of a segment and first fix of the next one
+        idx = np.union1d(idx, np.concatenate([change, change + 1]))
+
+    idx = idx.tolist()
+    return [track_points[i] for i in idx], idx
+
+
+def simplify_features(feature_collection, tolerance):
+    """Douglas-Peucker on the LineStrings of a GeoJSON FeatureCollection
+
+    In place. Kept coordinate indices are added to each LineString
+    feature as properties["indices"], all of them for LineStrings too
+    short to simplify.
+    """
+    for feature in feature_collection.get("features", []):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "LineString":
+            continue
+        coords = geometry["coordinates"]
+        if len(coords) < 3:
+            idx = list(range(len(coords)))
+        else:
+            lon = [c[0] for c in coords]
+            lat = [c[1] for c in coords]
+            x, y = project(lon, lat)
+            idx = douglas_peucker(x, y, tolerance).tolist()
+            geometry["coordinates"] = [coords[i] for i in idx]
+        feature.setdefault("properties", {})["indices"] = idx
+    return feature_collection
+
+
+def simplify_result(result, tolerance=None, interval=None):
+    """Simplify a track_analysis result in place
+
+    track_points get both stages, glide/thermal LineStrings only
+    Douglas-Peucker (their coordinates carry no time). The kept
+    track_points indices are returned as "track_points_indices".
+    """
+    if result.get("track_points"):
+        points, idx = simplify_track_points(
+            result["track_points"], tolerance, interval)
+        result["track_points"] = points
+        result["track_points_indices"] = idx
+    if tolerance:
+        simplify_features(result["glides"], tolerance)
+        simplify_features(result["thermals"], tolerance)
+    return result
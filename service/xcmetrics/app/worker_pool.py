@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Process pool for CPU-bound igc_lib work.
+
+igc_lib parses and segments fix by fix in pure Python, running that on
+the event loop stalls every other request of the worker (health checks
+included). Jobs are handed to a ProcessPoolExecutor instead, with
+admission control in front of it so that load beyond the configured
+capacity is rejected early rather than queued without bound.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# stage timings of the current job, in the worker processes
+_timings = []
+
+
+def _init_worker():
+    """ProcessPoolExecutor initializer, stage() collects instead of
+    observing, the metrics of a worker would be lost with it"""
+    metrics.redirect_stages(_timings)
+
+
+def _timed(fn, *args):
+    """Worker side of run(), fn's result and the stage timings"""
+    _timings.clear()
+    result = fn(*args)
+    return result, list(_timings)
+
+
+class PoolBusyError(Exception):
+    """Admission limit reached, caller should retry later"""
+
+
+class PoolTimeoutError(Exception):
+    """Job exceeded its wall-clock limit"""
+
+
+class AnalysisPool:
+    """
+    ProcessPoolExecutor with a bounded number of admitted jobs.
+
+    A job counts as pending from submit until its future completes.
+    Jobs that time out while already running cannot be interrupted by
+    ProcessPoolExecutor, so they keep their slot until they finish;
+    admission control therefore reflects the real load on the workers.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        """
+        Args:
+            workers: number of worker processes
+            max_pending: maximum jobs running or queued at any time
+            timeout: per-job wall-clock limit in seconds
+        """
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.timeout = timeout
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   initializer=_init_worker)
+
+    def _release(self, _future):
+        # runs in the executor's management thread
+        with self._lock:
+            self.pending -= 1
+
+    def _restart(self, broken):
+        """Replace a broken executor, e.g. after a worker was OOM killed
+
+        Every job of a broken executor fails with BrokenProcessPool, so
+        several callers may get here for the same one; only the first
+        replaces it, the others must not shut down its replacement.
+        """
+        with self._restart_lock:
+            if self._executor is not broken:
+                return
+            logger.error("process pool broken, restarting")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process
+
+        Stage timings of the job (metrics.stage) are recorded here.
+
+        Raises:
+            PoolBusyError: max_pending jobs already admitted
+            PoolTimeoutError: job did not finish within timeout
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise PoolBusyError(
+                    f"{self.pending} jobs pending, limit {self.max_pending}")
+            self.pending += 1
+
+        executor = self._executor
+        try:
+            future = executor.submit(_timed, fn, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                self.pending -= 1
+            self._restart(executor)
+            raise PoolBusyError("process pool restarting")
+        future.add_done_callback(self._release)
+
+        try:
+            result, timings = await asyncio.wait_for(
+                asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            # only succeeds if the job is still queued
+            future.cancel()
+            raise PoolTimeoutError(
+                f"job exceeded {self.timeout:g} s")
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        for name, seconds in timings:
+            metrics.STAGE_SECONDS.labels(name).observe(seconds)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
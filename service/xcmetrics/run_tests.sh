@@ -8,10 +8,22 @@ fi
 source .venv/bin/activate
 pip install -r requirements.txt
 
+# modules shared by the services, e.g. metrics.py
+export PYTHONPATH="$(pwd)/../shared"
+
+# In-process tests, no server needed
+echo "Running engine parity tests..."
+python3 -m unittest tests/test_numpy_engine.py
+
 # Start Uvicorn server in the background and save its PID
 cd ./app
 echo "Starting Uvicorn server..."
-uvicorn main:app --port 8080&
+# small upload and batch limits and a single pool slot, exercised by
+# test_upload_limit, test_batch_limit and test_pool_busy
+XCMETRICS_MAX_UPLOAD_BYTES=2097152 \
+    XCMETRICS_MAX_BATCH_BYTES=4194304 XCMETRICS_MAX_BATCH_FILES=10 \
+    XCMETRICS_WORKERS=1 XCMETRICS_MAX_PENDING=1 \
+    uvicorn main:app --port 8080&
 UVICORN_PID=$!
 cd ..
 
@@ -0,0 +1,69 @@
+import sys
+import json
+import unittest
+from pathlib import Path
+
+p = Path(__file__).resolve()
+sys.path.insert(0, str(p.parent.parent.parent / 'shared'))
+sys.path.insert(0, str(p.parent.parent / 'app'))
+from analysis import flight_from_bytes, igcLibCfg
+
+class TestNumpyEngineParity(unittest.TestCase):
+    """NumPy engine against igc_lib on the bundled test files
+
+    Runs in-process, no server needed.
+    """
+
+    @classmethod
+    def setUpClass(self):
+        # .igc files for testing
+        self.testdata_dir = p.parent / 'resources'
+        self.files = ['valid_xctracer_mini_v.IGC', 'valid_xctrack.igc']
+
+    def flights(self, name):
+        data = (self.testdata_dir / name).read_bytes()
+        return (flight_from_bytes(data, igcLibCfg, 'igc_lib'),
+                flight_from_bytes(data, igcLibCfg, 'numpy'))
+
+    def test_per_fix_values(self):
+        """gsp, bearing, bearing change rate, flying and circling per fix"""
+        for name in self.files:
+            with self.subTest(file=name):
+                ref, new = self.flights(name)
+                self.assertTrue(new.valid)
+                self.assertEqual(len(ref.fixes),len(new.fixes))
+                for a, b in zip(ref.fixes, new.fixes):
+                    self.assertAlmostEqual(a.gsp, b.gsp, places=6)
+                    self.assertAlmostEqual(a.bearing, b.bearing, places=6)
+                    self.assertAlmostEqual(a.bearing_change_rate,
+                                           b.bearing_change_rate, places=6)
+                    self.assertEqual(a.flying, b.flying)
+                    self.assertEqual(a.circling, b.circling)
+
+    def test_segments(self):
+        """identical thermals and glides"""
+        for name in self.files:
+            with self.subTest(file=name):
+                ref, new = self.flights(name)
+                for attr in ('thermals', 'glides'):
+                    a = [(s.enter_fix.index, s.exit_fix.index)
+                         for s in getattr(ref, attr)]
+                    b = [(s.enter_fix.index, s.exit_fix.index)
+                         for s in getattr(new, attr)]
+                    self.assertEqual(a, b)
+
+    def test_output_schema(self):
+        """summary, GeoJSON and timeseries match"""
+        for name in self.files:
+            with self.subTest(file=name):
+                ref, new = self.flights(name)
+                self.assertEqual(json.loads(ref.flight_summary()),
+                                 json.loads(new.flight_summary()))
+                self.assertEqual(json.loads(ref.glides_to_gdf()),
+                                 json.loads(new.glides_to_gdf()))
+                self.assertEqual(json.loads(ref.thermals_to_gdf()),
+                                 json.loads(new.thermals_to_gdf()))
+                self.assertEqual(ref.timeseries(), new.timeseries())
+
+if __name__ == '__main__':
+    unittest.main()
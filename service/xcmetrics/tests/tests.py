@@ -1,5 +1,11 @@
+import io
+import gzip
+import json
+import zipfile
 import unittest
 import requests
+import msgpack
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 class TestMicroservice(unittest.TestCase):
@@ -33,6 +39,338 @@ class TestMicroservice(unittest.TestCase):
             response = requests.post(self.url, files=file)
             self.assertEqual(response.status_code,200)
 
+    def test_cache_etag(self):
+        """Repeated upload is served from cache, ETag revalidates"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC', data), }
+        first = requests.post(self.url, files=file)
+        self.assertEqual(first.status_code,200)
+        etag = first.headers['ETag']
+
+        second = requests.post(self.url, files=file)
+        self.assertEqual(second.status_code,200)
+        self.assertEqual(second.headers['X-Cache'],'hit')
+        self.assertEqual(second.headers['ETag'],etag)
+        self.assertEqual(second.content,first.content)
+
+        revalidate = requests.post(self.url, files=file,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(revalidate.status_code,304)
+
+    def test_output_formats(self):
+        """track_points as records (default), columnar JSON and msgpack"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC', data), }
+        records = requests.post(self.url, files=file).json()['track_points']
+
+        response = requests.post(self.url + '?format=columnar', files=file)
+        self.assertEqual(response.status_code,200)
+        columns = response.json()['track_points']
+        self.assertEqual(len(columns['lat']),len(records))
+        self.assertEqual(columns['lat'][0],records[0]['lat'])
+
+        response = requests.post(self.url, files=file,
+                                 headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(response.headers['Content-Type'],'application/msgpack')
+        d = msgpack.unpackb(response.content)
+        self.assertEqual(d['track_points']['lat']['dtype'],'<f8')
+        self.assertEqual(len(d['track_points']['lat']['data']),8*len(records))
+
+        response = requests.post(self.url + '?format=xml', files=file)
+        self.assertEqual(response.status_code,400)
+
+    def test_compression(self):
+        """gzip/brotli responses, .igc.gz and Content-Encoding: gzip uploads"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC', data), }
+        plain = requests.post(self.url, files=file,
+                              headers={'Accept-Encoding': 'identity'})
+        self.assertEqual(plain.status_code,200)
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        for encoding in ['gzip', 'br']:
+            response = requests.post(self.url, files=file,
+                                     headers={'Accept-Encoding': encoding})
+            self.assertEqual(response.status_code,200)
+            self.assertEqual(response.headers['Content-Encoding'],encoding)
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertEqual(response.json(),plain.json())
+
+        file = {'file': ('valid_xctracer_mini_v.IGC.gz', gzip.compress(data)), }
+        response = requests.post(self.url, files=file)
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(response.json(),plain.json())
+
+        file = {'file': ('broken.igc.gz', gzip.compress(data)[:100]), }
+        response = requests.post(self.url, files=file)
+        self.assertEqual(response.status_code,400)
+
+        request = requests.Request('POST', self.url, files={
+            'file': ('valid_xctracer_mini_v.IGC', data)}).prepare()
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(response.json(),plain.json())
+
+    def test_upload_limit(self):
+        """413 beyond XCMETRICS_MAX_UPLOAD_BYTES (2 MiB in run_tests.sh)"""
+        big = b'B' * (3 * 2**20)
+        response = requests.post(self.url, files={'file': ('big.igc', big)})
+        self.assertEqual(response.status_code,413)
+
+        # decompressed size counts
+        file = {'file': ('big.igc.gz', gzip.compress(big))}
+        response = requests.post(self.url, files=file)
+        self.assertEqual(response.status_code,413)
+
+        # Content-Encoding: gzip request body, decompressed size counts
+        request = requests.Request('POST', self.url, files={
+            'file': ('big.igc', big)}).prepare()
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,413)
+
+        # transfer-encoding: chunked, no Content-Length
+        request = requests.Request('POST', self.url, files={
+            'file': ('big.igc', big)}).prepare()
+        response = requests.post(self.url, data=iter([request.body]),
+                                 headers={'Content-Type':
+                                          request.headers['Content-Type']})
+        self.assertEqual(response.status_code,413)
+
+        request = requests.Request('POST', self.url, files={
+            'file': ('small.igc', b'B')}).prepare()
+        request.headers['Content-Length'] = 'many'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,400)
+
+        response = requests.post(self.url + 'batch', files=[
+            ('files', ('big.igc.gz', gzip.compress(big)))])
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(json.loads(response.text)['status'],413)
+
+    def test_batch_limit(self):
+        """413 beyond XCMETRICS_MAX_BATCH_BYTES or XCMETRICS_MAX_BATCH_FILES
+        (4 MiB and 10 flights in run_tests.sh)"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        files = [('files', (f'{i}.igc', data)) for i in range(11)]
+        response = requests.post(self.url + 'batch', files=files)
+        self.assertEqual(response.status_code,413)
+
+        # archive members count
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as archive:
+            for i in range(11):
+                archive.writestr(f'club/{i}.igc', data)
+        response = requests.post(self.url + 'batch', files=[
+            ('files', ('archive.zip', buf.getvalue()))])
+        self.assertEqual(response.status_code,413)
+
+        # total size, every file within the per-file limit
+        part = b'B' * (3 * 2**19)
+        files = [('files', (f'{i}.igc', part)) for i in range(3)]
+        response = requests.post(self.url + 'batch', files=files)
+        self.assertEqual(response.status_code,413)
+        # transfer-encoding: chunked, no Content-Length
+        request = requests.Request('POST', self.url + 'batch',
+                                   files=files).prepare()
+        response = requests.post(self.url + 'batch',
+                                 data=iter([request.body]),
+                                 headers={'Content-Type':
+                                          request.headers['Content-Type']})
+        self.assertEqual(response.status_code,413)
+        # Content-Encoding: gzip, decompressed size counts
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,413)
+
+    def test_pool_busy(self):
+        """503 with Retry-After beyond XCMETRICS_MAX_PENDING (1 worker, 1
+        job in run_tests.sh), the event loop stays responsive meanwhile"""
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            data = f.read()
+        def post(i):
+            # distinct content, so none is served from the cache
+            return requests.post(self.url, files={
+                'file': ('valid_xctrack.igc', data + b'LXXXBUSY%d\r\n' % i)})
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(post, i) for i in range(4)]
+            # not blocked by the running analysis
+            response = requests.get(self.url, timeout=1)
+            self.assertEqual(response.status_code,200)
+            responses = [f.result() for f in futures]
+        status = sorted(r.status_code for r in responses)
+        self.assertEqual(status[0],200)
+        self.assertEqual(status[-1],503)
+        busy = [r for r in responses if r.status_code == 503][0]
+        self.assertEqual(busy.headers['Retry-After'],'1')
+
+    def test_batch(self):
+        """Multi-file and zip batch, one NDJSON line per flight"""
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as archive:
+            archive.write(self.testdata_dir / 'valid_xctracer_mini_v.IGC',
+                          'club/valid_xctracer_mini_v.IGC')
+            archive.write(self.testdata_dir / 'invalid_empty.igc',
+                          'club/invalid_empty.igc')
+        files = [
+            ('files', ('valid_xctracer_mini_v.IGC',
+                       open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb'))),
+            ('files', ('archive.zip', buf.getvalue())),
+            ('files', ('notes.txt', b'not a flight')),
+        ]
+        response = requests.post(self.url + 'batch', files=files)
+        self.assertEqual(response.status_code,200)
+        lines = [json.loads(l) for l in response.text.splitlines()]
+        d = {l['file']: l for l in lines}
+        self.assertEqual(len(d),4)
+        # same result as a single upload, for the file and the zip member
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            single = requests.post(self.url, files={'file': f}).json()
+        self.assertEqual(d['valid_xctracer_mini_v.IGC']['result'], single)
+        self.assertEqual(
+            d['archive.zip/club/valid_xctracer_mini_v.IGC']['result'], single)
+        self.assertEqual(d['archive.zip/club/invalid_empty.igc']['status'],400)
+        self.assertNotIn('result', d['archive.zip/club/invalid_empty.igc'])
+        self.assertEqual(d['notes.txt']['status'],400)
+        self.assertIn('.zip', d['notes.txt']['error'])
+
+        # Content-Encoding: gzip request, streamed response
+        request = requests.Request('POST', self.url + 'batch', files=[
+            ('files', ('valid_xctracer_mini_v.IGC', (self.testdata_dir /
+                        'valid_xctracer_mini_v.IGC').read_bytes()))]).prepare()
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request, stream=True, timeout=30)
+        self.assertEqual(response.status_code,200)
+        lines = [json.loads(l) for l in response.iter_lines()]
+        self.assertEqual(len(lines),1)
+        self.assertEqual(lines[0]['result'], single)
+        # the event loop is still serving
+        response = requests.get(self.url, timeout=1)
+        self.assertEqual(response.status_code,200)
+        response = requests.get(self.url + "metrics")
+        self.assertNotIn('method="POST",route="unmatched"', response.text)
+
+    def test_settings(self):
+        """igc_lib settings through query parameters"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            file = {'file': f, }
+            response = requests.post(
+                self.url + '?min_time_for_thermal=20&min_time_for_bearing_change=1',
+                files=file)
+            self.assertEqual(response.status_code,200)
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            file = {'file': f, }
+            response = requests.post(self.url + '?min_time_for_thermal=-1',
+                                     files=file)
+            self.assertEqual(response.status_code,422)
+
+    def test_sweep(self):
+        """Parse once, segment per settings"""
+        settings = [{}, {'min_time_for_thermal': 10},
+                    {'min_time_for_thermal': 60, 'min_time_for_bearing_change': 4}]
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            response = requests.post(self.url + 'sweep', files={'file': f},
+                                     data={'settings': json.dumps(settings)})
+        self.assertEqual(response.status_code,200)
+        results = response.json()['results']
+        self.assertEqual(len(results),3)
+        self.assertEqual(results[0]['settings']['min_time_for_thermal'],30)
+        self.assertEqual(results[1]['settings']['min_time_for_thermal'],10)
+        # shorter minimum thermal time never finds fewer thermals
+        self.assertGreaterEqual(len(results[1]['thermals']['features']),
+                                len(results[0]['thermals']['features']))
+
+    def test_simplify(self):
+        """Douglas-Peucker and time thinning of the output"""
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctrack.igc', data), }
+        full = requests.post(self.url, files=file).json()
+        response = requests.post(self.url + '?tolerance=10&interval=5',
+                                 files=file)
+        self.assertEqual(response.status_code,200)
+        d = response.json()
+        idx = d['track_points_indices']
+        self.assertEqual(len(idx),len(d['track_points']))
+        self.assertLess(len(idx),len(full['track_points']) / 5)
+        # kept points are original points, first and last always kept
+        self.assertEqual(idx[0],0)
+        self.assertEqual(idx[-1],len(full['track_points'])-1)
+        self.assertEqual(d['track_points'][1],full['track_points'][idx[1]])
+        for feature in d['glides']['features']:
+            self.assertIn('indices',feature['properties'])
+
+    def test_live_session(self):
+        """Feed a flight in chunks, segments are reported incrementally"""
+        response = requests.post(self.url + 'live')
+        self.assertEqual(response.status_code,200)
+        session_url = self.url + 'live/' + response.json()['session']
+
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        final = {}
+        for i in range(0, len(lines), 2000):
+            response = requests.post(session_url, data=b''.join(lines[i:i+2000]))
+            self.assertEqual(response.status_code,200)
+            d = response.json()
+            for feature in d['glides'] + d['thermals']:
+                if feature['properties']['final']:
+                    live_id = feature['properties']['live_id']
+                    # final segments are reported exactly once
+                    self.assertNotIn(live_id, final)
+                    final[live_id] = feature
+        self.assertGreater(len(final),0)
+
+        response = requests.delete(session_url)
+        self.assertEqual(response.status_code,204)
+        response = requests.post(session_url, data=b'')
+        self.assertEqual(response.status_code,404)
+
+    def test_live_chunk_limit(self):
+        """Chunks beyond the size limit are rejected, also when chunked"""
+        response = requests.post(self.url + 'live')
+        session_url = self.url + 'live/' + response.json()['session']
+        chunk = b'B1200004724000N00956000EA0100001000\r\n' * 40000
+        response = requests.post(session_url, data=chunk)
+        self.assertEqual(response.status_code,413)
+        # transfer-encoding: chunked, no Content-Length
+        response = requests.post(session_url, data=iter([chunk]))
+        self.assertEqual(response.status_code,413)
+        response = requests.post(session_url, data=chunk[:4000])
+        self.assertEqual(response.status_code,200)
+        requests.delete(session_url)
+
+    def test_metrics(self):
+        """Prometheus metrics, stage timings come back from the workers"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            response = requests.post(self.url, files={'file': f},
+                                     params={'min_time_for_thermal': 33})
+            self.assertEqual(response.status_code,200)
+
+        response = requests.get(self.url + "metrics")
+        self.assertEqual(response.status_code,200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        for name in ['http_request_duration_seconds_bucket',
+                     'http_requests_in_flight',
+                     'http_request_size_bytes_sum',
+                     'http_response_size_bytes_sum',
+                     'stage_duration_seconds_count{stage="parse"}',
+                     'stage_duration_seconds_count{stage="segment"}',
+                     'stage_duration_seconds_count{stage="serialize"}',
+                     'xcmetrics_pool_pending_jobs']:
+            self.assertIn(name, response.text)
+        self.assertIn('route="/"', response.text)
+
     def test_invalid(self):
         """Invalid igc file
         
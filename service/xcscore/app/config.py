@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Configuration for xcscore service.
+"""
+
+import os
+
+# Maximum size of an uploaded igc file in bytes, after decompression.
+# Larger uploads are rejected with 413, by Content-Length before reading.
+MAX_UPLOAD_BYTES = int(os.environ.get("XCSCORE_MAX_UPLOAD_BYTES",
+                                      64 * 2**20))
+
+# Pre-started igc-xc-score processes kept ready (0 disables the pool)
+# and seconds after which an unused one is replaced
+POOL_SIZE = int(os.environ.get("XCSCORE_POOL_SIZE", 2))
+POOL_MAX_IDLE = float(os.environ.get("XCSCORE_POOL_MAX_IDLE", 600))
+
+# Concurrent igc-xc-score runs (default: one per CPU core) and requests
+# allowed to wait for one; beyond that requests get 429
+CONCURRENCY = int(os.environ.get("XCSCORE_CONCURRENCY", os.cpu_count() or 1))
+MAX_QUEUE = int(os.environ.get("XCSCORE_MAX_QUEUE", 4 * CONCURRENCY))
+
+# Rulesets accepted by the ?scoring= parameter, values of the igc-xc-score
+# scoring= option
+RULESETS = os.environ.get(
+    "XCSCORE_RULESETS",
+    "XContest,FFVL,FAI,FAI-Cylinders,FAI-OAR,FAI-OAR2,XCLeague").split(",")
+
+# Default scoring engine: "binary" (igc-xc-score) or "numpy" (in-process,
+# XContest only), requests override it with ?engine=
+ENGINE = os.environ.get("XCSCORE_ENGINE", "binary")
+
+# Default fix decimation before scoring, see decimate.py: distance error
+# bound in meters and minimum seconds between fixes, 0 disables. Requests
+# override them with ?tolerance= and ?interval=.
+DECIMATE_TOLERANCE = float(os.environ.get("XCSCORE_DECIMATE_TOLERANCE", 0))
+DECIMATE_INTERVAL = float(os.environ.get("XCSCORE_DECIMATE_INTERVAL", 0))
+
+# Wall-clock limit of one igc-xc-score run in seconds, killed beyond
+SCORE_TIMEOUT = float(os.environ.get("XCSCORE_TIMEOUT", 120))
+
+# Result cache: memory tier capacity in bytes (0 disables caching) and
+# optional SQLite database file of the persistent tier
+CACHE_MAX_BYTES = int(os.environ.get("XCSCORE_CACHE_MAX_BYTES", 64 * 2**20))
+CACHE_DB = os.environ.get("XCSCORE_CACHE_DB") or None
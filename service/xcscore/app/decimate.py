@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Fix decimation before scoring.
+
+The optimizer's cost grows with the number of fixes, and 10 Hz loggers
+record far more of them than scoring needs. decimate() drops B records
+before the flight is sent to igc-xc-score:
+
+- geometric, bounded error: a fix closer than `tolerance` meters to the
+  last kept fix is dropped. Every dropped fix is within tolerance of a
+  kept one, so a turnpoint moves by at most tolerance and a leg changes
+  by at most 2 x tolerance.
+- time based: a fix less than `interval` seconds after the last kept
+  fix is dropped. The error is not bounded (speed x interval).
+
+Turnpoint candidates are always kept: the vertices of the convex hull
+of the track (the corners of the largest triangles lie on it), and the
+first and last fix (launch and landing detection). All other records
+are passed through unchanged.
+"""
+
+import math
+
+from metrics import stage
+
+EARTH_RADIUS = 6371000.0  # meters
+
+
+def _fix(line):
+    """(seconds of day, lat, lon) of a B record, None if not parsable"""
+    if len(line) < 24 or line[:1] != b"B":
+        return None
+    try:
+        t = int(line[1:3]) * 3600 + int(line[3:5]) * 60 + int(line[5:7])
+        # DDMMmmmN, DDDMMmmmE
+        lat = int(line[7:9]) + int(line[9:14]) / 60000
+        lon = int(line[15:18]) + int(line[18:23]) / 60000
+    except ValueError:
+        return None
+    if line[14:15] == b"S":
+        lat = -lat
+    if line[23:24] == b"W":
+        lon = -lon
+    return t, lat, lon
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def convex_hull(points):
+    """Indices of the convex hull vertices, monotone chain"""
+    order = sorted(range(len(points)), key=points.__getitem__)
+
+    def chain(indices):
+        out = []
+        for i in indices:
+            while (len(out) >= 2 and
+                   _cross(points[out[-2]], points[out[-1]], points[i]) <= 0):
+                out.pop()
+            out.append(i)
+        return out
+
+    return set(chain(order)) | set(chain(reversed(order)))
+
+
+def decimate(data, tolerance=0.0, interval=0.0):
+    """Drop B records, see module docstring
+
+    Args:
+        data: igc file content, bytes-like
+        tolerance: meters, geometric thinning, 0 disables
+        interval: seconds, time based thinning, 0 disables
+
+    Returns:
+        (igc file content, fixes, fixes kept)
+    """
+    with stage("decimate"):
+        lines = data.splitlines(keepends=True)
+        # (line index, seconds of day, lat, lon)
+        fixes = []
+        for j, line in enumerate(lines):
+            fix = _fix(line)
+            if fix is not None:
+                fixes.append((j, *fix))
+        if len(fixes) < 3 or (tolerance <= 0 and interval <= 0):
+            return bytes(data), len(fixes), len(fixes)
+
+        # local equirectangular projection, meters
+        lat0 = math.radians(sum(f[2] for f in fixes) / len(fixes))
+        ky = EARTH_RADIUS * math.pi / 180
+        kx = ky * math.cos(lat0)
+        points = [(lon * kx, lat * ky) for _, _, lat, lon in fixes]
+
+        keep = convex_hull(points)
+        keep.update((0, len(fixes) - 1))
+        tolerance2 = tolerance * tolerance
+        dropped = set()
+        last = 0
+        for i in range(1, len(fixes)):
+            if i not in keep:
+                # % one day: midnight UTC rollover
+                dt = (fixes[i][1] - fixes[last][1]) % 86400
+                dx = points[i][0] - points[last][0]
+                dy = points[i][1] - points[last][1]
+                if dx * dx + dy * dy < tolerance2 or dt < interval:
+                    dropped.add(fixes[i][0])
+                    continue
+            last = i
+
+        out = b"".join(line for j, line in enumerate(lines)
+                       if j not in dropped)
+        return out, len(fixes), len(fixes) - len(dropped)
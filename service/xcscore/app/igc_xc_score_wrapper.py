@@ -1,54 +1,125 @@
 from fastapi import HTTPException
+from functools import lru_cache
 import subprocess
-import json
+import hashlib
+import orjson
 import sys
 import os
 
-def igc_xc_score(data):
-    """igc-xc-score wrapper
-    
-    https://github.com/mmomtchev/igc-xc-score
-    """
+from metrics import stage
+
+class ScoreTimeoutError(Exception):
+    """igc-xc-score exceeded its wall-clock limit, and was killed"""
+
+# ruleset of the igc-xc-score scoring= option when none is requested
+DEFAULT_RULESET = "XContest"
 
-    # choose executable based on OS
+def scorer_program(scoring=DEFAULT_RULESET, max_time=None):
+    """igc-xc-score command line, executable chosen based on OS
+
+    Args:
+        scoring: ruleset, e.g. XContest, FFVL, FAI
+        max_time: seconds, the optimizer returns the best solution found
+            so far beyond, None for no limit
+    """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     if sys.platform == 'darwin': # macos
         bin = os.path.join(script_dir, "igc-xc-score-macos")
     else:
         bin = os.path.join(script_dir, "igc-xc-score-linux")
 
-    program = [bin, 
-        "quiet=true", 
-        "pipe=true", 
+    program = [bin,
+        "quiet=true",
+        "pipe=true",
         "noflight=true",
-        "scoring=XContest"]
-    
-    # Start the process
-    process = subprocess.Popen(
-        program, 
-        stdin=subprocess.PIPE, 
+        f"scoring={scoring}"]
+    if max_time is not None:
+        program.append(f"maxtime={max_time:g}")
+    return program
+
+@lru_cache(maxsize=1)
+def scorer_fingerprint():
+    """SHA-256 of the igc-xc-score executable, identifies its version"""
+    h = hashlib.sha256()
+    try:
+        with open(scorer_program()[0], "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+    except FileNotFoundError:
+        return "missing"
+    return h.hexdigest()
+
+def spawn(scoring=DEFAULT_RULESET, max_time=None):
+    """Start an igc-xc-score process, waiting for the flight on stdin"""
+    return subprocess.Popen(
+        scorer_program(scoring, max_time),
+        stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True  # Enable text mode (for string input/output instead of bytes)
     )
 
+def solve(process, data, timeout=None):
+    """Send the flight to a spawned process, returns the decoded output
+
+    Args:
+        data: igc file content, bytes-like
+        timeout: seconds, the process is killed beyond
+
+    Raises:
+        ScoreTimeoutError: timeout exceeded
+    """
     # Send input data and get the output
-    stdout, stderr = process.communicate(input=data)
+    try:
+        stdout, stderr = process.communicate(input=data, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise ScoreTimeoutError(f"igc-xc-score exceeded {timeout:g} s")
 
     # Check if any error occurred
     if stderr:
         raise HTTPException(
             status_code=500, # Internal Server Error
-            detail=f"Internal Error: igc-xc-score: {stderr}")
-    else:
-        d = json.loads(stdout)
+            detail=f"Internal Error: igc-xc-score: "
+                   f"{stderr.decode('utf-8', 'replace')}")
+    return orjson.loads(stdout)
+
+def igc_xc_score(data, start=spawn, timeout=None, max_time=None):
+    """igc-xc-score wrapper
+
+    https://github.com/mmomtchev/igc-xc-score
+
+    Blocking, run it in a thread from async code.
+
+    Args:
+        data: igc file content, bytes-like
+        start: returns a started process, e.g. ScorerPool.acquire
+        timeout: wall-clock limit of the scorer in seconds, see solve()
+        max_time: maxtime= of the started process, see postprocess()
+    """
+    # subprocess wall time, start to decoded output
+    with stage("xcscore"):
+        d = solve(start(), data, timeout)
+    with stage("postprocess"):
+        return postprocess(d, max_time)
+
+def postprocess(d, max_time=None):
+    """Merge solution properties into the GeoJSON, add derived metrics
 
+    max_time: maxtime= of the scorer run, a solution without an optimal
+        flag counts as optimal only if the optimizer was not limited
+    """
     # merge properties
     for key in ['distance', 'multiplier', 'penalty']:
         d['geojson']['properties'][key] = d['solution']['bestSolution'][key]
     # camel case conversion
     d['geojson']['properties']['closing_distance'] = \
         d['solution']['bestSolution']['closingDistance']
+    # false if maxtime stopped the optimizer before it proved the solution
+    d['geojson']['properties']['optimal'] = bool(
+        d['solution']['bestSolution'].get(
+            'optimal', d['geojson']['properties'].get(
+                'optimal', max_time is None)))
     
     # compute some dependent properties
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Admission control for igc-xc-score runs.
+
+At most `concurrency` scorer processes run at a time (one per core, the
+optimizer is single threaded and CPU bound). Runs beyond that wait for
+a slot, up to max_queue of them; further requests are rejected right
+away instead of piling up behind minutes of queued work. A request
+scoring several rulesets is admitted for all of its runs at once.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class QueueFullError(Exception):
+    """All slots busy and max_queue requests already waiting"""
+
+
+class Limiter:
+    """asyncio.Semaphore with a bounded number of waiters"""
+
+    def __init__(self, concurrency: int, max_queue: int):
+        """
+        Args:
+            concurrency: maximum concurrent scorer runs
+            max_queue: maximum requests waiting for a slot
+        """
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.running = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def admit(self, runs=1):
+        """Admission check of a new request
+
+        Args:
+            runs: scorer runs of the request, those that find no free
+                slot count against max_queue. A request of more runs than
+                concurrency + max_queue is admitted on an idle limiter
+                only, it could never be otherwise.
+
+        Raises:
+            QueueFullError: not enough slots free and the queue is full
+        """
+        runs = min(runs, self.concurrency + self.max_queue)
+        free = 0 if self.waiting else self.concurrency - self.running
+        if self.waiting + max(runs - free, 0) > self.max_queue:
+            raise QueueFullError(
+                f"{self.running} running, {self.waiting} queued")
+
+    @asynccontextmanager
+    async def slot(self, admitted=False, runs=1):
+        """Hold one of the concurrency slots
+
+        Args:
+            admitted: admit() already passed, e.g. further scorer runs of
+                a request scoring several rulesets, which wait for a slot
+                regardless of the queue length
+            runs: passed to admit(), all scorer runs of the request
+
+        Raises:
+            QueueFullError: not enough slots free and the queue is full
+        """
+        if not admitted:
+            self.admit(runs)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
@@ -1,33 +1,432 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, Counter, Gauge,
+                               generate_latest)
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import logging
+import orjson
+import time
 
-from igc_xc_score_wrapper import igc_xc_score
+from igc_xc_score_wrapper import (igc_xc_score, spawn, scorer_program,
+                                  scorer_fingerprint, ScoreTimeoutError,
+                                  DEFAULT_RULESET)
+from numpy_scorer import numpy_xc_score
+from scorer_pool import ScorerPool
+from decimate import decimate
+from result_cache import ResultCache, make_key
+from limiter import Limiter, QueueFullError
+from upload import (GzipRequestMiddleware, UploadLimitMiddleware,
+                    CompressedDataError, UploadTooLargeError,
+                    MULTIPART_OVERHEAD, is_igc, read_igc)
+from config import (MAX_UPLOAD_BYTES, POOL_SIZE, POOL_MAX_IDLE,
+                    CONCURRENCY, MAX_QUEUE, SCORE_TIMEOUT, RULESETS,
+                    DECIMATE_TOLERANCE, DECIMATE_INTERVAL, ENGINE,
+                    CACHE_MAX_BYTES, CACHE_DB)
+from metrics import MetricsMiddleware
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+POOL_IDLE = Gauge(
+    "xcscore_pool_idle_processes", "Pre-started igc-xc-score processes")
+CACHE_REQUESTS = Counter(
+    "xcscore_cache_requests_total", "Result cache lookups", ["result"])
+QUEUE_WAITING = Gauge(
+    "xcscore_queue_waiting", "Requests waiting for a scorer slot")
+
+# Global igc-xc-score process pool and result cache, None if disabled
+pool = None
+cache = None
+# admission control, concurrent scorer runs and queue
+limiter = Limiter(CONCURRENCY, MAX_QUEUE)
+
+# bump when the response layout changes, invalidates persisted entries
+RESULT_VERSION = "2"
+
+# first igc-xc-score time budget of /stream in seconds, doubled per run
+STREAM_FIRST_BUDGET = 0.5
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage igc-xc-score process pool and result cache lifecycle."""
+    global pool, cache
+
+    if POOL_SIZE > 0:
+        pool = ScorerPool(POOL_SIZE, POOL_MAX_IDLE)
+        logger.info(f"igc-xc-score pool started with {POOL_SIZE} processes")
+    if CACHE_MAX_BYTES or CACHE_DB:
+        # hashes the scorer binary, once
+        scorer = await asyncio.to_thread(scorer_fingerprint)
+        cache = ResultCache(CACHE_MAX_BYTES, CACHE_DB, scorer)
+
+    yield
+
+    if pool:
+        pool.shutdown()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+# decompressed size
+app.add_middleware(GzipRequestMiddleware,
+                   max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD)
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+# outermost, sizes as on the wire
+app.add_middleware(MetricsMiddleware)
+
+POOL_IDLE.set_function(lambda: pool.idle if pool else 0)
+QUEUE_WAITING.set_function(lambda: limiter.waiting)
 
 @app.get("/")
 async def alive():
     return {"message": "xcscore"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics, text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# ?engine= values: igc-xc-score binary or numpy_scorer (XContest only)
+Engine = Optional[Literal["binary", "numpy"]]
+
+def result_key(data, scoring=DEFAULT_RULESET, tolerance=0, interval=0,
+               max_time=None, engine="binary"):
+    """Cache key: content, scorer binary, its options (ruleset, time
+    budget), the decimation and the engine"""
+    parts = [RESULT_VERSION, scorer_fingerprint(),
+             *scorer_program(scoring, max_time)[1:]]
+    if tolerance or interval:
+        parts.append(f"decimate={tolerance:g},{interval:g}")
+    if engine != "binary":
+        parts.append(f"engine={engine}")
+    return make_key(data, *parts)
+
+def scorer_start(scoring, max_time=None):
+    """Process source of a ruleset, the pool holds default ruleset ones
+    without time budget"""
+    if pool and scoring == DEFAULT_RULESET and max_time is None:
+        return pool.acquire
+    return partial(spawn, scoring, max_time)
+
+def parse_rulesets(scoring):
+    """Requested rulesets, repeated and/or comma separated, in order
+
+    Raises:
+        HTTPException: 400, unknown ruleset
+    """
+    rulesets = []
+    for item in scoring:
+        for name in item.split(","):
+            name = name.strip()
+            if name and name not in rulesets:
+                rulesets.append(name)
+    unknown = [name for name in rulesets if name not in RULESETS]
+    if unknown or not rulesets:
+        raise HTTPException(
+            status_code=400, # bad request
+            detail=f"scoring must be one or more of {', '.join(RULESETS)}")
+    return rulesets
+
+async def cache_lookup(key):
+    """Cached response body for key, or None"""
+    if not cache:
+        return None
+    body = await asyncio.to_thread(cache.get, key)
+    CACHE_REQUESTS.labels("miss" if body is None else "hit").inc()
+    return body
+
+async def score(data, key, scoring, max_time=None, engine="binary",
+                admitted=False, runs=1):
+    """Response body of a scorer run, stored in the cache if optimal"""
+    # Blocking, runs in a thread to keep the event loop responsive
+    async with limiter.slot(admitted, runs):
+        if engine == "numpy":
+            json_data = await asyncio.to_thread(
+                numpy_xc_score, data, max_time or SCORE_TIMEOUT)
+        else:
+            json_data = await asyncio.to_thread(
+                igc_xc_score, data, scorer_start(scoring, max_time),
+                SCORE_TIMEOUT, max_time)
+    body = orjson.dumps(json_data)
+    # a solution cut short by max_time depends on the machine load
+    if cache and json_data['geojson']['properties']['optimal']:
+        await asyncio.to_thread(cache.put, key, body)
+    return body
+
+async def cached_scores(data, rulesets, tolerance=0, interval=0,
+                        max_time=None, engine="binary"):
+    """Response body per ruleset, from cache or scored
+
+    Rulesets missing from the cache are scored concurrently, one
+    igc-xc-score process (core) each, on the decimated flight.
+
+    Returns:
+        ({ruleset: body}, "hit" | "miss"), hit if all were cached
+    """
+    keys = {r: result_key(data, r, tolerance, interval, max_time, engine)
+            for r in rulesets}
+    bodies = dict(zip(rulesets, await asyncio.gather(
+        *(cache_lookup(keys[r]) for r in rulesets))))
+    missing = [r for r, body in bodies.items() if body is None]
+    if not missing:
+        return bodies, "hit"
+    if tolerance or interval:
+        data, fixes, kept = await asyncio.to_thread(
+            decimate, data, tolerance, interval)
+        logger.debug(f"decimation kept {kept} of {fixes} fixes")
+    # tasks start in creation order: the first run passes admission for
+    # all runs of the request, the others wait for a slot regardless of
+    # the queue
+    tasks = [asyncio.create_task(score(data, keys[r], r, max_time, engine,
+                                       admitted=i > 0, runs=len(missing)))
+             for i, r in enumerate(missing)]
+    try:
+        scored = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    bodies.update(zip(missing, scored))
+    return bodies, "miss"
+
+def http_error(e):
+    """HTTPException for an exception raised while scoring a flight"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(
+            status_code=413, # Content Too Large
+            detail=str(e))
+    if isinstance(e, QueueFullError):
+        return HTTPException(
+            status_code=429, # Too Many Requests
+            detail=f"Busy: {str(e)}",
+            headers={"Retry-After": "1"})
+    if isinstance(e, ScoreTimeoutError):
+        return HTTPException(
+            status_code=504, # Gateway Timeout
+            detail=f"Timeout: {str(e)}")
+    if isinstance(e, CompressedDataError):
+        return HTTPException(
+            status_code=400, # bad request
+            detail=str(e))
+    return HTTPException(
+        status_code=500, # Internal Server Error
+        detail=f"Internal Error: {str(e)}")
+
+def timed_score(data, scoring, engine="binary"):
+    """igc_xc_score() of a freshly started process, or numpy_xc_score(),
+    and its wall time"""
+    t0 = time.perf_counter()
+    if engine == "numpy":
+        result = numpy_xc_score(data, SCORE_TIMEOUT)
+    else:
+        result = igc_xc_score(data, partial(spawn, scoring), SCORE_TIMEOUT)
+    return result, time.perf_counter() - t0
+
+async def verify_decimation(data, rulesets, tolerance, interval,
+                            engine="binary"):
+    """Score the full and the decimated flight, report the score delta
+    and the speedup per ruleset
+
+    Not cached. The runs are sequential in one slot, so that their
+    timings compare.
+    """
+    decimated, fixes, kept = await asyncio.to_thread(
+        decimate, data, tolerance, interval)
+    report = {"tolerance": tolerance, "interval": interval,
+              "fixes": fixes, "fixes_decimated": kept, "rulesets": {}}
+    async with limiter.slot():
+        for r in rulesets:
+            full, seconds = await asyncio.to_thread(
+                timed_score, data, r, engine)
+            fast, seconds_decimated = await asyncio.to_thread(
+                timed_score, decimated, r, engine)
+            score = full['geojson']['properties']['score']
+            score_decimated = fast['geojson']['properties']['score']
+            report["rulesets"][r] = {
+                "score": score,
+                "score_decimated": score_decimated,
+                "score_delta": score_decimated - score,
+                "seconds": seconds,
+                "seconds_decimated": seconds_decimated,
+                "speedup": seconds / seconds_decimated,
+            }
+    return report
+
 @app.post("/")
-async def process(file: UploadFile = File(...)):
-    # Ensure the uploaded file is a .igc file
-    if not file.filename.lower().endswith(".igc"):
+async def process(file: UploadFile = File(...),
+                  scoring: Optional[List[str]] = Query(None),
+                  tolerance: Optional[float] = Query(None, ge=0),
+                  interval: Optional[float] = Query(None, ge=0),
+                  max_time: Optional[float] = Query(None, gt=0,
+                                                    le=SCORE_TIMEOUT),
+                  engine: Engine = None,
+                  verify: bool = False):
+    """Score a flight
+
+    scoring: rulesets, e.g. ?scoring=XContest&scoring=FFVL. Without it
+    the response is the XContest result, with it an object keyed by
+    ruleset.
+    tolerance, interval: fix decimation before scoring, meters and
+    seconds, 0 disables, see decimate.py
+    max_time: seconds, best solution found within this time budget,
+    geojson.properties.optimal is false if it was cut short
+    engine: igc-xc-score binary, or the in-process numpy scorer
+    (XContest only)
+    verify: score the full and the decimated flight with engine, the
+    response is the score delta and speedup per ruleset
+    """
+    # Ensure the uploaded file is a .igc or .igc.gz file
+    if not is_igc(file.filename):
         raise HTTPException(
             status_code=400, # bad request 
-            detail="File format not .igc")
+            detail="File format not .igc or .igc.gz")
+    rulesets = parse_rulesets(scoring) if scoring else [DEFAULT_RULESET]
+    tolerance = DECIMATE_TOLERANCE if tolerance is None else tolerance
+    interval = DECIMATE_INTERVAL if interval is None else interval
+    engine = engine or ENGINE
+    if engine == "numpy" and rulesets != ["XContest"]:
+        raise HTTPException(
+            status_code=400, # bad request
+            detail="engine numpy: scoring must be XContest")
+    if verify and not (tolerance or interval):
+        raise HTTPException(
+            status_code=400, # bad request
+            detail="verify needs decimation, tolerance and/or interval")
     
     try:
-        data = await file.read()
-        # call subfunction
-        json_data = igc_xc_score(data.decode('ascii'))
+        # chunked read of the spooled upload, size limited
+        data = await asyncio.to_thread(read_igc, file.file, file.filename,
+                                       MAX_UPLOAD_BYTES)
+        # call subfunction, bytes are piped as is, no decoded copy
+        if verify:
+            return await verify_decimation(data, rulesets, tolerance,
+                                           interval, engine)
+        bodies, status = await cached_scores(data, rulesets, tolerance,
+                                             interval, max_time, engine)
+        if scoring:
+            # cached bodies are spliced, not decoded and encoded again
+            body = b"{" + b",".join(orjson.dumps(r) + b":" + bodies[r]
+                                    for r in rulesets) + b"}"
+        else:
+            body = bodies[DEFAULT_RULESET]
         # Return the processed JSON
-        return JSONResponse(content=json_data)
+        return Response(content=body, media_type="application/json",
+                        headers={"X-Cache": status})
     
     except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
-        else:
-            raise HTTPException(
-                status_code=500, # Internal Server Error
-                detail=f"Internal Error: {str(e)}")
+        raise http_error(e)
+
+def sse(event, data):
+    """Server-Sent Events message, data is one line of JSON"""
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+async def stream_solutions(data, scoring, max_time, tolerance, interval,
+                           engine="binary"):
+    """SSE messages of improving solutions, then done or error
+
+    igc-xc-score only reports its result at exit, so the time budget is
+    deepened instead: runs with 0.5, 1, 2, ... seconds until a solution
+    is optimal or max_time is spent. Each run starts over, the total
+    cost is about twice the one of the last run. The numpy scorer
+    returns its best solution at the budget, one run with max_time.
+    Each run is admitted like a request of its own, a full queue ends
+    the stream with a 429 error event.
+    """
+    try:
+        key = result_key(data, scoring, tolerance, interval, engine=engine)
+        body = await cache_lookup(key)
+        if body is not None:
+            yield sse("solution", body)
+            yield sse("done", b"{}")
+            return
+        if tolerance or interval:
+            data, _, _ = await asyncio.to_thread(
+                decimate, data, tolerance, interval)
+
+        best = None
+        budget = max_time if engine == "numpy" else STREAM_FIRST_BUDGET
+        spent = 0.0
+        while True:
+            budget = min(budget, max_time - spent)
+            t0 = time.perf_counter()
+            async with limiter.slot():
+                if engine == "numpy":
+                    json_data = await asyncio.to_thread(
+                        numpy_xc_score, data, budget)
+                else:
+                    json_data = await asyncio.to_thread(
+                        igc_xc_score, data, partial(spawn, scoring, budget),
+                        SCORE_TIMEOUT, budget)
+            spent += time.perf_counter() - t0
+            properties = json_data['geojson']['properties']
+            optimal = properties['optimal']
+            if best is None or properties['score'] > best or optimal:
+                best = properties['score']
+                body = orjson.dumps(json_data)
+                yield sse("solution", body)
+            if optimal:
+                # same as an unlimited run
+                if cache:
+                    await asyncio.to_thread(cache.put, key, body)
+                break
+            if spent >= max_time or engine == "numpy":
+                break
+            budget *= 2
+        yield sse("done", b"{}")
+    except Exception as e:
+        # the response status is sent already
+        e = http_error(e)
+        logger.info(f"stream: {e.status_code} {e.detail}")
+        yield sse("error", orjson.dumps(
+            {"status": e.status_code, "detail": e.detail}))
+
+@app.post("/stream")
+async def stream(file: UploadFile = File(...),
+                 scoring: str = DEFAULT_RULESET,
+                 max_time: float = Query(SCORE_TIMEOUT, gt=0,
+                                         le=SCORE_TIMEOUT),
+                 tolerance: Optional[float] = Query(None, ge=0),
+                 interval: Optional[float] = Query(None, ge=0),
+                 engine: Engine = None):
+    """Score a flight, streams improving solutions as Server-Sent Events
+
+    event: solution, data: result as returned by POST /, with
+    geojson.properties.optimal; then event: done, or event: error with
+    data {"status": http status, "detail": "..."}.
+
+    max_time: seconds, total time budget
+    engine: as for POST /
+    """
+    if not is_igc(file.filename):
+        raise HTTPException(
+            status_code=400, # bad request
+            detail="File format not .igc or .igc.gz")
+    rulesets = parse_rulesets([scoring])
+    if len(rulesets) > 1:
+        raise HTTPException(
+            status_code=400, # bad request
+            detail="stream: scoring must be a single ruleset")
+    scoring, = rulesets
+    tolerance = DECIMATE_TOLERANCE if tolerance is None else tolerance
+    interval = DECIMATE_INTERVAL if interval is None else interval
+    engine = engine or ENGINE
+    if engine == "numpy" and scoring != "XContest":
+        raise HTTPException(
+            status_code=400, # bad request
+            detail="engine numpy: scoring must be XContest")
+
+    try:
+        data = await asyncio.to_thread(read_igc, file.file, file.filename,
+                                       MAX_UPLOAD_BYTES)
+        # rejected with a status code, not within the stream, the runs
+        # are admitted again one by one
+        limiter.admit()
+    except Exception as e:
+        raise http_error(e)
+    return StreamingResponse(
+        stream_solutions(data, scoring, max_time, tolerance, interval,
+                         engine),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+"""
+In-process XContest scorer, an alternative to the igc-xc-score binary.
+
+Scores free distance (start, 3 turnpoints, finish), free (flat) and FAI
+triangles, and their closed variants. The result has the layout of the
+igc-xc-score pipe output (geojson with launch0/land0, ep_start/ep_finish
+or cp_in/cp_out and tp0..tp2 point features, solution.bestSolution), so
+postprocess() applies unchanged.
+
+Distances: great circles of a sphere stretched to the degree lengths of
+the ellipsoid at the mean latitude of the flight (FCC formula, as the
+binary's), see _ellipsoid_scale(). Scores agree with the binary's to
+about 0.1%.
+
+Search, optimal up to SCORE_TOLERANCE on these distances: geojson
+properties.optimal is set only if the bound of everything not searched
+is within SCORE_TOLERANCE of the score, properties.bound is that bound
+otherwise (time or search size exceeded). Flights of more than
+MAX_FIXES fixes are thinned to MAX_FIXES evenly spaced fixes first,
+their scores are not optimal.
+- fixes are unit vectors, the bounding box of any index range comes
+  from a sparse table (O(1) range min/max), the distance between two
+  boxes is bounded from above and below
+- free distance: dynamic programming over groups of consecutive fixes.
+  Box bounds give, per group and position, an upper bound of the best
+  path through it; groups that cannot beat the best path found are
+  pruned, the others are split, until the groups are single fixes.
+- triangles: branch and bound over triples of index ranges, widest
+  range split first. Closing distances are bounded per range pair with
+  a prefix/suffix minimum of group to group distances. The convex hull
+  vertices seed the best triangle, the largest triangles have their
+  corners on the hull.
+
+Launch and landing are detected by ground speed, only the fixes in
+between are scored.
+"""
+
+import datetime
+import math
+import time
+from itertools import combinations_with_replacement
+
+import numpy as np
+
+from decimate import convex_hull
+from igc_xc_score_wrapper import postprocess
+from metrics import stage
+
+EARTH_RADIUS_KM = 6371.0
+
+# scores closer than this (km x multiplier) to the bound are optimal,
+# the binary rounds scores to 0.01
+SCORE_TOLERANCE = 0.005
+
+# launch/landing: moving if the path is faster than LAUNCH_SPEED m/s
+# over LAUNCH_WINDOW seconds
+LAUNCH_SPEED = 3.0
+LAUNCH_WINDOW = 30
+
+# fixes scored at most, beyond the flight is thinned. Bounds the sparse
+# tables, 2 x levels x n x 3 float64: 38 MB at 50000 fixes.
+MAX_FIXES = 50_000
+
+# search sizes: initial free distance groups and triangle ranges per
+# flight, group cap of the dynamic programming, node cap of the triangle
+# search, triangles evaluated per round, hull vertices seeding it.
+# Beyond a cap the best solution so far is returned, not optimal.
+FREE_GROUPS = 64
+TRIANGLE_GROUPS = 24
+MAX_GROUPS = 2048
+MAX_NODES = 500_000
+CANDIDATES = 16
+HULL_VERTICES = 120
+# fixes per group of the closing distance bounds, at most CLOSING_GROUPS
+CLOSING_GROUPS = 256
+# rows of the group pair matrices and triangle nodes per block of
+# vectorized bounds, their temporaries stay in the tens of MB
+PAIR_ROWS = 256
+NODE_ROWS = 65536
+
+# XContest: name, code, multiplier, closing distance limit relative to
+# the distance, minimum side relative to the distance
+TRIANGLES = [
+    ("Free Triangle", "tri", 1.2, 0.2, 0.0),
+    ("FAI Triangle", "fai", 1.4, 0.2, 0.28),
+    ("Closed Free Triangle", "tri", 1.4, 0.05, 0.0),
+    ("Closed FAI Triangle", "fai", 1.6, 0.05, 0.28),
+]
+FREE_FLIGHT = ("Free Flight", "od", 1.0)
+
+
+def _km(chord):
+    """Great circle distance of a unit sphere chord"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def _unit(lat, lon):
+    """Unit vectors of degree coordinates, (n, 3)"""
+    phi, lam = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam),
+                     np.sin(phi)], axis=1)
+
+
+def _ellipsoid_scale(lat, lon):
+    """Latitudes and longitudes stretched about their means, great circles
+    of EARTH_RADIUS_KM are then ellipsoidal distances
+
+    Degree lengths of the FCC formula at the mean latitude, the
+    east-west one follows the latitude through the cosine of the sphere.
+    """
+    lat0, lon0 = lat.mean(), lon.mean()
+    phi = math.radians(lat0)
+    # km per degree of latitude and of longitude
+    k1 = (111.13209 - 0.56605 * math.cos(2 * phi)
+          + 0.00120 * math.cos(4 * phi))
+    k2 = (111.41513 * math.cos(phi) - 0.09455 * math.cos(3 * phi)
+          + 0.00012 * math.cos(5 * phi))
+    sphere = EARTH_RADIUS_KM * math.pi / 180
+    return (lat0 + (lat - lat0) * k1 / sphere,
+            lon0 + (lon - lon0) * k2 / (sphere * math.cos(phi)))
+
+
+def _triples(count):
+    """Index triples i <= j <= k < count, (3, count**3 / 6)"""
+    out = np.array(list(combinations_with_replacement(range(count), 3)),
+                   dtype=int).reshape(-1, 3)
+    return out.T
+
+
+class _Track:
+    """Fixes of the flight and range bounding boxes
+
+    index: fix numbers in the igc file, thinned: not all fixes between
+    launch and landing
+    """
+
+    def __init__(self, t, lat, lon, index, thinned=False):
+        self.t = t
+        self.lat = lat
+        self.lon = lon
+        self.index = index
+        self.thinned = thinned
+        self.xyz = _unit(*_ellipsoid_scale(lat, lon))
+        self.n = n = len(t)
+
+        # sparse tables, level k: min/max over [i, i + 2**k)
+        levels = max(1, n.bit_length())
+        self._min = np.full((levels, n, 3), np.inf)
+        self._max = np.full((levels, n, 3), -np.inf)
+        self._min[0] = self._max[0] = self.xyz
+        for k in range(1, levels):
+            h = 1 << (k - 1)
+            m = n - (1 << k) + 1
+            if m <= 0:
+                break
+            self._min[k, :m] = np.minimum(self._min[k - 1, :m],
+                                          self._min[k - 1, h:h + m])
+            self._max[k, :m] = np.maximum(self._max[k - 1, :m],
+                                          self._max[k - 1, h:h + m])
+
+    def box(self, lo, hi):
+        """(min, max) corners of the boxes of fixes lo..hi inclusive"""
+        k = np.floor(np.log2(hi - lo + 1)).astype(int)
+        end = hi - (1 << k) + 1
+        return (np.minimum(self._min[k, lo], self._min[k, end]),
+                np.maximum(self._max[k, lo], self._max[k, end]))
+
+    def distance(self, i, j):
+        """km between fixes i and j"""
+        return _km(np.linalg.norm(self.xyz[i] - self.xyz[j], axis=-1))
+
+
+def _max_chord(a, b):
+    """Upper bound of the chord between points of boxes a and b"""
+    return np.linalg.norm(np.maximum(np.abs(a[1] - b[0]),
+                                     np.abs(b[1] - a[0])), axis=-1)
+
+
+def _min_chord(a, b):
+    """Lower bound of the chord between points of boxes a and b"""
+    gap = np.maximum(np.maximum(a[0] - b[1], b[0] - a[1]), 0.0)
+    return np.linalg.norm(gap, axis=-1)
+
+
+def _max_km(a, b):
+    """Upper bound of the km between points of boxes a and b"""
+    return _km(_max_chord(a, b))
+
+
+def _pairs(box, f, dtype=np.float64):
+    """f(box i, box j) for all pairs of groups, (m, m)
+
+    Computed in blocks of PAIR_ROWS rows.
+    """
+    m = len(box[0])
+    out = np.empty((m, m), dtype=dtype)
+    for i in range(0, m, PAIR_ROWS):
+        rows = slice(i, i + PAIR_ROWS)
+        out[rows] = f((box[0][rows, None], box[1][rows, None]),
+                      (box[0][None, :], box[1][None, :]))
+    return out
+
+
+def _groups(lo, hi, count):
+    """Split lo..hi inclusive into about count ranges"""
+    edges = np.unique(np.linspace(lo, hi + 1, count + 1).astype(int))
+    return edges[:-1], edges[1:] - 1
+
+
+def _split(lo, hi):
+    """Halves of the ranges, ranges of single fixes are kept as is"""
+    wide = hi > lo
+    mid = (lo[wide] + hi[wide]) // 2
+    return (np.concatenate([lo[~wide], lo[wide], mid + 1]),
+            np.concatenate([hi[~wide], mid, hi[wide]]))
+
+
+def _forward(W, legs):
+    """F[k][b]: best k-leg path ending in b, W[a, b] for a <= b"""
+    F = [np.zeros(len(W), dtype=W.dtype)]
+    for _ in range(legs):
+        F.append((F[-1][:, None] + W).max(axis=0))
+    return F
+
+
+def _backward(W, legs):
+    """B[k][a]: best path of the remaining legs - k legs, starting in a"""
+    B = [np.zeros(len(W), dtype=W.dtype)]
+    for _ in range(legs):
+        B.append((W + B[-1][None, :]).max(axis=1))
+    return B[::-1]
+
+
+def _best_path(W, legs):
+    """Vertices of the best path over W, a <= b"""
+    F = np.zeros(len(W), dtype=W.dtype)
+    args = []
+    for _ in range(legs):
+        S = F[:, None] + W
+        args.append(S.argmax(axis=0))
+        F = S[args[-1], np.arange(len(W))]
+    b = int(F.argmax())
+    path = [b]
+    for a in reversed(args):
+        b = int(a[b])
+        path.append(b)
+    return path[::-1]
+
+
+class _Search:
+    """Best solution of one flight"""
+
+    def __init__(self, track, deadline=None):
+        self.track = track
+        self.deadline = deadline
+        self.processed = 0
+        # score, solution dict
+        self.best = (-np.inf, None)
+        # upper bound of the solutions left unsearched
+        self.bound = -np.inf
+        self._closing = {}
+        # upper bound of any distance of the flight
+        box = track.box(0, track.n - 1)
+        self.diameter = float(_max_km(box, box))
+
+        # closing distance bounds, CL[a, c]: min over s in groups <= a,
+        # f in groups >= c
+        n = track.n
+        self.group = max(1, -(-n // CLOSING_GROUPS))
+        lo = np.arange(0, n, self.group)
+        hi = np.minimum(lo + self.group - 1, n - 1)
+        self._mind = _pairs(track.box(lo, hi), _min_chord)
+        cl = np.minimum.accumulate(self._mind, axis=0)
+        cl = np.minimum.accumulate(cl[:, ::-1], axis=1)[:, ::-1]
+        self._closing_bound = _km(cl)
+
+    def expired(self):
+        return (self.deadline is not None and
+                time.perf_counter() > self.deadline)
+
+    def unresolved(self, bound):
+        """Search stopped short, bound of the solutions it left"""
+        self.bound = max(self.bound, float(bound))
+
+    @property
+    def optimal(self):
+        return (not self.track.thinned and
+                self.bound <= self.lower + SCORE_TOLERANCE)
+
+    def offer(self, score, solution):
+        if score > self.best[0]:
+            self.best = (score, solution)
+
+    @property
+    def lower(self):
+        return self.best[0]
+
+    # free distance
+
+    def free_distance(self):
+        name, code, multiplier = FREE_FLIGHT
+        track = self.track
+        lo, hi = _groups(0, track.n - 1, FREE_GROUPS)
+        while True:
+            box = track.box(lo, hi)
+            upper = _pairs(box, _max_km, np.float32)
+            below = np.arange(len(lo))[:, None] > np.arange(len(lo))
+            upper[below] = -np.inf
+
+            # best path over one fix per group
+            reps = (lo + hi) // 2
+            rep = _pairs((track.xyz[reps], track.xyz[reps]), _max_km,
+                         np.float32)
+            rep[below] = -np.inf
+            del below
+            path = reps[_best_path(rep, 4)]
+            legs = track.distance(path[:-1], path[1:])
+            self.processed += len(lo)
+            distance = float(legs.sum())
+            self.offer(round(distance * multiplier, 2), {
+                "name": name, "code": code, "multiplier": multiplier,
+                "distance": distance, "penalty": 0, "closingDistance": None,
+                "fixes": [int(i) for i in path]})
+
+            F = _forward(upper, 4)
+            B = _backward(upper, 4)
+            bound = np.max([F[k] + B[k] for k in range(5)], axis=0)
+            del upper, rep, F, B
+            if bound.max() * multiplier <= self.lower + SCORE_TOLERANCE:
+                return
+            keep = bound * multiplier > self.lower + SCORE_TOLERANCE
+            lo, hi = _split(lo[keep], hi[keep])
+            order = np.argsort(lo, kind="stable")
+            lo, hi = lo[order], hi[order]
+            if len(lo) > MAX_GROUPS or self.expired():
+                self.unresolved(bound.max() * multiplier)
+                return
+
+    # triangles
+
+    def closing(self, t0, t2):
+        """Closing distance, (km, cp_in, cp_out): nearest s <= t0, f >= t2"""
+        key = (t0, t2)
+        if key in self._closing:
+            return self._closing[key]
+        g, xyz = self.group, self.track.xyz
+        a, c = t0 // g, t2 // g
+        mind = self._mind[:a + 1, c:]
+        best = (np.inf, t0, t2)
+        best_chord = np.inf
+        for flat in np.argsort(mind, axis=None):
+            i, j = divmod(int(flat), mind.shape[1])
+            if mind[i, j] >= best_chord:
+                break
+            s0, s1 = i * g, min((i + 1) * g, t0 + 1)
+            f0, f1 = max((j + c) * g, t2), min((j + c + 1) * g, self.track.n)
+            if s0 >= s1 or f0 >= f1:
+                continue
+            # unit vectors: chord**2 = 2 - 2 cos
+            cos = xyz[s0:s1] @ xyz[f0:f1].T
+            k = int(cos.argmax())
+            chord = math.sqrt(max(2 - 2 * cos.flat[k], 0.0))
+            if chord < best_chord:
+                best_chord = chord
+                best = (float(_km(best_chord)), s0 + k // (f1 - f0),
+                        f0 + k % (f1 - f0))
+        self._closing[key] = best
+        return best
+
+    def evaluate(self, rule, fixes):
+        """Offer the best valid triangle of fixes (N, 3), t0 <= t1 <= t2
+
+        Sides are exact and vectorized, the closing distance is bounded
+        first: exact closing distances are only searched for triangles
+        that can still beat the best solution, best bound first, until
+        the deadline.
+        """
+        name, code, multiplier, closing_limit, min_side = rule
+        self.processed += len(fixes)
+        t0, t1, t2 = fixes.T
+        sides = np.stack([self.track.distance(t0, t1),
+                          self.track.distance(t1, t2),
+                          self.track.distance(t2, t0)], axis=1)
+        distance = sides.sum(axis=1)
+        closing = self._closing_bound[t0 // self.group, t2 // self.group]
+        valid = ((distance > 0) & (sides.min(axis=1) >= min_side * distance)
+                 & (closing <= closing_limit * distance))
+        bound = np.where(valid, (distance - closing) * multiplier, -np.inf)
+        for i in np.argsort(-bound):
+            if bound[i] <= self.lower + SCORE_TOLERANCE:
+                return
+            if self.expired():
+                self.unresolved(bound[i])
+                return
+            closing, cp_in, cp_out = self.closing(int(t0[i]), int(t2[i]))
+            if closing > closing_limit * distance[i]:
+                continue
+            self.offer(round(float(distance[i] - closing) * multiplier, 2), {
+                "name": name, "code": code, "multiplier": multiplier,
+                "distance": float(distance[i]), "penalty": closing,
+                "closingDistance": closing,
+                "fixes": [cp_in, int(t0[i]), int(t1[i]), int(t2[i]),
+                          cp_out]})
+
+    def hull_triangles(self, rule):
+        """Seed: triangles of convex hull vertices
+
+        Skipped past the deadline, the triangle search covers them.
+        """
+        if self.expired():
+            return
+        track = self.track
+        x = np.radians(track.lon) * math.cos(np.radians(track.lat.mean()))
+        y = np.radians(track.lat)
+        points = list(zip(x.tolist(), y.tolist()))
+        hull = np.array(sorted(convex_hull(points)))
+        if len(hull) > HULL_VERTICES:
+            hull = hull[np.linspace(0, len(hull) - 1,
+                                    HULL_VERTICES).astype(int)]
+        if not self.expired():
+            self.evaluate(rule, hull[_triples(len(hull)).T])
+
+    def node_bounds(self, rule, lo, hi):
+        """Upper bound of the score of the triangles of the nodes
+
+        Infeasible nodes get -inf. Computed in blocks of NODE_ROWS nodes.
+        """
+        name, code, multiplier, closing_limit, min_side = rule
+        track = self.track
+        out = np.empty(len(lo))
+        for start in range(0, len(lo), NODE_ROWS):
+            rows = slice(start, start + NODE_ROWS)
+            nlo, nhi = lo[rows], hi[rows]
+            boxes = [track.box(nlo[:, k], nhi[:, k]) for k in range(3)]
+            pairs = [(0, 1), (1, 2), (2, 0)]
+            upper = np.stack([_max_km(boxes[i], boxes[j])
+                              for i, j in pairs], axis=1)
+            distance = upper.sum(axis=1)
+            closing = self._closing_bound[nhi[:, 0] // self.group,
+                                          nlo[:, 2] // self.group]
+            feasible = closing <= closing_limit * distance
+            if min_side:
+                lower = np.stack([_km(_min_chord(boxes[i], boxes[j]))
+                                  for i, j in pairs], axis=1)
+                feasible &= (upper >= min_side *
+                             lower.sum(axis=1)[:, None]).all(axis=1)
+            out[rows] = np.where(
+                feasible, (distance - closing) * multiplier, -np.inf)
+        return out
+
+    def triangle(self, rule):
+        track = self.track
+        self.hull_triangles(rule)
+
+        glo, ghi = _groups(0, track.n - 1, TRIANGLE_GROUPS)
+        a, b, c = _triples(len(glo))
+        lo = np.stack([glo[a], glo[b], glo[c]], axis=1)
+        hi = np.stack([ghi[a], ghi[b], ghi[c]], axis=1)
+
+        while len(lo):
+            bound = self.node_bounds(rule, lo, hi)
+
+            # most promising ones by their middle fixes, single fixes
+            # are exact
+            single = (lo == hi).all(axis=1)
+            top = np.argsort(-bound)[:CANDIDATES]
+            self.evaluate(rule, np.concatenate([
+                (lo[top] + hi[top]) // 2,
+                lo[single & (bound > self.lower + SCORE_TOLERANCE)]]))
+
+            keep = (bound > self.lower + SCORE_TOLERANCE) & ~single
+            if not keep.any():
+                return
+            if keep.sum() > MAX_NODES or self.expired():
+                self.unresolved(bound[keep].max())
+                return
+            lo, hi = lo[keep], hi[keep]
+
+            # split the widest range of each node
+            widest = (hi - lo).argmax(axis=1)
+            rows = np.arange(len(lo))
+            mid = (lo[rows, widest] + hi[rows, widest]) // 2
+            lo1, hi1 = lo.copy(), hi.copy()
+            hi1[rows, widest] = mid
+            lo2, hi2 = lo.copy(), hi.copy()
+            lo2[rows, widest] = mid + 1
+            lo = np.concatenate([lo1, lo2])
+            hi = np.concatenate([hi1, hi2])
+            # t0 <= t1 <= t2
+            for k in (1, 2):
+                lo[:, k] = np.maximum(lo[:, k], lo[:, k - 1])
+            for k in (1, 0):
+                hi[:, k] = np.minimum(hi[:, k], hi[:, k + 1])
+            valid = (lo <= hi).all(axis=1)
+            lo, hi = lo[valid], hi[valid]
+
+
+def parse_igc(data):
+    """Fix timestamps (ms since epoch), latitudes and longitudes
+
+    Raises:
+        ValueError: fewer than 5 fixes
+    """
+    date = datetime.date(1970, 1, 1)
+    lines = []
+    for line in bytes(data).splitlines():
+        if line[:1] == b"B" and len(line) >= 35:
+            lines.append(line[:35])
+        elif line[:5] == b"HFDTE":
+            digits = bytes(ch for ch in line[5:] if 48 <= ch <= 57)[:6]
+            if len(digits) == 6:
+                try:
+                    date = datetime.date(2000 + int(digits[4:6]),
+                                         int(digits[2:4]), int(digits[0:2]))
+                except ValueError:
+                    pass
+    if len(lines) < 5:
+        raise ValueError(f"igc: {len(lines)} fixes, too short to score")
+
+    b = np.frombuffer(b"".join(lines), dtype=np.uint8).reshape(-1, 35)
+    digit = b.astype(np.int64) - 48
+
+    def number(start, end):
+        out = np.zeros(len(b), dtype=np.int64)
+        for column in range(start, end):
+            out = out * 10 + digit[:, column]
+        return out
+
+    ok = ((digit[:, 1:14] >= 0) & (digit[:, 1:14] <= 9)).all(axis=1) & \
+         ((digit[:, 15:23] >= 0) & (digit[:, 15:23] <= 9)).all(axis=1)
+    seconds = number(1, 3) * 3600 + number(3, 5) * 60 + number(5, 7)
+    lat = number(7, 9) + number(9, 14) / 60000
+    lon = number(15, 18) + number(18, 23) / 60000
+    lat = np.where(b[:, 14] == ord("S"), -lat, lat)
+    lon = np.where(b[:, 23] == ord("W"), -lon, lon)
+    seconds, lat, lon = seconds[ok], lat[ok], lon[ok]
+    if len(seconds) < 5:
+        raise ValueError(f"igc: {len(seconds)} fixes, too short to score")
+
+    # midnight UTC rollovers
+    seconds = seconds + 86400 * np.cumsum(np.diff(seconds, prepend=seconds[0]) < 0)
+    epoch = datetime.datetime(date.year, date.month, date.day,
+                              tzinfo=datetime.timezone.utc).timestamp()
+    return (epoch + seconds) * 1000, lat, lon
+
+
+def _launch_landing(t, lat, lon):
+    """Index of launch and landing, by ground speed over a window"""
+    t = t / 1000
+    n = len(t)
+    xyz = _unit(lat, lon)
+    # path length, not displacement: circling in a thermal is flying
+    path = np.concatenate([[0.0], np.cumsum(
+        _km(np.linalg.norm(np.diff(xyz, axis=0), axis=1)))]) * 1000
+    j = np.minimum(np.searchsorted(t, t + LAUNCH_WINDOW), n - 1)
+    dt = np.maximum(t[j] - t, 1e-9)
+    moving = np.flatnonzero((path[j] - path) / dt > LAUNCH_SPEED)
+    if not len(moving) or j[moving[-1]] - moving[0] < 4:
+        return 0, n - 1
+    return int(moving[0]), int(j[moving[-1]])
+
+
+def _point(track, fid, name, i):
+    i = int(i)
+    return {"type": "Feature", "id": fid,
+            "properties": {"id": fid, "name": name,
+                           "r": int(track.index[i]),
+                           "timestamp": int(track.t[i])},
+            "geometry": {"type": "Point",
+                         "coordinates": [float(track.lon[i]),
+                                         float(track.lat[i])]}}
+
+
+def _line(track, fid, name, i, j):
+    return {"type": "Feature", "id": fid,
+            "properties": {"id": fid, "name": name,
+                           "d": float(track.distance(i, j))},
+            "geometry": {"type": "LineString",
+                         "coordinates": [[float(track.lon[k]),
+                                          float(track.lat[k])]
+                                         for k in (i, j)]}}
+
+
+def _geojson(track, score, solution, search, seconds):
+    """igc-xc-score pipe output layout, fix numbers of the igc file"""
+    fixes = solution["fixes"]
+    features = [_point(track, "launch0", "Launch", 0),
+                _point(track, "land0", "Landing", track.n - 1)]
+    if solution["closingDistance"] is None:
+        ids = ["ep_start", "tp0", "tp1", "tp2", "ep_finish"]
+        names = ["Start", "TP1", "TP2", "TP3", "Finish"]
+        legs = [("seg_in", 0, 1), ("tp0-tp1", 1, 2), ("tp1-tp2", 2, 3),
+                ("seg_out", 3, 4)]
+    else:
+        ids = ["cp_in", "tp0", "tp1", "tp2", "cp_out"]
+        names = ["Closing In", "TP1", "TP2", "TP3", "Closing Out"]
+        legs = [("tp0-tp1", 1, 2), ("tp1-tp2", 2, 3), ("tp2-tp0", 3, 1),
+                ("closing", 0, 4)]
+    features += [_point(track, fid, name, i)
+                 for fid, name, i in zip(ids, names, fixes)]
+    features += [_line(track, fid, fid, fixes[i], fixes[j])
+                 for fid, i, j in legs]
+
+    optimal = search.optimal
+    bound = score if optimal else round(max(search.bound, score), 2)
+    best = {"score": score, "distance": solution["distance"],
+            "multiplier": solution["multiplier"],
+            "penalty": solution["penalty"],
+            "closingDistance": solution["closingDistance"],
+            "optimal": optimal}
+    return {
+        "geojson": {
+            "type": "FeatureCollection",
+            "properties": {
+                "name": solution["name"], "id": solution["code"],
+                "score": score, "bound": bound,
+                "optimal": optimal,
+                "processedTime": seconds,
+                "processedSolutions": search.processed,
+                "type": "xc-score", "code": solution["code"]},
+            "features": features},
+        "solution": {"bestSolution": best},
+    }
+
+
+def solve(data, max_time=None):
+    """Best XContest solution of an igc file, igc-xc-score output layout
+
+    Args:
+        data: igc file content, bytes-like
+        max_time: seconds, best solution so far beyond, not optimal
+    """
+    t0 = time.perf_counter()
+    t, lat, lon = parse_igc(data)
+    launch, land = _launch_landing(t, lat, lon)
+    index = np.arange(launch, land + 1)
+    thinned = len(index) > MAX_FIXES
+    if thinned:
+        index = index[np.linspace(0, len(index) - 1,
+                                  MAX_FIXES).astype(int)]
+    flight = _Track(t[index], lat[index], lon[index], index, thinned)
+    del t, lat, lon
+
+    deadline = None if max_time is None else t0 + max_time
+    search = _Search(flight, deadline)
+    search.free_distance()
+    # highest multiplier first, its best solution prunes the others most
+    for rule in sorted(TRIANGLES, key=lambda rule: -rule[2]):
+        if search.expired():
+            # not searched, a triangle is shorter than 3 diameters
+            search.unresolved(3 * search.diameter * rule[2])
+            continue
+        search.triangle(rule)
+
+    score, solution = search.best
+    return _geojson(flight, score, solution, search,
+                    time.perf_counter() - t0)
+
+
+def numpy_xc_score(data, max_time=None):
+    """igc_xc_score() with the in-process scorer
+
+    Blocking, run it in a thread from async code.
+    """
+    with stage("xcscore_numpy"):
+        d = solve(data, max_time)
+    with stage("postprocess"):
+        return postprocess(d, max_time)
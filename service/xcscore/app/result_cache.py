@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of scoring results.
+
+Results are keyed by the SHA-256 of the IGC bytes plus everything else
+that determines the output: ruleset and scorer options, and the SHA-256
+of the igc-xc-score binary itself, so a new scorer release never serves
+results of the old one. Values are the serialized response bodies.
+
+Two tiers:
+- memory: LRU, evicted by total size in bytes
+- SQLite (optional): survives restarts. Entries of another scorer
+  binary are deleted when the database is opened.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(data: bytes, *parts: str) -> str:
+    """SHA-256 over the file content and the output-determining parts"""
+    h = hashlib.sha256(data)
+    for part in parts:
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier (memory LRU, optional SQLite) cache of response bodies.
+
+    Thread-safe, so that it can be used from a thread pool.
+    """
+
+    def __init__(self, max_bytes: int, db_path: Optional[str] = None,
+                 scorer: str = ""):
+        """
+        Args:
+            max_bytes: memory tier capacity, sum of cached body sizes
+            db_path: SQLite database file of the persistent tier, None
+                to disable
+            scorer: scorer binary fingerprint, the persistent tier is
+                cleared when it differs from the stored one
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, value BLOB, "
+                             "created REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta "
+                             "(name TEXT PRIMARY KEY, value TEXT)")
+            self._invalidate(scorer)
+
+    def _invalidate(self, scorer):
+        """Drop persisted results of another scorer binary"""
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE name = 'scorer'").fetchone()
+        if row and row[0] == scorer:
+            return
+        if row:
+            logger.info("scorer binary changed, clearing result cache")
+        self._db.execute("DELETE FROM results")
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES "
+                         "('scorer', ?)", (scorer,))
+
+    def _put_memory(self, key: str, value: bytes):
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            # larger than the whole tier, would only flush everything else
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Cached body for key, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            row = None
+            if self._db:
+                try:
+                    row = self._db.execute(
+                        "SELECT value FROM results WHERE key = ?",
+                        (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to read cache entry {key}: {e}")
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # promote to memory
+        value = bytes(row[0])
+        self._put_memory(key, value)
+        return value
+
+    def put(self, key: str, value: bytes):
+        """Store body under key in all tiers"""
+        self._put_memory(key, value)
+
+        if self._db:
+            with self._lock:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                        (key, value, time.time()))
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to write cache entry {key}: {e}")
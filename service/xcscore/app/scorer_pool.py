@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Pool of pre-started igc-xc-score processes.
+
+igc-xc-score is a bundled Node.js program: every run pays for process
+start and runtime/module initialization before the flight is even read,
+which dominates the latency of short flights. Its pipe mode scores
+exactly one flight per process (stdin until EOF, result on stdout), so
+the pool keeps processes started and initialized, blocked on stdin,
+and hands one out per request; a background thread starts the
+replacement. The job count per process is therefore always one.
+
+Health checks: idle processes that exited (crash, OOM kill) are dropped
+and replaced, processes idle for longer than max_idle are recycled.
+"""
+
+import logging
+import threading
+import time
+
+from igc_xc_score_wrapper import spawn
+
+logger = logging.getLogger(__name__)
+
+# seconds between health checks of the idle processes
+HEALTH_INTERVAL = 5.0
+
+
+class ScorerPool:
+    """Idle igc-xc-score processes, ready to receive a flight"""
+
+    def __init__(self, size: int, max_idle: float, spawn=spawn):
+        """
+        Args:
+            size: number of idle processes kept
+            max_idle: seconds after which an idle process is recycled
+            spawn: starts one process, see igc_xc_score_wrapper.spawn
+        """
+        self.size = size
+        self.max_idle = max_idle
+        self._spawn = spawn
+        # (started, process), oldest first
+        self._idle = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._maintain,
+                                        name="scorer-pool", daemon=True)
+        self._thread.start()
+
+    @property
+    def idle(self):
+        """Number of processes ready"""
+        return len(self._idle)
+
+    def acquire(self):
+        """A started process waiting for its flight on stdin
+
+        Falls back to starting one if none is ready, the caller owns
+        the process and must communicate() with it.
+        """
+        with self._cond:
+            while self._idle:
+                _, process = self._idle.pop(0)
+                if process.poll() is None:
+                    self._cond.notify()
+                    return process
+                self._dropped(process)
+            self._cond.notify()
+        logger.info("scorer pool empty, starting a process")
+        return self._spawn()
+
+    def _dropped(self, process):
+        logger.warning(f"idle igc-xc-score exited with "
+                       f"{process.returncode}, replacing it")
+        self._close(process)
+
+    @staticmethod
+    def _close(process):
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            if pipe:
+                pipe.close()
+
+    def _check(self):
+        """Drop exited and expired idle processes, with the lock held"""
+        now = time.monotonic()
+        keep = []
+        for started, process in self._idle:
+            if process.poll() is not None:
+                self._dropped(process)
+            elif now - started > self.max_idle:
+                self._close(process)
+            else:
+                keep.append((started, process))
+        self._idle = keep
+
+    def _maintain(self):
+        """Background thread, keeps size healthy idle processes"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                self._check()
+                missing = self.size - len(self._idle)
+                if missing <= 0:
+                    self._cond.wait(HEALTH_INTERVAL)
+                    continue
+            # started outside of the lock, acquire() does not wait for it
+            try:
+                process = self._spawn()
+            except OSError:
+                logger.error("cannot start igc-xc-score", exc_info=True)
+                with self._cond:
+                    self._cond.wait(HEALTH_INTERVAL)
+                continue
+            with self._cond:
+                if self._closed:
+                    self._close(process)
+                    return
+                self._idle.append((time.monotonic(), process))
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            for _, process in self._idle:
+                self._close(process)
+            self._idle = []
+            self._cond.notify()
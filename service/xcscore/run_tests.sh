@@ -8,10 +8,16 @@ fi
 source .venv/bin/activate
 pip install -r requirements.txt
 
+# modules shared by the services, e.g. metrics.py
+export PYTHONPATH="$(pwd)/../shared"
+
 # Start Uvicorn server in the background and save its PID
 cd ./app
 echo "Starting Uvicorn server..."
-uvicorn main:app --port 8080&
+# small upload limit and no queue, exercised by test_upload_limit and
+# test_admission
+XCSCORE_MAX_UPLOAD_BYTES=2097152 XCSCORE_CONCURRENCY=1 XCSCORE_MAX_QUEUE=0 \
+    uvicorn main:app --port 8080&
 UVICORN_PID=$!
 cd ..
 
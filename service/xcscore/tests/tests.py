@@ -1,6 +1,9 @@
+import gzip
 import json
+import time
 import unittest
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 class TestMicroservice(unittest.TestCase):
@@ -43,6 +46,283 @@ class TestMicroservice(unittest.TestCase):
             # check the response is JSON and contains the expected fields
             self.assertAlmostEqual(d['geojson']['properties']['score'], 208.94)
 
+    def test_cache(self):
+        """Second identical request is served from the result cache"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC', data)}
+        first = requests.post(self.url, files=file)
+        second = requests.post(self.url, files=file)
+        self.assertEqual(second.status_code,200)
+        self.assertEqual(second.headers['X-Cache'],'hit')
+        self.assertEqual(second.json(),first.json())
+
+    def test_rulesets(self):
+        """Several rulesets in one request, results keyed by ruleset"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC', data)}
+        response = requests.post(self.url, files=file,
+                                 params={'scoring': ['XContest', 'FFVL']})
+        self.assertEqual(response.status_code,200)
+        d = response.json()
+        self.assertEqual(list(d),['XContest', 'FFVL'])
+        for result in d.values():
+            self.assertIn('xc_speed_route', result['geojson']['properties'])
+        # same result as without ?scoring=
+        default = requests.post(self.url, files=file).json()
+        self.assertEqual(d['XContest'],default)
+
+        response = requests.post(self.url, files=file,
+                                 params={'scoring': 'NoSuchRuleset'})
+        self.assertEqual(response.status_code,400)
+
+    def test_decimation(self):
+        """Fix decimation, and its verification mode"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC', data)}
+        response = requests.post(self.url, files=file,
+                                 params={'tolerance': 5})
+        self.assertEqual(response.status_code,200)
+        self.assertAlmostEqual(response.json()['geojson']['properties']['score'], 0.93, delta=0.05)
+
+        response = requests.post(self.url, files=file,
+                                 params={'tolerance': 5, 'verify': 'true'})
+        self.assertEqual(response.status_code,200)
+        d = response.json()
+        self.assertLess(d['fixes_decimated'],d['fixes'])
+        report = d['rulesets']['XContest']
+        self.assertAlmostEqual(report['score'], 0.93)
+        self.assertLess(abs(report['score_delta']), 0.05)
+        self.assertGreater(report['speedup'], 0)
+
+        # nothing to verify without decimation
+        response = requests.post(self.url, files=file,
+                                 params={'verify': 'true'})
+        self.assertEqual(response.status_code,400)
+
+    def test_max_time(self):
+        """Time budget, the solution is flagged optimal or not"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            file = {'file': f, }
+            response = requests.post(self.url, files=file,
+                                     params={'max_time': 10})
+        self.assertEqual(response.status_code,200)
+        properties = response.json()['geojson']['properties']
+        self.assertTrue(properties['optimal'])
+        self.assertAlmostEqual(properties['score'], 0.93)
+
+    def test_stream(self):
+        """Server-Sent Events, improving solutions then done"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            file = {'file': f, }
+            response = requests.post(self.url + "stream", files=file,
+                                     params={'max_time': 10}, stream=True)
+            self.assertEqual(response.status_code,200)
+            self.assertTrue(response.headers['content-type'].startswith('text/event-stream'))
+            events = [m.split('\n') for m in response.text.strip().split('\n\n')]
+        self.assertEqual(events[-1][0],'event: done')
+        self.assertEqual(events[-2][0],'event: solution')
+        d = json.loads(events[-2][1].removeprefix('data: '))
+        self.assertTrue(d['geojson']['properties']['optimal'])
+        self.assertAlmostEqual(d['geojson']['properties']['score'], 0.93)
+
+        # Content-Encoding: gzip request
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            request = requests.Request('POST', self.url + "stream",
+                                       files={'file': f},
+                                       params={'max_time': 10}).prepare()
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request, stream=True, timeout=30)
+        self.assertEqual(response.status_code,200)
+        events = [m.split('\n') for m in response.text.strip().split('\n\n')]
+        self.assertEqual(events[-1][0],'event: done')
+        # the event loop is still serving
+        response = requests.get(self.url, timeout=1)
+        self.assertEqual(response.status_code,200)
+
+        # one ruleset per stream
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            response = requests.post(self.url + "stream", files={'file': f},
+                                     params={'scoring': 'XContest,FFVL'})
+        self.assertEqual(response.status_code,400)
+
+    def test_numpy_engine(self):
+        """In-process scorer, same response layout"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            file = {'file': f, }
+            response = requests.post(self.url, files=file,
+                                     params={'engine': 'numpy'})
+        self.assertEqual(response.status_code,200)
+        properties = response.json()['geojson']['properties']
+        self.assertTrue(properties['optimal'])
+        for key in ['score', 'distance', 'airtime', 'xc_speed_route']:
+            self.assertIn(key, properties)
+
+        # ellipsoidal distances as the binary's, within 0.1%
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            response = requests.post(self.url, files={'file': f},
+                                     params={'engine': 'numpy'})
+        self.assertEqual(response.status_code,200)
+        result = response.json()['geojson']['properties']
+        self.assertTrue(result['optimal'])
+        self.assertAlmostEqual(result['score'], 208.94, delta=0.21)
+
+        # the time budget holds, the solution is not proven then
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            started = time.perf_counter()
+            response = requests.post(self.url, files={'file': f},
+                                     params={'engine': 'numpy',
+                                             'max_time': 0.05})
+            elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code,200)
+        result = response.json()['geojson']['properties']
+        self.assertFalse(result['optimal'])
+        self.assertGreaterEqual(result['bound'], result['score'])
+        self.assertLess(elapsed, 2)
+
+        # XContest only
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            response = requests.post(self.url, files={'file': f},
+                                     params={'engine': 'numpy',
+                                             'scoring': 'FFVL'})
+        self.assertEqual(response.status_code,400)
+
+        # honoured by /stream and ?verify=true too
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            response = requests.post(self.url + "stream", files={'file': f},
+                                     params={'engine': 'numpy',
+                                             'max_time': 10})
+        self.assertEqual(response.status_code,200)
+        events = [m.split('\n') for m in response.text.strip().split('\n\n')]
+        self.assertEqual([e[0] for e in events],
+                         ['event: solution', 'event: done'])
+        d = json.loads(events[0][1].removeprefix('data: '))
+        self.assertEqual(d['geojson']['properties']['score'],
+                         properties['score'])
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            response = requests.post(self.url, files={'file': f},
+                                     params={'engine': 'numpy',
+                                             'tolerance': 5,
+                                             'verify': 'true'})
+        self.assertEqual(response.status_code,200)
+        report = response.json()['rulesets']['XContest']
+        self.assertEqual(report['score'], properties['score'])
+
+    def test_numpy_parity(self):
+        """numpy engine and igc-xc-score agree on the bundled files"""
+        app = Path(__file__).resolve().parents[1] / 'app'
+        if not any((app / name).is_file() for name in
+                   ('igc-xc-score-linux', 'igc-xc-score-macos')):
+            self.skipTest("igc-xc-score binary not found")
+        for name in ['valid_xctracer_mini_v.IGC', 'valid_xctrack.igc']:
+            with open(self.testdata_dir / name,'rb') as f:
+                data = f.read()
+            scores = []
+            for engine in ['binary', 'numpy']:
+                response = requests.post(self.url, params={'engine': engine},
+                                         files={'file': (name, data)})
+                self.assertEqual(response.status_code,200)
+                scores.append(response.json()['geojson']['properties']['score'])
+            # within 0.1%, see numpy_scorer, and 0.01 rounding
+            self.assertAlmostEqual(scores[1], scores[0],
+                                   delta=max(0.02, 0.001 * scores[0]))
+
+    def test_compressed_upload(self):
+        """.igc.gz file and Content-Encoding: gzip request body"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        file = {'file': ('valid_xctracer_mini_v.IGC.gz', gzip.compress(data)), }
+        response = requests.post(self.url, files=file)
+        self.assertEqual(response.status_code,200)
+        self.assertAlmostEqual(response.json()['geojson']['properties']['score'], 0.93)
+
+        request = requests.Request('POST', self.url, files={
+            'file': ('valid_xctracer_mini_v.IGC', data)}).prepare()
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,200)
+        self.assertAlmostEqual(response.json()['geojson']['properties']['score'], 0.93)
+
+        file = {'file': ('broken.igc.gz', gzip.compress(data)[:100]), }
+        response = requests.post(self.url, files=file)
+        self.assertEqual(response.status_code,400)
+
+    def test_pool(self):
+        """Repeated requests through the pre-started process pool"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            data = f.read()
+        for _ in range(4):
+            response = requests.post(self.url, files={
+                'file': ('valid_xctracer_mini_v.IGC', data)})
+            self.assertEqual(response.status_code,200)
+            self.assertAlmostEqual(response.json()['geojson']['properties']['score'], 0.93)
+
+    def test_admission(self):
+        """429 beyond XCSCORE_CONCURRENCY + XCSCORE_MAX_QUEUE (1 + 0 in
+        run_tests.sh), the event loop stays responsive meanwhile"""
+        with open(self.testdata_dir / 'valid_xctrack.igc','rb') as f:
+            data = f.read()
+        def post(_):
+            return requests.post(self.url, files={
+                'file': ('valid_xctrack.igc', data)})
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(post, i) for i in range(4)]
+            # not blocked by the running optimization
+            response = requests.get(self.url, timeout=1)
+            self.assertEqual(response.status_code,200)
+            status = sorted(f.result().status_code for f in futures)
+        self.assertEqual(status[0],200)
+        self.assertEqual(status[-1],429)
+
+    def test_upload_limit(self):
+        """413 beyond XCSCORE_MAX_UPLOAD_BYTES (2 MiB in run_tests.sh)"""
+        big = b'B' * (3 * 2**20)
+        response = requests.post(self.url, files={'file': ('big.igc', big)})
+        self.assertEqual(response.status_code,413)
+
+        # decompressed size counts
+        file = {'file': ('big.igc.gz', gzip.compress(big))}
+        response = requests.post(self.url, files=file)
+        self.assertEqual(response.status_code,413)
+
+        # Content-Encoding: gzip request body, decompressed size counts
+        request = requests.Request('POST', self.url, files={
+            'file': ('big.igc', big)}).prepare()
+        request.prepare_body(gzip.compress(request.body), None)
+        request.headers['Content-Encoding'] = 'gzip'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,413)
+
+        # transfer-encoding: chunked, no Content-Length
+        request = requests.Request('POST', self.url, files={
+            'file': ('big.igc', big)}).prepare()
+        response = requests.post(self.url, data=iter([request.body]),
+                                 headers={'Content-Type':
+                                          request.headers['Content-Type']})
+        self.assertEqual(response.status_code,413)
+
+        request = requests.Request('POST', self.url, files={
+            'file': ('small.igc', b'B')}).prepare()
+        request.headers['Content-Length'] = 'many'
+        response = requests.Session().send(request)
+        self.assertEqual(response.status_code,400)
+
+    def test_metrics(self):
+        """Prometheus metrics, igc-xc-score subprocess wall time"""
+        with open(self.testdata_dir / 'valid_xctracer_mini_v.IGC','rb') as f:
+            response = requests.post(self.url, files={'file': f})
+            self.assertEqual(response.status_code,200)
+
+        response = requests.get(self.url + "metrics")
+        self.assertEqual(response.status_code,200)
+        self.assertIn('stage_duration_seconds_count{stage="xcscore"}', response.text)
+        self.assertIn('http_request_duration_seconds_bucket', response.text)
+        self.assertIn('xcscore_pool_idle_processes', response.text)
+
     def test_invalid(self):
         """Invalid igc file
         